@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Optional, Set, TextIO
+from pydantic import ValidationError
+from app.config import settings
+from app.utils.data_validation import ResponseRequest
+from app.utils.logger import get_logger
+from app.routers.responses.services import generate_item
+
+# Put on the work queue once per worker when the input is exhausted.
+_DONE = object()
+
+
+def count_lines(path: str) -> int:
+    """Counts the lines of a file in 1MB chunks, including a last line without a newline."""
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (last != b"\n")
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class BatchRunner:
+    """
+    Generates the responses to a JSONL file of ResponseRequest records.
+
+    The input is streamed line by line; at most `concurrency` items are generated at
+    a time, through the same service path as POST /responses/batch (rate limit,
+    scheduler, caches, storage). Each result is appended to the output file as soon
+    as it is ready, in completion order, as `{"line", "response"}` or
+    `{"line", "error"}` (plus `custom_id` when the input record had one; invalid lines
+    are 400/422 errors). Blank lines are skipped.
+
+    Progress is checkpointed every `checkpoint_interval` seconds: the first line not
+    yet done with its byte offset in the input, the lines done after it, and the
+    length of the (fsynced) output. A rerun with the same arguments seeks the input
+    to that offset, recovers the results written after the checkpoint from the
+    output's tail and only generates what is left. Without a checkpoint file the
+    whole output is scanned instead.
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        checkpoint_path: Optional[str] = None,
+        concurrency: int = settings.BATCH_MAX_CONCURRENCY,
+        user: str = "batch",
+        priority: str = "batch",
+        max_wait: Optional[float] = None,
+        checkpoint_interval: float = 5.0,
+        progress_interval: float = 10.0,
+        progress: TextIO = sys.stderr,
+    ):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+        self.concurrency = concurrency
+        self.user = user
+        self.priority = priority
+        self.max_wait = max_wait
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self.progress = progress
+        self.next_line = 0  # Every line before this one is done
+        self.input_offset = 0  # Byte offset of `next_line` in the input
+        self.done: Set[int] = set()  # Lines done after `next_line`
+        self._offsets: Dict[int, int] = {}  # Byte offset of each line read and not yet passed
+        self._output = None
+        self.total = 0
+        self.resumed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.started = 0.0
+
+    def _load_checkpoint(self) -> int:
+        """Restores progress; returns the output length the checkpoint vouches for."""
+        if not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint["input"] != os.path.abspath(self.input_path):
+            raise ValueError(f"{self.checkpoint_path} belongs to {checkpoint['input']}")
+        self.next_line = checkpoint["next_line"]
+        self.input_offset = checkpoint["input_offset"]
+        self.done = set(checkpoint["done"])
+        self.succeeded = checkpoint["succeeded"]
+        self.failed = checkpoint["failed"]
+        return checkpoint["output_offset"]
+
+    def _recover_output(self, offset: int) -> None:
+        """Marks the lines of results written after the checkpoint as done and cuts a torn last line."""
+        if not os.path.exists(self.output_path):
+            return
+        with open(self.output_path, "r+b") as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # Crashed mid-write: the item is generated again
+                record = json.loads(raw)
+                if record["line"] >= self.next_line and record["line"] not in self.done:
+                    self.done.add(record["line"])
+                    if "error" in record:
+                        self.failed += 1
+                    else:
+                        self.succeeded += 1
+                offset += len(raw)
+            f.truncate(offset)
+
+    def _save_checkpoint(self) -> None:
+        self._output.flush()
+        os.fsync(self._output.fileno())  # The checkpoint never vouches for results that could be lost
+        checkpoint = {
+            "input": os.path.abspath(self.input_path),
+            "next_line": self.next_line,
+            "input_offset": self.input_offset,
+            "done": sorted(self.done),
+            "output_offset": self._output.tell(),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _advance(self) -> None:
+        # Only past lines already read, so that `input_offset` stays the offset of `next_line`
+        while self.next_line in self.done and self.next_line + 1 in self._offsets:
+            self.done.remove(self.next_line)
+            del self._offsets[self.next_line]
+            self.next_line += 1
+            self.input_offset = self._offsets[self.next_line]
+
+    def _mark_done(self, line: int) -> None:
+        self.done.add(line)
+        self._advance()
+
+    def _write(self, line: int, custom_id: Any, result: Dict[str, Any]) -> None:
+        record = {"line": line, **({"custom_id": custom_id} if custom_id is not None else {}), **result}
+        self._output.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        if "error" in result:
+            self.failed += 1
+        else:
+            self.succeeded += 1
+        self._mark_done(line)
+
+    async def _read(self, queue: asyncio.Queue) -> None:
+        line, offset = self.next_line, self.input_offset
+        self._offsets[line] = offset
+        with open(self.input_path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                offset += len(raw)
+                self._offsets[line + 1] = offset
+                if line in self.done:
+                    self._advance()  # Recovered from the output
+                else:
+                    await self._dispatch(queue, line, raw)
+                line += 1
+        for _ in range(self.concurrency):
+            await queue.put(_DONE)
+
+    async def _dispatch(self, queue: asyncio.Queue, line: int, raw: bytes) -> None:
+        if not raw.strip():
+            self._mark_done(line)
+            return
+        custom_id = None
+        try:
+            record = json.loads(raw)
+            custom_id = record.pop("custom_id", None) if isinstance(record, dict) else None
+            request = ResponseRequest(**record)
+        except (ValueError, TypeError) as e:
+            status = 422 if isinstance(e, ValidationError) else 400
+            detail = json.loads(e.json()) if isinstance(e, ValidationError) else f"Invalid JSON: {e}"
+            self._write(line, custom_id, {"error": {"status_code": status, "detail": detail}})
+            return
+        await queue.put((line, custom_id, request))
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            line, custom_id, request = item
+            result = await generate_item(request, self.user, self.priority, self.max_wait)
+            self._write(line, custom_id, result)
+
+    async def _every(self, interval: float, fn) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            fn()
+
+    def report(self) -> str:
+        done = self.succeeded + self.failed
+        processed = done - self.resumed
+        elapsed = time.monotonic() - self.started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        # Blank lines count towards the total but produce no result
+        remaining = max(0, self.total - self.next_line - len(self.done))
+        eta = format_duration(remaining / rate) if rate > 0 else "?"
+        percent = 100.0 * (self.total - remaining) / self.total if self.total else 100.0
+        return (
+            f"{done}/{self.total} lines ({percent:.1f}%) | {self.failed} errors | "
+            f"{rate:.1f} req/s | elapsed {format_duration(elapsed)} | ETA {eta}"
+        )
+
+    def _print_progress(self) -> None:
+        print(self.report(), file=self.progress, flush=True)
+
+    async def run(self) -> Dict[str, int]:
+        """
+        Processes the input (what is left of it, when resuming).
+
+        Returns:
+            `{"succeeded", "failed", "total"}` counts over the whole file.
+        """
+        self._recover_output(self._load_checkpoint())
+        self.resumed = self.succeeded + self.failed
+        self.total = count_lines(self.input_path)
+        self.started = time.monotonic()
+        if self.resumed:
+            get_logger().info("Resuming %s at line %d (%d results kept)", self.input_path, self.next_line, self.resumed)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        with open(self.output_path, "ab") as self._output:
+            background = [
+                asyncio.ensure_future(self._every(self.checkpoint_interval, self._save_checkpoint)),
+                asyncio.ensure_future(self._every(self.progress_interval, self._print_progress)),
+            ]
+            tasks = [asyncio.ensure_future(self._read(queue))]
+            tasks += [asyncio.ensure_future(self._work(queue)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks + background:
+                    task.cancel()
+                self._save_checkpoint()  # Also on Ctrl-C or an error: the rerun picks up from here
+                self._print_progress()
+        return {"succeeded": self.succeeded, "failed": self.failed, "total": self.total}
+
+
+async def main(argv=None) -> int:
+    from app.main import shutdown, startup
+
+    parser = argparse.ArgumentParser(prog="python -m app.batch", description="Generate responses for a JSONL file")
+    parser.add_argument("input", help="JSONL file of ResponseRequest records (optionally with a custom_id)")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=settings.BATCH_MAX_CONCURRENCY)
+    parser.add_argument("--user", default="batch", help="rate-limit key the items are accounted to")
+    parser.add_argument("--priority", default="batch", help="scheduler priority class")
+    parser.add_argument("--max-wait", type=float, help="seconds an item waits for rate-limit budget")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0)
+    parser.add_argument("--progress-interval", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    runner = BatchRunner(
+        args.input,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        concurrency=args.concurrency,
+        user=args.user,
+        priority=args.priority,
+        max_wait=args.max_wait,
+        checkpoint_interval=args.checkpoint_interval,
+        progress_interval=args.progress_interval,
+    )
+    await startup()
+    try:
+        await runner.run()
+    finally:
+        await shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    # python -m app.batch requests.jsonl responses.jsonl: rerun the same command to resume
+    sys.exit(asyncio.run(main()))
@@ -1,22 +1,55 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-import os
 from app.config import settings
 
 # Define the SQLAlchemy base class for database models
 Base = declarative_base()
 
-# Create the SQLAlchemy engine using the database connection string
-engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
 
-# Create a session factory to create database sessions
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def async_database_url(url: str) -> str:
+    """
+    Maps a sync DATABASE_URL onto its asyncio driver (asyncpg / aiosqlite).
+
+    Args:
+        url: The configured database URL.
+
+    Returns:
+        The URL to hand to `create_async_engine`.
+    """
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+def engine_options(url: str) -> dict:
+    """
+    Returns the pool configuration from Settings. SQLite does not take pool sizing.
+    """
+    options = {
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+# Create the async SQLAlchemy engine using the database connection string
+DATABASE_URL = async_database_url(settings.DATABASE_URL)
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+# Create a session factory to create (async) database sessions
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Dependency function to inject a database session into API routes
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
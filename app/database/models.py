@@ -1,29 +1,89 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Index, Integer, LargeBinary, String, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship
 from app.database import Base  # Importing the Base class from our database module
+from app.database.types import CompressedText, JSONDocument, content_hash
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, nullable=False)
     api_key = Column(String, nullable=False)
+    prompts = relationship("Prompt", back_populates="user")
+
+class PromptBlob(Base):
+    __tablename__ = "prompt_blobs"
+    # Prompt bodies stored once per distinct text, keyed by its hash (app/routers/prompts/services.py)
+    hash = Column(LargeBinary(32), primary_key=True)
+    text = Column(CompressedText, nullable=False)
 
 class Prompt(Base):
     __tablename__ = "prompts"
+    # Keyset pagination of GET /prompts, filtered by user or model (newest first)
+    __table_args__ = (
+        Index("ix_prompts_user_id_id", "user_id", "id"),
+        Index("ix_prompts_model_id", "model", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, nullable=False)
+    blob_hash = Column(LargeBinary(32), ForeignKey("prompt_blobs.hash", name="fk_prompts_blob_hash"), nullable=False)
     model = Column(String, nullable=False)
-    parameters = Column(String)
+    parameters = Column(JSONDocument)  # Sampling parameters as a JSON object
+    token_count = Column(Integer)  # Prompt tokens, counted locally (app/utils/tokenizer.py)
     user_id = Column(Integer, ForeignKey("users.id"))
     user = relationship("User", back_populates="prompts")
     responses = relationship("Response", back_populates="prompt")
+    blob = relationship("PromptBlob", lazy="joined")
+    # `prompt.text` reads through the blob. Assigning it creates a new blob, so writers that may
+    # repeat a text go through app.routers.prompts.services.prompt_blobs instead
+    text = association_proxy("blob", "text", creator=lambda text: PromptBlob(hash=content_hash(text), text=text))
 
 class Response(Base):
     __tablename__ = "responses"
+    # Keyset pagination of GET /responses and GET /prompts/{id}/responses (newest first)
+    __table_args__ = (
+        Index("ix_responses_generation_time_id", "generation_time", "id"),
+        Index("ix_responses_model_generation_time_id", "model", "generation_time", "id"),
+        Index("ix_responses_prompt_id_generation_time_id", "prompt_id", "generation_time", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, nullable=False)
+    text = Column(CompressedText, nullable=False)
     model = Column(String, nullable=False)
-    parameters = Column(String)
+    parameters = Column(JSONDocument)  # Sampling parameters as a JSON object
     generation_time = Column(DateTime, nullable=False)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
     prompt_id = Column(Integer, ForeignKey("prompts.id"))
-    prompt = relationship("Prompt", back_populates="responses")
\ No newline at end of file
+    prompt = relationship("Prompt", back_populates="responses")
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+    # Keyset pagination of a user's conversations (newest first)
+    __table_args__ = (Index("ix_conversations_user_id_id", "user_id", "id"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    model = Column(String, nullable=False)
+    system_prompt = Column(CompressedText)
+    summary = Column(CompressedText)  # Running summary of the turns folded out of the context window
+    summarized_turns = Column(Integer, nullable=False, default=0)  # Turns before this position are in `summary`
+    turn_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    turns = relationship("ConversationTurn", back_populates="conversation", order_by="ConversationTurn.position")
+
+class ConversationTurn(Base):
+    __tablename__ = "conversation_turns"
+    # One row per position; a concurrent writer appending the same position fails on it
+    __table_args__ = (UniqueConstraint("conversation_id", "position", name="uq_conversation_turns_conversation_id_position"),)
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
+    position = Column(Integer, nullable=False)  # 0-based turn number within the conversation
+    prompt_id = Column(Integer, ForeignKey("prompts.id"), nullable=False)  # The user message
+    # No foreign key: `responses` is partitioned on Postgres (its key includes generation_time) and
+    # write-behind rows get their id after the turn is stored, so this may be None
+    response_id = Column(Integer)
+    # The reply is kept with the turn: history reads stay on this table, and survive the
+    # retirement of old `responses` partitions
+    reply = Column(CompressedText, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False)  # The user message alone, not its context
+    reply_tokens = Column(Integer, nullable=False)
+    conversation = relationship("Conversation", back_populates="turns")
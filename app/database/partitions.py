@@ -0,0 +1,213 @@
+import asyncio
+import re
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from app.config import settings
+from app.database import engine
+from app.utils.logger import get_logger
+
+# Arbitrary constant key of the Postgres advisory lock that lets only one worker run
+# maintenance at a time.
+MAINTENANCE_LOCK_KEY = 0x7265737073  # "resps"
+
+ARCHIVE_SCHEMA = "archive"
+
+# Partitions of `responses` in the current schema, with their bound expressions, e.g.
+# "FOR VALUES FROM ('2024-05-01 00:00:00') TO ('2024-06-01 00:00:00')".
+PARTITIONS_QUERY = """
+SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+FROM pg_inherits
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE pg_inherits.inhparent = to_regclass('responses')
+"""
+
+_UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"responses_p{start:%Y_%m}"
+
+
+def create_partition_sql(start: datetime) -> str:
+    """
+    Returns the DDL creating the monthly partition of `responses` starting at `start`.
+
+    Args:
+        start: First instant of the month.
+
+    Returns:
+        An idempotent CREATE TABLE ... PARTITION OF statement.
+    """
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF responses "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{add_months(start, 1):%Y-%m-%d %H:%M:%S}')"
+    )
+
+
+def upper_bound(bound: str) -> Optional[datetime]:
+    """
+    Returns the exclusive upper bound of a partition, or None for the default
+    partition or an unbounded (MAXVALUE) one.
+
+    Args:
+        bound: The partition bound as rendered by `pg_get_expr`.
+    """
+    match = _UPPER_BOUND_RE.search(bound)
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+def plan_maintenance(
+    partitions: List[Tuple[str, str]], now: datetime, months_ahead: int, retention_months: int
+) -> Tuple[List[datetime], List[str]]:
+    """
+    Decides which monthly partitions to create and which to retire.
+
+    Args:
+        partitions: (name, bound expression) of the existing partitions.
+        now: The current time.
+        months_ahead: Months after the current one that must already have a partition.
+        retention_months: Whole months of data to keep besides the current one (0 keeps everything).
+
+    Returns:
+        The start of each missing month, and the names of partitions holding only data
+        older than the retention window.
+    """
+    bounds = {name: upper_bound(bound) for name, bound in partitions}
+    covered_until = max((bound for bound in bounds.values() if bound is not None), default=None)
+    current = month_start(now)
+    missing = [
+        start
+        for start in (add_months(current, i) for i in range(months_ahead + 1))
+        if covered_until is None or start >= covered_until
+    ]
+    expired = []
+    if retention_months > 0:
+        cutoff = add_months(current, -retention_months)
+        expired = sorted(name for name, bound in bounds.items() if bound is not None and bound <= cutoff)
+    return missing, expired
+
+
+async def maintain_partitions(
+    conn,
+    now: Optional[datetime] = None,
+    months_ahead: int = settings.RESPONSES_PARTITION_MONTHS_AHEAD,
+    retention_months: int = settings.RESPONSES_RETENTION_MONTHS,
+    archive: bool = settings.RESPONSES_RETENTION_ARCHIVE,
+) -> Dict[str, List[str]]:
+    """
+    Creates the partitions of the coming months and retires expired ones.
+
+    Retiring a partition is a catalog operation: it is dropped, or with `archive`
+    detached and moved to the "archive" schema (to be dumped and dropped later).
+    That costs the same however many rows it holds, unlike a mass DELETE. Does
+    nothing unless `responses` is a partitioned Postgres table, or when another
+    worker holds the maintenance lock.
+
+    Args:
+        conn: An AsyncConnection inside a transaction.
+        now: The current time (UTC, like `generation_time`).
+        months_ahead: See `settings.RESPONSES_PARTITION_MONTHS_AHEAD`.
+        retention_months: See `settings.RESPONSES_RETENTION_MONTHS`.
+        archive: See `settings.RESPONSES_RETENTION_ARCHIVE`.
+
+    Returns:
+        `{"created": [...], "retired": [...]}` partition names.
+    """
+    result = {"created": [], "retired": []}
+    if conn.dialect.name != "postgresql":
+        return result
+    kind = await conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('responses')"))
+    if kind != "p":
+        return result
+    if not await conn.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}):
+        return result
+    partitions = [tuple(row) for row in await conn.execute(text(PARTITIONS_QUERY))]
+    missing, expired = plan_maintenance(partitions, now or datetime.utcnow(), months_ahead, retention_months)
+    for start in missing:
+        await conn.execute(text(create_partition_sql(start)))
+        result["created"].append(partition_name(start))
+    for name in expired:
+        if archive:
+            await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+            await conn.execute(text(f"ALTER TABLE responses DETACH PARTITION {name}"))
+            await conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        else:
+            await conn.execute(text(f"DROP TABLE {name}"))
+        result["retired"].append(name)
+    return result
+
+
+class PartitionMaintainer:
+    """
+    Background task running `maintain_partitions` at startup and then every
+    `interval` seconds, so inserts always find a partition for the current month.
+    Only started on Postgres.
+    """
+
+    def __init__(self, interval: float = settings.PARTITION_MAINTENANCE_INTERVAL, bind=engine):
+        self.interval = interval
+        self.bind = bind
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.created = 0
+        self.retired = 0
+        self.failures = 0
+
+    async def start(self) -> None:
+        if self.bind.dialect.name != "postgresql" or self._task is not None:
+            return
+        await self.run_once()  # The current month's partition must exist before serving
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    async def run_once(self) -> Dict[str, List[str]]:
+        try:
+            async with self.bind.begin() as conn:
+                result = await maintain_partitions(conn)
+        except Exception as e:
+            self.failures += 1
+            get_logger().error("Partition maintenance failed: %s", e)
+            return {"created": [], "retired": []}
+        self.runs += 1
+        self.created += len(result["created"])
+        self.retired += len(result["retired"])
+        if result["created"] or result["retired"]:
+            get_logger().info("Partition maintenance: created=%s retired=%s", result["created"], result["retired"])
+        return result
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"runs": self.runs, "created": self.created, "retired": self.retired, "failures": self.failures}
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+if __name__ == "__main__":
+    # python -m app.database.partitions: one maintenance pass, e.g. from cron
+    async def main():
+        result = await partition_maintainer.run_once()
+        await engine.dispose()
+        print(result)
+        return 1 if partition_maintainer.failures else 0
+
+    sys.exit(asyncio.run(main()))
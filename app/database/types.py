@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import sys
+import zlib
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import JSON, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator
+from app.config import settings
+
+# First byte of every stored value: how the rest of it is encoded. Values written with a
+# dictionary carry its 4-byte id next, so a rotated dictionary can still read old rows.
+RAW = 0
+ZLIB = 1
+ZLIB_DICT = 2
+ZSTD = 3
+ZSTD_DICT = 4
+
+# JSON on every backend, binary JSONB on Postgres (indexable, no re-parse on read); None is SQL NULL.
+JSONDocument = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+
+def content_hash(text: str) -> bytes:
+    """The 32-byte address of a text in content-addressed storage (see PromptBlob)."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=32).digest()
+
+
+def dictionary_id(dictionary: bytes) -> bytes:
+    return zlib.crc32(dictionary).to_bytes(4, "big")
+
+
+def _zstd():
+    import zstandard
+
+    return zstandard
+
+
+class TextCodec:
+    """
+    Encodes text for storage: UTF-8 as is below `min_bytes`, compressed above it.
+
+    `kind` is "auto" (zstd when the zstandard package is installed, zlib otherwise),
+    "zstd", "zlib" or "none" (never compress; still reads compressed values). Either
+    codec can use a shared dictionary trained on past texts (`train_dictionary`), which
+    is what makes short completions compress at all: only the first of `dictionaries`
+    is used to write, the others are kept to read rows written before a rotation. zlib
+    uses the last 32KB of a dictionary file as its preset dictionary, so a zstd-trained
+    file also serves when zstandard is missing, with less benefit.
+
+    Not thread-safe (the zstd contexts are shared); the app encodes on its event loop.
+    """
+
+    def __init__(
+        self,
+        kind: str = settings.TEXT_COMPRESSION,
+        min_bytes: int = settings.TEXT_COMPRESSION_MIN_BYTES,
+        level: int = settings.TEXT_COMPRESSION_LEVEL,
+        dictionaries: Iterable[bytes] = (),
+    ):
+        if kind == "auto":
+            try:
+                _zstd()
+                kind = "zstd"
+            except ImportError:
+                kind = "zlib"
+        if kind not in ("zstd", "zlib", "none"):
+            raise ValueError(f"Unknown TEXT_COMPRESSION: {kind}")
+        self.kind = kind
+        self.min_bytes = min_bytes
+        self.level = level
+        self.dictionaries: Dict[bytes, bytes] = {}
+        self.write_dictionary: Optional[bytes] = None
+        for dictionary in dictionaries:
+            self.dictionaries[dictionary_id(dictionary)] = dictionary
+            if self.write_dictionary is None:
+                self.write_dictionary = dictionary_id(dictionary)
+        self._zstd_contexts = {}
+
+    @classmethod
+    def from_settings(cls) -> "TextCodec":
+        dictionaries = []
+        for path in filter(None, (p.strip() for p in settings.TEXT_COMPRESSION_DICT.split(","))):
+            with open(path, "rb") as f:
+                dictionaries.append(f.read())
+        return cls(dictionaries=dictionaries)
+
+    def _zstd_context(self, dict_id: Optional[bytes], compress: bool):
+        key = (dict_id, compress)
+        if key not in self._zstd_contexts:
+            zstandard = _zstd()
+            params = {}
+            if dict_id is not None:
+                params["dict_data"] = zstandard.ZstdCompressionDict(self.dictionaries[dict_id])
+            if compress:
+                self._zstd_contexts[key] = zstandard.ZstdCompressor(level=self.level, **params)
+            else:
+                self._zstd_contexts[key] = zstandard.ZstdDecompressor(**params)
+        return self._zstd_contexts[key]
+
+    def encode(self, value: str) -> bytes:
+        """
+        Encodes one text value.
+
+        Args:
+            value: The text to store.
+
+        Returns:
+            The tagged bytes. Compressed output that is not smaller than the raw text
+            is discarded, so a value never grows by more than the tag byte.
+        """
+        raw = value.encode("utf-8")
+        if self.kind == "none" or len(raw) < self.min_bytes:
+            return bytes([RAW]) + raw
+        dict_id = self.write_dictionary
+        if self.kind == "zstd":
+            body = self._zstd_context(dict_id, compress=True).compress(raw)
+            header = bytes([ZSTD]) if dict_id is None else bytes([ZSTD_DICT]) + dict_id
+        else:
+            if dict_id is None:
+                compressor = zlib.compressobj(self.level)
+                header = bytes([ZLIB])
+            else:
+                compressor = zlib.compressobj(self.level, zdict=self.dictionaries[dict_id][-32768:])
+                header = bytes([ZLIB_DICT]) + dict_id
+            body = compressor.compress(raw) + compressor.flush()
+        if len(header) + len(body) >= len(raw):
+            return bytes([RAW]) + raw
+        return header + body
+
+    def decode(self, stored: bytes) -> str:
+        """
+        Decodes bytes written by `encode`, with any codec or known dictionary.
+
+        Raises:
+            ValueError: Unknown tag, or a dictionary that is no longer configured.
+        """
+        tag, body = stored[0], stored[1:]
+        if tag == RAW:
+            return body.decode("utf-8")
+        dict_id = None
+        if tag in (ZLIB_DICT, ZSTD_DICT):
+            dict_id, body = body[:4], body[4:]
+            if dict_id not in self.dictionaries:
+                raise ValueError(f"Text compressed with unknown dictionary {dict_id.hex()} (see TEXT_COMPRESSION_DICT)")
+        if tag in (ZSTD, ZSTD_DICT):
+            return self._zstd_context(dict_id, compress=False).decompress(body).decode("utf-8")
+        if tag == ZLIB:
+            return zlib.decompress(body).decode("utf-8")
+        if tag == ZLIB_DICT:
+            decompressor = zlib.decompressobj(zdict=self.dictionaries[dict_id][-32768:])
+            return (decompressor.decompress(body) + decompressor.flush()).decode("utf-8")
+        raise ValueError(f"Unknown text encoding tag {tag}")
+
+
+def train_dictionary(samples: List[str], size: int = 65536) -> bytes:
+    """
+    Trains a zstd dictionary on sample texts (requires the zstandard package).
+
+    Args:
+        samples: Representative prompt or response texts, ideally thousands.
+        size: Dictionary size in bytes.
+
+    Returns:
+        The dictionary, to be saved to a file listed in TEXT_COMPRESSION_DICT.
+    """
+    zstandard = _zstd()
+    return zstandard.train_dictionary(size, [sample.encode("utf-8") for sample in samples]).as_bytes()
+
+
+text_codec = TextCodec.from_settings()
+
+
+class CompressedText(TypeDecorator):
+    """
+    A text column stored as tagged bytes by `text_codec`: large values are compressed,
+    small ones stored as UTF-8. Reads and writes plain str, so the ORM and queries
+    selecting the column are unchanged; the column cannot be filtered or indexed on.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else text_codec.encode(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value  # str: a row not yet converted by migration 0004
+        return text_codec.decode(bytes(value))
+
+
+if __name__ == "__main__":
+    # python -m app.database.types <out file> [samples]: trains a dictionary on recent responses
+    async def main(out: str, samples: int):
+        from sqlalchemy import select
+        from app.database import engine
+        from app.database.models import Response
+
+        async with engine.connect() as conn:
+            texts = (await conn.execute(select(Response.text).order_by(Response.id.desc()).limit(samples))).scalars().all()
+        await engine.dispose()
+        dictionary = train_dictionary(list(texts))
+        with open(out, "wb") as f:
+            f.write(dictionary)
+        print(f"trained a {len(dictionary)} byte dictionary on {len(texts)} responses: {out}")
+
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10000))
@@ -0,0 +1,167 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import insert
+from app.config import settings
+from app.database import SessionLocal
+from app.database.models import Response
+from app.utils.logger import get_logger
+from app.utils.metrics import DB_COMMIT_LATENCY
+
+# Put on the queue by stop() to tell the drain task to flush what it has and exit.
+_STOP = object()
+
+
+class ResponseWriter:
+    """
+    Write-behind pipeline for generated responses.
+
+    Rows are put on a bounded asyncio queue and a background task writes them with one
+    multi-row INSERT per batch (SQLAlchemy's executemany/insertmanyvalues path). A batch
+    is flushed when it reaches `batch_size` rows or `flush_interval` seconds after its
+    first row, whichever comes first. When the queue is full, `submit` waits up to
+    `put_timeout` seconds and then rejects the request with a 503. A failed flush is
+    retried `max_attempts` times in all, `retry_backoff` seconds apart (doubling), before
+    the batch is dropped and counted in `dropped_rows`.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = settings.WRITE_BEHIND_QUEUE_SIZE,
+        batch_size: int = settings.WRITE_BEHIND_BATCH_SIZE,
+        flush_interval: float = settings.WRITE_BEHIND_FLUSH_INTERVAL,
+        put_timeout: float = settings.WRITE_BEHIND_PUT_TIMEOUT,
+        max_attempts: int = settings.WRITE_BEHIND_MAX_ATTEMPTS,
+        retry_backoff: float = settings.WRITE_BEHIND_RETRY_BACKOFF,
+        session_factory=SessionLocal,
+    ):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.retries = 0
+        self.dropped_rows = 0
+        self.rejected_rows = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        """
+        Starts the background drain task on the running event loop.
+        """
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def submit(self, row: Dict[str, Any]) -> None:
+        """
+        Queues one `responses` row for insertion.
+
+        Args:
+            row: Column values for the new row.
+
+        Raises:
+            HTTPException: 503 when the queue stays full for `put_timeout` seconds.
+        """
+        if not self.running:
+            await self.start()  # e.g. scripts that never ran the startup hook
+        try:
+            await asyncio.wait_for(self._queue.put(row), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_rows += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Response write queue is full",
+                headers={"Retry-After": "1"},
+            )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    async with self.session_factory() as db:
+                        with DB_COMMIT_LATENCY.labels("responses").time():
+                            await db.execute(insert(Response), batch)
+                            await db.commit()
+                    self.flushed_rows += len(batch)
+                    return
+                except Exception as e:
+                    if attempt >= self.max_attempts:
+                        self.dropped_rows += len(batch)
+                        get_logger().error(
+                            "Write-behind flush of %d responses failed %d times, dropping them: %s",
+                            len(batch), attempt, e,
+                        )
+                        return
+                    delay = self.retry_backoff * 2 ** (attempt - 1)
+                    get_logger().warning(
+                        "Write-behind flush of %d responses failed, retrying in %.2fs: %s", len(batch), delay, e
+                    )
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+        finally:
+            self.flushes += 1
+            self.last_flush_latency = time.perf_counter() - start
+            self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+
+    async def stop(self) -> None:
+        """
+        Flushes everything still queued and stops the drain task.
+        """
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "retries": self.retries,
+            "dropped_rows": self.dropped_rows,
+            "rejected_rows": self.rejected_rows,
+            "last_flush_ms": round(self.last_flush_latency * 1000, 3),
+            "max_flush_ms": round(self.max_flush_latency * 1000, 3),
+        }
+
+
+response_writer = ResponseWriter()
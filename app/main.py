@@ -1,9 +1,27 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import text
 from app.database import engine
-from app.routers import prompts, responses
-from app.utils.logger import get_logger
+from app.database.write_behind import response_writer
+from app.database.partitions import partition_maintainer
+from app.routers import conversations, prompts, responses
+from app.routers.conversations.services import conversation_store
+from app.routers.prompts.services import prompt_blobs
+from app.utils.logger import configure_logging, get_logger, shutdown_logging
 from app.utils.error_handler import handle_exception
-from app.utils.auth import authenticate_user  # (If JWT authentication is implemented)
+from app.utils.auth import authenticate_user, token_cache  # (If JWT authentication is implemented)
+from app.utils.openai_client import init_openai_client, close_openai_client
+from app.providers import provider_registry
+from app.utils.metrics import AUTH_LATENCY, MetricsMiddleware, loop_lag_monitor, register_stats, render_metrics
+from app.utils.cache import response_cache
+from app.utils.semantic_cache import semantic_cache
+from app.utils.rate_limit import rate_limiter
+from app.utils.resilience import upstream
+from app.utils.singleflight import single_flight
+from app.utils.tokenizer import tokenizer
+from app.utils.scheduler import scheduler
+from app.utils.redis_client import close_redis
 from fastapi.middleware.cors import CORSMiddleware  # (If CORS is needed)
 from app.config import settings
 
@@ -22,7 +40,16 @@ app.add_middleware(
 # Initialize database connection (using SQLAlchemy)
 @app.on_event("startup")
 async def startup():
-    await database.connect(settings.DATABASE_URL)
+    configure_logging(settings.LOG_LEVEL)  # JSON lines written off the event loop by a listener thread
+    async with engine.connect() as conn:  # Fail fast if the database is unreachable
+        await conn.execute(text("SELECT 1"))
+    await init_openai_client()  # Shared pooled upstream client
+    await partition_maintainer.start()  # Postgres: partitions of the coming months, retention
+    await loop_lag_monitor.start()  # Samples event_loop_lag_seconds
+    if settings.WRITE_BEHIND_ENABLED:
+        await response_writer.start()  # Batched background inserts of responses
+    if semantic_cache.enabled:
+        await semantic_cache.load()  # Warm start from the last snapshot
     logger = get_logger(settings.LOG_LEVEL)  # Initialize the logger
     logger.info("Application Startup - Database Connected")
 
@@ -30,30 +57,72 @@ async def startup():
 # Close database connection
 @app.on_event("shutdown")
 async def shutdown():
-    await database.disconnect()
+    logger = get_logger(settings.LOG_LEVEL)
+    await response_writer.stop()  # Flush queued responses before the pool goes away
+    await partition_maintainer.stop()
+    await loop_lag_monitor.stop()
+    if semantic_cache.enabled:
+        await semantic_cache.save()  # Snapshot the index for the next warm start
+    await engine.dispose()  # Close pooled database connections
+    await provider_registry.close()  # Clients owned by non-default backends
+    await close_openai_client()
+    await close_redis()
     logger.info("Application Shutdown - Database Disconnected")
+    shutdown_logging()  # Drain queued records before the process exits
 
 
 # Include API routers
 app.include_router(prompts.router)
 app.include_router(responses.router)
+app.include_router(conversations.router)
+
+
+# Prometheus scrape endpoint (left unauthenticated; restrict access at the network level)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+# Counters the components already keep, read at scrape time
+register_stats("response_cache", response_cache.stats)
+register_stats("semantic_cache", semantic_cache.stats)
+register_stats("single_flight", single_flight.stats)
+register_stats("response_writer", response_writer.stats)
+register_stats("partition_maintenance", partition_maintainer.stats)
+register_stats("rate_limit", rate_limiter.stats)
+register_stats("upstream", upstream.stats)
+register_stats("token_count_cache", tokenizer.stats)
+register_stats("prompt_blob_cache", prompt_blobs.stats)
+register_stats("conversation_cache", conversation_store.stats)
+register_stats("event_loop_lag", loop_lag_monitor.stats)
+register_stats("admission", scheduler.stats)
+register_stats("auth_cache", lambda: {"hits": token_cache.hits, "misses": token_cache.misses})
 
 
 # Implement JWT authentication middleware (if needed)
 @app.middleware("http")
 async def auth_middleware(request: Request, call_next):
-    if settings.DEBUG:
+    if settings.DEBUG or request.url.path == "/metrics":
         response = await call_next(request)
         return response
     else:
+        start = time.perf_counter()
         try:
-            await authenticate_user(request)  # Authenticate user
-            response = await call_next(request)
-            return response
+            # Cached per token (see app/utils/auth.py); handlers read request.state.user
+            request.state.user = await authenticate_user(request)
         except Exception as e:
             logger = get_logger(settings.LOG_LEVEL)
-            logger.error(f"Authentication Error: {e}")
-            raise HTTPException(status_code=401, detail="Unauthorized")
+            logger.error("Authentication Error: %s", e)
+            return JSONResponse(status_code=401, content={"detail": "Unauthorized"})
+        finally:
+            AUTH_LATENCY.observe(time.perf_counter() - start)
+        response = await call_next(request)
+        return response
+
+
+# Outermost middleware, so its latency histogram includes authentication
+app.add_middleware(MetricsMiddleware)
 
 
 # Define exception handler
@@ -63,8 +132,9 @@ async def exception_handler(request: Request, exc: Exception):
     return handle_exception(exc, logger, request)
 
 
-# Start the application
+# Start a single development server (reloading on code changes with DEBUG); in production
+# run `gunicorn app.main:app`, configured by gunicorn.conf.py
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=settings.DEBUG)
\ No newline at end of file
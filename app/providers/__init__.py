@@ -0,0 +1,4 @@
+from .base import CompletionStream, Provider
+from .echo import EchoProvider
+from .openai_compatible import OpenAIProvider
+from .registry import ProviderRegistry, build_registry, provider_registry
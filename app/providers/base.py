@@ -0,0 +1,60 @@
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+
+class CompletionStream:
+    """
+    Provider-neutral stream of completion text deltas.
+
+    Iterating yields the text of each delta; `close()` releases the upstream connection
+    and must be called once the caller is done, whether or not the stream was exhausted.
+    """
+
+    def __init__(self, deltas: AsyncIterator[str], close: Optional[Callable[[], Awaitable[None]]] = None):
+        self._deltas = deltas
+        self._close = close
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._deltas
+
+    async def close(self) -> None:
+        if self._close is not None:
+            await self._close()
+
+
+class Provider:
+    """
+    Base class of completion backends. A provider is registered in the
+    `ProviderRegistry` for the model names it serves.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def complete(self, request, timeout: float) -> str:
+        """
+        Generates the full completion for a ResponseRequest.
+
+        Args:
+            request: The validated ResponseRequest.
+            timeout: Seconds this attempt may take.
+
+        Returns:
+            The completion text.
+        """
+        raise NotImplementedError
+
+    async def open_stream(self, request, timeout: float) -> CompletionStream:
+        """
+        Starts a streamed completion for a ResponseRequest.
+
+        Args:
+            request: The validated ResponseRequest.
+            timeout: Seconds opening the stream may take.
+
+        Returns:
+            A CompletionStream of text deltas.
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Releases the provider's resources (connection pools, ...)."""
@@ -0,0 +1,28 @@
+import asyncio
+from typing import AsyncIterator
+from .base import CompletionStream, Provider
+
+
+class EchoProvider(Provider):
+    """
+    In-process backend that answers with the prompt itself after `latency` seconds.
+    Useful for local development, load tests and as a last-resort fallback in tests.
+    """
+
+    def __init__(self, name: str = "echo", latency: float = 0.0):
+        super().__init__(name)
+        self.latency = latency
+
+    async def complete(self, request, timeout: float) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return request.prompt
+
+    async def open_stream(self, request, timeout: float) -> CompletionStream:
+        async def deltas() -> AsyncIterator[str]:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            for index, word in enumerate(request.prompt.split(" ")):
+                yield word if index == 0 else " " + word
+
+        return CompletionStream(deltas())
@@ -0,0 +1,68 @@
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional
+from app.config import settings
+from app.utils.openai_client import build_openai_client, get_openai_client
+from .base import CompletionStream, Provider
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+def chat_arguments(request) -> Dict[str, Any]:
+    """Chat completion arguments of a ResponseRequest: its earlier messages, then the prompt."""
+    return {
+        "model": request.model,
+        "messages": [
+            *(request.context or ()),
+            {"role": "user", "content": request.prompt}
+        ],
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens,
+        "top_p": request.top_p,
+        "frequency_penalty": request.frequency_penalty,
+        "presence_penalty": request.presence_penalty,
+        # ... (Add any other model-specific parameters)
+    }
+
+
+class OpenAIProvider(Provider):
+    """
+    Any backend speaking the OpenAI chat completions API (OpenAI itself, vLLM, Azure
+    proxies, ...). Without `base_url`/`api_key` it uses the process-wide client from
+    app/utils/openai_client.py; otherwise it owns a pooled client of its own.
+    """
+
+    def __init__(self, name: str = "openai", base_url: Optional[str] = None, api_key: Optional[str] = None):
+        super().__init__(name)
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client: Optional["AsyncOpenAI"] = None
+
+    def client(self) -> "AsyncOpenAI":
+        if self.base_url is None and self.api_key is None:
+            return get_openai_client()
+        if self._client is None:
+            self._client = build_openai_client(base_url=self.base_url, api_key=self.api_key)
+        return self._client
+
+    async def complete(self, request, timeout: float) -> str:
+        response = await self.client().chat.completions.create(
+            **chat_arguments(request), timeout=min(timeout, settings.OPENAI_TIMEOUT)
+        )
+        return response.choices[0].message.content
+
+    async def open_stream(self, request, timeout: float) -> CompletionStream:
+        stream = await self.client().chat.completions.create(
+            **chat_arguments(request), timeout=min(timeout, settings.OPENAI_TIMEOUT), stream=True
+        )
+
+        async def deltas() -> AsyncIterator[str]:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        return CompletionStream(deltas(), stream.close)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
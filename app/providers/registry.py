@@ -0,0 +1,206 @@
+import asyncio
+import json
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.metrics import UPSTREAM_LATENCY
+from app.utils.resilience import ResilientCaller, CircuitOpenError, DeadlineExceeded, is_retryable, upstream
+from app.utils.scheduler import remaining_budget
+from .base import CompletionStream, Provider
+from .echo import EchoProvider
+from .openai_compatible import OpenAIProvider
+
+# Used when settings.PROVIDERS is empty: the models the service always accepted, on OpenAI.
+DEFAULT_PROVIDERS = [
+    {"name": "openai", "type": "openai", "models": ["text-davinci-003", "gpt-3.5-turbo", "gpt-4"]},
+]
+
+# The in-process echo model is for tests and load tests: it is only added to the defaults
+# with DEBUG, otherwise it has to be listed in settings.PROVIDERS.
+DEBUG_PROVIDERS = [
+    {"name": "echo", "type": "echo", "models": ["echo"]},
+]
+
+PROVIDER_TYPES = {"openai": OpenAIProvider, "echo": EchoProvider}
+
+
+class Route(NamedTuple):
+    provider: Provider
+    weight: float
+
+
+class ProviderRegistry:
+    """
+    Maps model names to the backends serving them and routes each request to the
+    best one.
+
+    Backends are ranked by rolling p50 latency divided by their weight, with
+    backends whose circuit is open and those with a high recent error rate moved to
+    the back. A backend without samples yet ranks first so it gets measured. When a
+    backend fails with a transient error (after the retries of `ResilientCaller`),
+    the next one is tried within the same deadline.
+    """
+
+    def __init__(self, caller: ResilientCaller = upstream, error_window: int = 100):
+        self.caller = caller
+        self.error_window = error_window
+        self._routes: Dict[str, List[Route]] = {}
+        self._providers: Dict[str, Provider] = {}
+        self._outcomes: Dict[str, deque] = {}
+
+    def register(self, provider: Provider, models: List[str], weight: float = 1.0) -> None:
+        """
+        Registers a backend for the given models.
+
+        Args:
+            provider: The backend.
+            models: Model names it serves.
+            weight: Routing preference; a backend with weight 2 is picked over one with
+                weight 1 until it is twice as slow.
+        """
+        self._providers[provider.name] = provider
+        for model in models:
+            self._routes.setdefault(model, []).append(Route(provider, weight))
+
+    def models(self) -> List[str]:
+        return sorted(self._routes)
+
+    def serves(self, model: str) -> bool:
+        return model in self._routes
+
+    def _key(self, provider: Provider, model: str) -> str:
+        return f"{provider.name}:{model}"
+
+    def error_rate(self, provider: Provider, model: str) -> float:
+        outcomes = self._outcomes.get(self._key(provider, model))
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def _record(self, provider: Provider, model: str, ok: bool) -> None:
+        key = self._key(provider, model)
+        outcomes = self._outcomes.get(key)
+        if outcomes is None:
+            outcomes = self._outcomes[key] = deque(maxlen=self.error_window)
+        outcomes.append(ok)
+
+    def routes(self, model: str) -> List[Route]:
+        """
+        Returns the backends serving `model`, best first.
+
+        Args:
+            model: The requested model.
+
+        Returns:
+            The ordered routes; empty when no backend serves the model.
+        """
+
+        def rank(route: Route):
+            key = self._key(route.provider, model)
+            unhealthy = self.caller.breaker(key).state == "open" or self.error_rate(route.provider, model) > 0.5
+            latency = self.caller.latencies(key).percentile(50) or 0.0
+            return unhealthy, latency / route.weight
+
+        return sorted(self._routes.get(model, []), key=rank)
+
+    async def _route(self, model: str, attempt: Callable[[Provider, float], Awaitable[Any]], hedge: Optional[bool]):
+        logger = get_logger()
+        loop = asyncio.get_running_loop()
+        budget_end = loop.time() + remaining_budget(self.caller.deadline)  # What queueing left of it
+        routes = self.routes(model)
+        if not routes:
+            raise ValueError(f"No provider serves model {model}")
+        last_error: Optional[Exception] = None
+        for route in routes:
+            remaining = budget_end - loop.time()
+            if remaining <= 0:
+                break
+            start = loop.time()
+            try:
+                result = await self.caller.call(
+                    self._key(route.provider, model),
+                    lambda timeout, provider=route.provider: attempt(provider, timeout),
+                    deadline=remaining,
+                    hedge=hedge,
+                )
+            except CircuitOpenError as e:
+                last_error = e
+                continue
+            except Exception as e:
+                UPSTREAM_LATENCY.labels(route.provider.name, model, "error").observe(loop.time() - start)
+                if not (isinstance(e, DeadlineExceeded) or is_retryable(e)):
+                    raise
+                self._record(route.provider, model, False)
+                logger.warning("Provider %s failed for %s, trying next: %s", route.provider.name, model, e)
+                last_error = e
+                continue
+            UPSTREAM_LATENCY.labels(route.provider.name, model, "ok").observe(loop.time() - start)
+            self._record(route.provider, model, True)
+            return result
+        raise last_error or DeadlineExceeded(f"No answer from {model} within the request budget")
+
+    async def complete(self, request) -> str:
+        """
+        Generates the completion text on the best backend for `request.model`.
+
+        Args:
+            request: The validated ResponseRequest.
+
+        Returns:
+            The completion text.
+        """
+        return await self._route(request.model, lambda provider, timeout: provider.complete(request, timeout), None)
+
+    async def open_stream(self, request) -> CompletionStream:
+        """
+        Opens a completion stream on the best backend; only opening is retried, and
+        streams are never hedged.
+
+        Args:
+            request: The validated ResponseRequest.
+
+        Returns:
+            A CompletionStream of text deltas.
+        """
+        return await self._route(request.model, lambda provider, timeout: provider.open_stream(request, timeout), False)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for model, routes in self._routes.items():
+            for route in routes:
+                key = self._key(route.provider, model)
+                stats[key] = {
+                    "weight": route.weight,
+                    "p50_ms": round((self.caller.latencies(key).percentile(50) or 0.0) * 1000, 3),
+                    "error_rate": round(self.error_rate(route.provider, model), 3),
+                    "circuit": self.caller.breaker(key).state,
+                }
+        return stats
+
+    async def close(self) -> None:
+        for provider in self._providers.values():
+            await provider.close()
+
+
+def build_registry(config: str = settings.PROVIDERS, debug: bool = settings.DEBUG) -> ProviderRegistry:
+    """
+    Builds the registry from `settings.PROVIDERS`.
+
+    Args:
+        config: JSON list of backends, each with "name", "type" ("openai" or "echo"),
+            "models", and optionally "weight" plus type-specific options ("base_url",
+            "api_key" for openai, "latency" for echo). Empty for `DEFAULT_PROVIDERS`.
+        debug: Adds `DEBUG_PROVIDERS` to the defaults (ignored when `config` is set).
+
+    Returns:
+        A ProviderRegistry with every configured backend registered.
+    """
+    registry = ProviderRegistry()
+    entries = json.loads(config) if config else DEFAULT_PROVIDERS + (DEBUG_PROVIDERS if debug else [])
+    for entry in entries:
+        options = {k: v for k, v in entry.items() if k not in ("type", "models", "weight")}
+        provider = PROVIDER_TYPES[entry["type"]](**options)
+        registry.register(provider, entry["models"], entry.get("weight", 1.0))
+    return registry
+
+
+provider_registry = build_registry()
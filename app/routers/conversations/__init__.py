@@ -0,0 +1 @@
+from .routes import router  # Routes are defined in routes.py
@@ -0,0 +1,2 @@
+# The ORM classes are declared once, on the shared Base, in app/database/models.py
+from app.database.models import Conversation, ConversationTurn  # noqa: F401
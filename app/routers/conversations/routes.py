@@ -0,0 +1,127 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response as HTTPResponse
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.utils.auth import principal_id
+from app.utils.logger import get_logger
+from app.utils.data_validation import (
+    ConversationCreate,
+    ConversationMessage,
+    ConversationOut,
+    ConversationPage,
+    ConversationReply,
+    TurnPage,
+)
+from app.utils.pagination import decode_cursor, page
+from app.utils.rate_limit import user_key
+from app.utils.scheduler import resolve_priority
+from app.config import settings
+from app.database.models import Prompt, PromptBlob
+from app.routers.responses.routes import _request_timeout
+from .models import Conversation, ConversationTurn
+from .services import conversation_store, send_message
+
+router = APIRouter(
+    prefix="/conversations",
+    tags=["conversations"],
+    responses={404: {"description": "Conversation not found"}},
+)
+
+def _owned_by(user_id: Optional[int]):
+    # Without authentication (DEBUG) conversations have no user and are shared
+    return Conversation.user_id == user_id if user_id is not None else Conversation.user_id.is_(None)
+
+async def _get_conversation(db: AsyncSession, conversation_id: int, user_id: Optional[int]) -> Conversation:
+    conversation = await db.get(Conversation, conversation_id)
+    if conversation is None or conversation.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+@router.post("/", response_model=ConversationOut)
+async def create_conversation(conversation: ConversationCreate, http_request: Request, db: AsyncSession = Depends(get_db)):
+    now = datetime.utcnow()
+    db_conversation = Conversation(
+        user_id=principal_id(http_request),
+        model=conversation.model,
+        system_prompt=conversation.system_prompt,
+        summarized_turns=0,
+        turn_count=0,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(db_conversation)
+    await db.commit()
+    await db.refresh(db_conversation)
+    get_logger().info("Created conversation: id=%s model=%s", db_conversation.id, db_conversation.model)
+    return db_conversation
+
+# The caller's conversations, newest first, keyset-paginated on id
+@router.get("/", response_model=ConversationPage)
+async def read_conversations(
+    http_request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_SIZE, ge=1, le=settings.PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    after = decode_cursor(cursor, [int])
+    query = select(*Conversation.__table__.columns).where(_owned_by(principal_id(http_request)))  # ix_conversations_user_id_id
+    if after is not None:
+        query = query.where(Conversation.id < after[0])
+    rows = (await db.execute(query.order_by(Conversation.id.desc()).limit(limit + 1))).all()
+    return page(rows, limit, lambda row: [row.id])
+
+@router.get("/{conversation_id}", response_model=ConversationOut)
+async def read_conversation(conversation_id: int, http_request: Request, db: AsyncSession = Depends(get_db)):
+    return await _get_conversation(db, conversation_id, principal_id(http_request))
+
+@router.delete("/{conversation_id}", status_code=204)
+async def delete_conversation(conversation_id: int, http_request: Request, db: AsyncSession = Depends(get_db)):
+    await _get_conversation(db, conversation_id, principal_id(http_request))
+    # The messages stay available as prompts
+    await db.execute(delete(ConversationTurn).where(ConversationTurn.conversation_id == conversation_id))
+    await db.execute(delete(Conversation).where(Conversation.id == conversation_id))
+    await db.commit()
+    conversation_store.discard(conversation_id)
+    return HTTPResponse(status_code=204)
+
+# The full history, oldest first, keyset-paginated on position
+@router.get("/{conversation_id}/turns", response_model=TurnPage)
+async def read_turns(
+    conversation_id: int,
+    http_request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_SIZE, ge=1, le=settings.PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    await _get_conversation(db, conversation_id, principal_id(http_request))
+    after = decode_cursor(cursor, [int])
+    query = (
+        select(
+            ConversationTurn.position,
+            ConversationTurn.prompt_id,
+            ConversationTurn.response_id,
+            PromptBlob.text,
+            ConversationTurn.reply,
+            ConversationTurn.prompt_tokens,
+            ConversationTurn.reply_tokens,
+        )
+        .join(Prompt, Prompt.id == ConversationTurn.prompt_id)
+        .join(PromptBlob, PromptBlob.hash == Prompt.blob_hash)
+        .where(ConversationTurn.conversation_id == conversation_id)
+    )
+    if after is not None:
+        query = query.where(ConversationTurn.position > after[0])
+    rows = (await db.execute(query.order_by(ConversationTurn.position).limit(limit + 1))).all()
+    return page(rows, limit, lambda row: [row.position])
+
+# Sends a message with the server-side history (windowed to the model's context) and stores the turn
+@router.post("/{conversation_id}/messages", response_model=ConversationReply)
+async def create_message(
+    conversation_id: int, message: ConversationMessage, http_request: Request, db: AsyncSession = Depends(get_db)
+):
+    principal = getattr(http_request.state, "user", None)
+    priority = resolve_priority(principal, http_request.headers.get("X-Priority"))
+    async with conversation_store.open(db, conversation_id, principal_id(http_request)) as state:
+        return await send_message(db, state, message, user_key(principal), priority, _request_timeout(http_request))
@@ -0,0 +1,392 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from itertools import chain
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database.models import Prompt, PromptBlob
+from app.providers import provider_registry
+from app.routers.prompts.services import create_prompts
+from app.routers.responses.services import generate_response
+from app.utils.cache import TTLCache
+from app.utils.data_validation import ConversationMessage, PromptCreate, ResponseRequest
+from app.utils.logger import get_logger
+from app.utils.metrics import DB_COMMIT_LATENCY, TOKENS
+from app.utils.rate_limit import estimate_tokens, rate_limiter
+from app.utils.scheduler import scheduler
+from app.utils.tokenizer import MESSAGE_OVERHEAD_TOKENS, context_window, count_tokens, fit_request, tokenizer
+from .models import Conversation, ConversationTurn
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below so that it can be continued from the summary alone. "
+    "Keep facts, names, numbers, decisions and open questions; leave out pleasantries."
+)
+
+
+class CachedTurn(NamedTuple):
+    """A turn of a cached history: its two chat messages, ready to send, and their token count."""
+    position: int
+    messages: Tuple[Dict[str, str], Dict[str, str]]  # The user message, then the reply
+    tokens: int  # Both messages, formatting overhead included
+
+
+def cached_turn(position: int, text: str, reply: str, prompt_tokens: int, reply_tokens: int) -> CachedTurn:
+    return CachedTurn(
+        position,
+        ({"role": "user", "content": text}, {"role": "assistant", "content": reply}),
+        prompt_tokens + reply_tokens + 2 * MESSAGE_OVERHEAD_TOKENS,
+    )
+
+
+def fit_history(turns: Sequence[CachedTurn], budget: int) -> int:
+    """
+    Windows a history: the newest turns are kept as long as their tokens fit the budget.
+
+    Args:
+        turns: The history, oldest first.
+        budget: Tokens available to the history.
+
+    Returns:
+        The index of the oldest turn kept; `len(turns)` when none fits.
+    """
+    start = len(turns)
+    for turn in reversed(turns):
+        if turn.tokens > budget:
+            break
+        budget -= turn.tokens
+        start -= 1
+    return start
+
+
+class ConversationState:
+    """
+    In-memory copy of a conversation: its settings, the system messages sent ahead of
+    the history (system prompt, running summary) and the most recent turns with their
+    token counts, oldest first. `turn_count` is the number of turns accounted for, kept
+    or not. `lock` serializes the turns of the conversation within the process.
+    """
+
+    def __init__(self, conversation_id: int):
+        self.id = conversation_id
+        self.lock = asyncio.Lock()
+        self.loaded = False
+        self.user_id: Optional[int] = None
+        self.model = ""
+        self.system_prompt: Optional[str] = None
+        self.system_tokens = 0
+        self.turns: List[CachedTurn] = []
+        self.turn_count = 0
+        self.set_summary(None, 0)
+
+    def reset(self, row) -> None:
+        """Loads the conversation's settings and summary; the turns are loaded after it."""
+        self.loaded = True
+        self.user_id = row.user_id
+        self.model = row.model
+        self.system_prompt = row.system_prompt
+        self.system_tokens = count_tokens(row.system_prompt, row.model) + MESSAGE_OVERHEAD_TOKENS if row.system_prompt else 0
+        self.set_summary(row.summary, row.summarized_turns)
+        self.turns = []
+        self.turn_count = row.summarized_turns
+
+    def set_summary(self, summary: Optional[str], summarized_turns: int) -> None:
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+        self.summary_tokens = count_tokens(summary, self.model) + MESSAGE_OVERHEAD_TOKENS if summary else 0
+
+    def prefix(self) -> List[Dict[str, str]]:
+        """The system messages sent ahead of the history."""
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + self.summary})
+        return messages
+
+    def prune(self) -> None:
+        """Drops the oldest turns, which no message could be sent with anymore."""
+        del self.turns[: fit_history(self.turns, context_window(self.model) - self.system_tokens - self.summary_tokens)]
+
+
+class ConversationStore:
+    """
+    LRU of recently used conversations (`ConversationState`), so that a new turn
+    assembles its context from memory instead of re-reading the history.
+
+    Another worker may have continued a cached conversation: each use reads the
+    conversation's counters (a primary-key lookup) and loads only the turns added
+    since. A conversation summarized elsewhere is reloaded. With `overflow` "trim" a
+    state keeps the newest turns that fit the model's context window; with
+    "summarize" it keeps every turn not yet folded into the summary.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.CONVERSATION_CACHE_SIZE,
+        ttl: float = settings.CONVERSATION_CACHE_TTL,
+        overflow: str = settings.CONVERSATION_OVERFLOW,
+    ):
+        self._states = TTLCache(max_entries, ttl)
+        self.overflow = overflow
+        self.hits = 0
+        self.refreshes = 0
+        self.misses = 0
+
+    @asynccontextmanager
+    async def open(self, db: AsyncSession, conversation_id: int, user_id: Optional[int]) -> AsyncIterator[ConversationState]:
+        """
+        Holds the conversation's lock and yields its state, synchronized with the database.
+
+        Args:
+            db: Database session.
+            conversation_id: The conversation.
+            user_id: The caller; conversations of other users are not found.
+
+        Yields:
+            The ConversationState. It is discarded when the block fails with anything
+            but an HTTPException, since it may be half updated.
+
+        Raises:
+            HTTPException: 404 when the conversation does not exist or is not the caller's.
+        """
+        state = self._states.get(conversation_id)
+        if state is None:
+            state = ConversationState(conversation_id)
+            self._states.set(conversation_id, state)
+        async with state.lock:
+            try:
+                await self._sync(db, state, user_id)
+                yield state
+            except HTTPException:
+                raise
+            except BaseException:
+                self.discard(conversation_id)
+                raise
+
+    def discard(self, conversation_id: int) -> None:
+        self._states.delete(conversation_id)
+
+    async def _sync(self, db: AsyncSession, state: ConversationState, user_id: Optional[int]) -> None:
+        columns = [Conversation.user_id, Conversation.turn_count, Conversation.summarized_turns]
+        if not state.loaded:
+            columns += [Conversation.model, Conversation.system_prompt, Conversation.summary]
+        row = (await db.execute(select(*columns).where(Conversation.id == state.id))).first()
+        if row is None or row.user_id != user_id:
+            if row is None or not state.loaded:
+                self.discard(state.id)
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        if not state.loaded:
+            self.misses += 1
+            state.reset(row)
+        elif row.summarized_turns != state.summarized_turns:
+            self.misses += 1  # Summarized by another worker
+            full = (await db.execute(select(Conversation).where(Conversation.id == state.id))).scalar_one()
+            state.reset(full)
+        elif row.turn_count != state.turn_count:
+            self.refreshes += 1
+        else:
+            self.hits += 1
+            return
+        await self._load_turns(db, state, row.turn_count)
+
+    async def _load_turns(self, db: AsyncSession, state: ConversationState, end: int) -> None:
+        """Appends the turns from `state.turn_count` to `end` that may still be sent."""
+        where = (
+            ConversationTurn.conversation_id == state.id,
+            ConversationTurn.position >= state.turn_count,
+            ConversationTurn.position < end,
+        )
+        start = state.turn_count
+        if self.overflow != "summarize":
+            # Token counts first, newest first, to read only the texts that fit the window
+            counts = await db.execute(
+                select(ConversationTurn.position, ConversationTurn.prompt_tokens, ConversationTurn.reply_tokens)
+                .where(*where)
+                .order_by(ConversationTurn.position.desc())
+            )
+            budget = context_window(state.model) - state.system_tokens - state.summary_tokens
+            start = end
+            for row in counts:
+                tokens = row.prompt_tokens + row.reply_tokens + 2 * MESSAGE_OVERHEAD_TOKENS
+                if tokens > budget:
+                    break
+                budget -= tokens
+                start = row.position
+            if start > state.turn_count:
+                state.turns.clear()  # The cached turns are older than ones left out
+        rows = await db.execute(
+            select(
+                ConversationTurn.position,
+                PromptBlob.text,
+                ConversationTurn.reply,
+                ConversationTurn.prompt_tokens,
+                ConversationTurn.reply_tokens,
+            )
+            .join(Prompt, Prompt.id == ConversationTurn.prompt_id)
+            .join(PromptBlob, PromptBlob.hash == Prompt.blob_hash)
+            .where(*where, ConversationTurn.position >= start)
+            .order_by(ConversationTurn.position)
+        )
+        state.turns.extend(cached_turn(*row) for row in rows)
+        state.turn_count = end
+        if self.overflow != "summarize":
+            state.prune()
+
+    def stats(self):
+        return {"hits": self.hits, "refreshes": self.refreshes, "misses": self.misses, "size": len(self._states)}
+
+
+conversation_store = ConversationStore()
+
+
+@asynccontextmanager
+async def _admission(request: ResponseRequest, user: str, priority: str, timeout: Optional[float]) -> AsyncIterator[None]:
+    """Holds the caller's rate limit and a scheduler slot for one completion of `request`."""
+    async with rate_limiter.limit(user, request.model, estimate_tokens(request)):
+        async with scheduler.slot(request.model, priority, timeout):
+            yield
+
+
+async def _summarize(
+    db: AsyncSession,
+    state: ConversationState,
+    count: int,
+    user: str,
+    priority: str = "interactive",
+    timeout: Optional[float] = None,
+) -> None:
+    """
+    Folds the `count` oldest cached turns into the conversation's running summary. The
+    completion is admitted like the turn's own, under `user`'s rate limit and a scheduler slot.
+    """
+    turns = state.turns[:count]
+    transcript = "\n\n".join(f"User: {turn.messages[0]['content']}\nAssistant: {turn.messages[1]['content']}" for turn in turns)
+    previous = f"Summary so far:\n{state.summary}\n\n" if state.summary else ""
+    request = ResponseRequest(
+        prompt=f"{SUMMARY_INSTRUCTIONS}\n\n{previous}Conversation:\n{transcript}",
+        model=state.model,
+        max_tokens=settings.CONVERSATION_SUMMARY_TOKENS,
+        temperature=0.0,
+    )
+    request, prompt_tokens = fit_request(request, overflow="truncate")
+    async with _admission(request, user, priority, timeout):
+        summary = await provider_registry.complete(request)
+    summary = tokenizer.truncate(summary, state.model, settings.CONVERSATION_SUMMARY_TOKENS)
+    TOKENS.labels(state.model, "in").inc(prompt_tokens)
+    TOKENS.labels(state.model, "out").inc(count_tokens(summary, state.model))
+    summarized_turns = turns[-1].position + 1
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.id == state.id)
+        .values(summary=summary, summarized_turns=summarized_turns)
+    )
+    with DB_COMMIT_LATENCY.labels("conversations").time():
+        await db.commit()
+    state.set_summary(summary, summarized_turns)
+    del state.turns[:count]
+
+
+async def send_message(
+    db: AsyncSession,
+    state: ConversationState,
+    message: ConversationMessage,
+    user: str,
+    priority: str = "interactive",
+    timeout: Optional[float] = None,
+) -> dict:
+    """
+    Continues a conversation: sends the message with as much of the history as fits
+    the model's context window and stores the exchange as the next turn.
+
+    The context is the system prompt, the running summary and the newest cached turns
+    whose token counts fit what is left of the window after the message and its
+    `max_tokens`. With `settings.CONVERSATION_OVERFLOW` "summarize" the older turns are
+    first folded into the summary (one extra completion, at most
+    `settings.CONVERSATION_SUMMARY_TOKENS` long), down to half that budget so that it
+    happens every few turns rather than on each; should that fail they are only left out,
+    but a rejection by the rate limit or the scheduler fails the message. The message is
+    stored as a prompt of the conversation's user and answered through
+    `generate_response`; both completions run under the user's rate limit and a
+    scheduler slot.
+
+    Args:
+        db: Database session.
+        state: The conversation, as yielded by `conversation_store.open`.
+        message: The user message and its sampling parameters.
+        user: The rate-limit key of the caller (see `app.utils.rate_limit.user_key`).
+        priority: Scheduler priority class of the completion.
+        timeout: The request's time budget in seconds.
+
+    Returns:
+        The stored turn with `context_turns` and `context_tokens`, the history sent.
+
+    Raises:
+        HTTPException: 409 when another worker stored a turn of the conversation meanwhile,
+            429 or 503 when the summary or the reply is not admitted.
+    """
+    logger = get_logger()
+    model = state.model
+    message_tokens = count_tokens(message.text, model)
+    summarize = conversation_store.overflow == "summarize"
+    budget = context_window(model) - message.max_tokens - message_tokens - MESSAGE_OVERHEAD_TOKENS - state.system_tokens
+    # A summary written now must fit, whatever the one it replaces
+    budget -= settings.CONVERSATION_SUMMARY_TOKENS + MESSAGE_OVERHEAD_TOKENS if summarize else state.summary_tokens
+    start = fit_history(state.turns, budget)
+    if start and summarize:
+        # Folds down to half the budget, so that the next turns fit without summarizing again
+        start = fit_history(state.turns, budget // 2)
+        try:
+            await _summarize(db, state, start, user, priority, timeout)
+            start = 0
+        except HTTPException:
+            raise
+        except Exception as e:
+            await db.rollback()
+            logger.warning("Could not summarize conversation %s, trimming it instead: %s", state.id, e)
+    history = state.turns[start:]
+    context = state.prefix() + list(chain.from_iterable(turn.messages for turn in history))
+
+    sampling = message.dict(exclude={"text", "cache"})
+    [prompt] = await create_prompts(db, [PromptCreate(text=message.text, model=model, **sampling)], state.user_id)
+    request = ResponseRequest(prompt=message.text, model=model, prompt_id=prompt["id"], cache=message.cache, **sampling)
+    # The history comes from stored turns: it is attached without being validated again
+    request = request.copy(update={"context": context})
+
+    db_response = await generate_response(request, db, lambda: _admission(request, user, priority, timeout))
+
+    reply_tokens = count_tokens(db_response.text, model)
+    turn = {
+        "position": state.turn_count,
+        "prompt_id": prompt["id"],
+        "response_id": db_response.id,
+        "reply": db_response.text,
+        "prompt_tokens": message_tokens,
+        "reply_tokens": reply_tokens,
+    }
+    db.add(ConversationTurn(conversation_id=state.id, **turn))
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.id == state.id)
+        .values(turn_count=state.turn_count + 1, updated_at=datetime.utcnow())
+    )
+    try:
+        with DB_COMMIT_LATENCY.labels("conversations").time():
+            await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Conversation was continued concurrently; send the message again")
+    state.turns.append(cached_turn(state.turn_count, message.text, db_response.text, message_tokens, reply_tokens))
+    state.turn_count += 1
+    if not summarize:
+        state.prune()
+    logger.info("Conversation %s: turn %d with %d earlier turns", state.id, turn["position"], len(history))
+    return {
+        **turn,
+        "text": message.text,
+        "context_turns": len(history),
+        "context_tokens": state.system_tokens + state.summary_tokens + sum(t.tokens for t in history),
+    }
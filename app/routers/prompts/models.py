@@ -1,14 +1,2 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
-from app.database import Base
-
-class Prompt(Base):
-    __tablename__ = "prompts"
-    id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, nullable=False)
-    model = Column(String, nullable=False)
-    parameters = Column(String)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    user = relationship("User", back_populates="prompts")
-    responses = relationship("Response", back_populates="prompt")
\ No newline at end of file
+# The ORM classes are declared once, on the shared Base, in app/database/models.py
+from app.database.models import Prompt, PromptBlob  # noqa: F401
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, Request
 from app.database import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
+from app.utils.auth import principal_id
 from app.utils.logger import get_logger
-from .models import Prompt, PromptCreate
+from app.utils.data_validation import PromptCreate, PromptBatchCreate, PromptOut, PromptPage, ResponsePage
+from app.utils.pagination import decode_cursor, page
+from app.config import settings
+from app.routers.responses.services import list_responses
+from .models import Prompt, PromptBlob
+from .services import create_prompts
 
 router = APIRouter(
     prefix="/prompts",
@@ -11,16 +20,78 @@ router = APIRouter(
     responses={404: {"description": "Prompt not found"}},
 )
 
-@router.post("/", response_model=Prompt)
-async def create_prompt(prompt: PromptCreate, db: Session = Depends(get_db)):
+@router.post("/", response_model=PromptOut)
+async def create_prompt(prompt: PromptCreate, http_request: Request, db: AsyncSession = Depends(get_db)):
     logger = get_logger()
     try:
-        db_prompt = Prompt(**prompt.dict())
-        db.add(db_prompt)
-        db.commit()
-        db.refresh(db_prompt)
-        logger.info(f"Created new prompt: {db_prompt.id}")
+        [db_prompt] = await create_prompts(db, [prompt], principal_id(http_request))
+        logger.info("Created new prompt: %s", db_prompt["id"])
         return db_prompt
     except Exception as e:
-        logger.error(f"Error creating prompt: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        await db.rollback()
+        logger.error("Error creating prompt: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+# Inserts all prompts with one multi-row INSERT ... RETURNING in a single transaction
+@router.post("/batch")
+async def create_prompts_batch(batch: PromptBatchCreate, http_request: Request, db: AsyncSession = Depends(get_db)):
+    logger = get_logger()
+    try:
+        rows = await create_prompts(db, batch.prompts, principal_id(http_request))
+        logger.info("Created %d prompts in one batch", len(rows))
+        return rows
+    except Exception as e:
+        await db.rollback()
+        logger.error("Error creating prompt batch: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+# The caller's prompts (all of them without authentication), keyset-paginated newest first:
+# each page continues below the last id seen instead of using OFFSET. `text` is left out
+# unless include_text=true
+@router.get("/", response_model=PromptPage, response_model_exclude_unset=True)
+async def read_prompts(
+    http_request: Request,
+    model: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_SIZE, ge=1, le=settings.PAGE_MAX_SIZE),
+    include_text: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    after = decode_cursor(cursor, [int])
+    user_id = principal_id(http_request)
+    columns = [Prompt.id, Prompt.model, Prompt.parameters, Prompt.token_count, Prompt.user_id]
+    query = select(*columns)
+    if include_text:
+        query = query.add_columns(PromptBlob.text).join(PromptBlob, Prompt.blob_hash == PromptBlob.hash)
+    if user_id is not None:
+        query = query.where(Prompt.user_id == user_id)  # ix_prompts_user_id_id
+    if model is not None:
+        query = query.where(Prompt.model == model)  # ix_prompts_model_id
+    if after is not None:
+        query = query.where(Prompt.id < after[0])
+    rows = (await db.execute(query.order_by(Prompt.id.desc()).limit(limit + 1))).all()
+    return page(rows, limit, lambda row: [row.id])
+
+@router.get("/{prompt_id}/responses", response_model=ResponsePage, response_model_exclude_unset=True)
+async def read_prompt_responses(
+    prompt_id: int,
+    http_request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_SIZE, ge=1, le=settings.PAGE_MAX_SIZE),
+    include_text: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    user_id = principal_id(http_request)
+    result = await list_responses(
+        db, limit, cursor, user_id=user_id, prompt_id=prompt_id, since=since, until=until, include_text=include_text
+    )
+    # Only an empty page needs the extra lookup to tell "no responses" from "no prompt" (of the caller's)
+    if not result["items"] and cursor is None:
+        query = select(Prompt.id).where(Prompt.id == prompt_id)
+        if user_id is not None:
+            query = query.where(Prompt.user_id == user_id)
+        if (await db.execute(query)).first() is None:
+            raise HTTPException(status_code=404, detail="Prompt not found")
+    return result
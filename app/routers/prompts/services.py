@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database.types import content_hash
+from app.utils.cache import TTLCache
+from app.utils.data_validation import PromptCreate
+from app.utils.metrics import DB_COMMIT_LATENCY
+from app.utils.tokenizer import count_tokens
+from .models import Prompt, PromptBlob
+
+blobs = PromptBlob.__table__
+
+
+def _upsert_blobs(dialect_name: str, rows: List[dict]):
+    """One INSERT ... ON CONFLICT (hash) DO NOTHING of the rows, in hash order."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    # Concurrent upserts lock the conflicting keys in the same order, so they cannot deadlock
+    rows = sorted(rows, key=lambda row: row["hash"])
+    return insert(blobs).values(rows).on_conflict_do_nothing(index_elements=[blobs.c.hash])
+
+
+class PromptBlobStore:
+    """
+    Content-addressed storage of prompt bodies.
+
+    Each distinct text is stored once in `prompt_blobs`, keyed by its hash; prompts
+    store the hash. Bodies not seen before are upserted with a single INSERT ... ON
+    CONFLICT DO NOTHING statement, whatever their number. Hashes known to be stored
+    (an in-process LRU of the hottest ones) need no statement at all, which skips
+    sending, compressing and looking up the text. A hash is remembered once the
+    transaction that stored it committed. Bodies are never deleted: no prompt is.
+    """
+
+    def __init__(self, max_entries: int = settings.PROMPT_BLOB_CACHE_SIZE):
+        self._known = TTLCache(max_entries, ttl=float("inf"))
+        self.hits = 0
+        self.misses = 0
+
+    async def intern(self, db: AsyncSession, texts: Sequence[str]) -> List[bytes]:
+        """
+        Stores the bodies of new prompts, or references the stored copies.
+
+        Args:
+            db: The session of the transaction that inserts the prompts.
+            texts: One prompt text per new prompt (repeats allowed).
+
+        Returns:
+            The `blob_hash` of each prompt, in order. Pass them to `remember` after commit.
+        """
+        hashes = [content_hash(text) for text in texts]
+        bodies: Dict[bytes, str] = dict(zip(hashes, texts))
+        new = [digest for digest in bodies if self._known.get(digest) is None]
+        self.hits += len(bodies) - len(new)
+        self.misses += len(new)
+        if new:
+            rows = [{"hash": digest, "text": bodies[digest]} for digest in new]
+            await db.execute(_upsert_blobs(db.get_bind().dialect.name, rows))
+        return hashes
+
+    def remember(self, hashes: Sequence[bytes]) -> None:
+        for digest in hashes:
+            self._known.set(digest, True)
+
+    def forget(self, hashes: Sequence[bytes]) -> None:
+        """Drops hashes after a failed transaction, in case their bodies are gone (the retry upserts)."""
+        for digest in hashes:
+            self._known.delete(digest)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._known)}
+
+
+prompt_blobs = PromptBlobStore()
+
+
+def _prompt_values(prompt: PromptCreate) -> dict:
+    # Sampling settings have no columns of their own; they are kept in `parameters`
+    values = prompt.dict()
+    return {
+        "text": values.pop("text"),
+        "model": values.pop("model"),
+        "parameters": values,
+        "token_count": count_tokens(prompt.text, prompt.model),
+    }
+
+
+async def create_prompts(db: AsyncSession, prompts: List[PromptCreate], user_id: Optional[int] = None) -> List[dict]:
+    """
+    Inserts prompts in one transaction: their bodies are interned by hash in
+    `prompt_blobs` (one upsert of the new ones) and the prompt rows, which reference
+    them, go in with one multi-row INSERT ... RETURNING.
+
+    Args:
+        db: The session to insert with; the transaction is committed.
+        prompts: The validated prompts.
+        user_id: Owner of the prompts, if any.
+
+    Returns:
+        One dict per prompt, in order, with its `id`, `text` and stored columns.
+    """
+    rows = [{**_prompt_values(prompt), "user_id": user_id} for prompt in prompts]
+    texts = [row.pop("text") for row in rows]
+    hashes = await prompt_blobs.intern(db, texts)
+    try:
+        result = await db.execute(
+            insert(Prompt).returning(Prompt.id, sort_by_parameter_order=True),
+            [{**row, "blob_hash": digest} for row, digest in zip(rows, hashes)],
+        )
+        ids = result.scalars().all()
+        with DB_COMMIT_LATENCY.labels("prompts").time():
+            await db.commit()
+    except Exception:
+        prompt_blobs.forget(hashes)
+        raise
+    prompt_blobs.remember(hashes)
+    return [{"id": prompt_id, "text": text, **row} for prompt_id, text, row in zip(ids, texts, rows)]
@@ -1,10 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, Request, Response as HTTPResponse
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from app.database import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.utils.auth import principal_id
 from app.utils.logger import get_logger  # For logging
-from app.utils.error_handler import handle_exception  # For error handling
-from .models import Response
-from .services import generate_response
+from app.utils.data_validation import ResponseRequest, ResponseBatchRequest, ResponseOut, ResponsePage
+from app.utils.rate_limit import rate_limiter, estimate_tokens, user_key
+from app.utils.tokenizer import fit_request
+from app.utils.scheduler import request_deadline, request_timeout, resolve_priority, scheduler
+from app.config import settings
+from .services import generate_response, stream_response, generate_batch, list_responses
 
 router = APIRouter(
     prefix="/responses",
@@ -12,14 +24,130 @@ router = APIRouter(
     responses={404: {"description": "Response not found"}},
 )
 
-@router.post("/", response_model=Response)
-async def create_response(request: ResponseRequest, db: Session = Depends(get_db)):
+def _request_timeout(http_request: Request) -> float:
+    # Clients may ask for a tighter budget than the server-wide one, never a longer one
+    try:
+        requested = float(http_request.headers.get("X-Request-Timeout", settings.UPSTREAM_DEADLINE))
+    except ValueError:
+        requested = settings.UPSTREAM_DEADLINE
+    return min(max(requested, 0.1), settings.UPSTREAM_DEADLINE)
+
+@router.post("/", response_model=ResponseOut)
+async def create_response(
+    request: ResponseRequest, http_request: Request, http_response: HTTPResponse, db: AsyncSession = Depends(get_db)
+):
     logger = get_logger()
     try:
-        logger.info(f"Received response request: {request}")
-        response = await generate_response(request, db)
-        logger.info(f"Generated response: {response}")
+        logger.info("Received response request: model=%s", request.model)
+        principal = getattr(http_request.state, "user", None)
+        priority = resolve_priority(principal, http_request.headers.get("X-Priority"))
+        waited = 0.0
+
+        # Taken only on a cache miss, around the upstream call
+        @asynccontextmanager
+        async def admission():
+            nonlocal waited
+            # Per-user/per-model budget; rejects with 429 + Retry-After (see app/utils/rate_limit.py)
+            async with rate_limiter.limit(user_key(principal), request.model, estimate_tokens(request)):
+                # Per-model slot in a priority queue; sheds with 503 + Retry-After (see app/utils/scheduler.py)
+                async with scheduler.slot(request.model, priority, _request_timeout(http_request)) as waited:
+                    yield
+
+        response = await generate_response(request, db, admission)
+        http_response.headers["X-Queue-Wait-Ms"] = str(round(waited * 1000, 2))
+        logger.info("Generated response: id=%s queue_wait=%.3fs", getattr(response, "id", None), waited)
         return response
     except Exception as e:
-        logger.error(f"Error generating response: {e}")
-        return handle_exception(e, logger)
\ No newline at end of file
+        logger.error("Error generating response: %s", e)
+        raise
+
+# Streams completion deltas as Server-Sent Events; the row is stored when the stream ends
+@router.post("/stream")
+async def create_response_stream(request: ResponseRequest, http_request: Request):
+    logger = get_logger()
+    logger.info("Received streaming response request: model=%s", request.model)
+    request, _ = fit_request(request)  # Rejected before the stream starts, while a 400 is still possible
+    # Admitted before the response starts so a rejection is still a real 429/503; the
+    # in-flight and scheduler slots are held until the stream ends
+    principal = getattr(http_request.state, "user", None)
+    user = user_key(principal)
+    priority = resolve_priority(principal, http_request.headers.get("X-Priority"))
+    timeout = _request_timeout(http_request)
+    backend = await rate_limiter.acquire(user, request.model, estimate_tokens(request))
+    try:
+        deadline = asyncio.get_running_loop().time() + timeout
+        waited = await scheduler.acquire(request.model, priority, deadline)
+    except BaseException:
+        await rate_limiter.release(user, backend)
+        raise
+    started = time.perf_counter()
+    released = False
+
+    async def release():
+        # Once, from whichever comes first: the end of the stream, or the response's background
+        # task, which also runs when the client left before the stream started
+        nonlocal released
+        if not released:
+            released = True
+            scheduler.release(request.model, time.perf_counter() - started)
+            await rate_limiter.release(user, backend)
+
+    async def limited_stream():
+        # The body runs in the response's own context: the upstream call gets the same deadline
+        # as with `scheduler.slot`
+        request_deadline.set(deadline)
+        request_timeout.set(timeout)
+        try:
+            async for event in stream_response(request):
+                yield event
+        finally:
+            await release()
+
+    return StreamingResponse(
+        limited_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Queue-Wait-Ms": str(round(waited * 1000, 2)),
+        },
+        background=BackgroundTask(release),
+    )
+
+# Generates a list of completions with bounded concurrency; per-item errors instead of
+# failing the whole batch. `stream=true` emits NDJSON lines as items complete.
+@router.post("/batch")
+async def create_response_batch(batch: ResponseBatchRequest, http_request: Request):
+    logger = get_logger()
+    concurrency = min(batch.concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    logger.info("Received batch of %d response requests (concurrency=%d)", len(batch.requests), concurrency)
+    principal = getattr(http_request.state, "user", None)
+    # Batch items queue behind interactive requests unless the user is configured otherwise
+    priority = resolve_priority(principal, http_request.headers.get("X-Priority"), default="batch")
+    results = generate_batch(batch.requests, concurrency, user=user_key(principal), priority=priority)
+    if batch.stream:
+        async def ndjson():
+            async for result in results:
+                yield json.dumps(result, default=str) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    ordered = [None] * len(batch.requests)
+    async for result in results:
+        ordered[result["index"]] = result
+    return {"results": ordered}
+
+# Responses to the caller's prompts (all of them without authentication), keyset-paginated
+# newest first; `text` is left out unless include_text=true
+@router.get("/", response_model=ResponsePage, response_model_exclude_unset=True)
+async def read_responses(
+    http_request: Request,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_SIZE, ge=1, le=settings.PAGE_MAX_SIZE),
+    include_text: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    return await list_responses(
+        db, limit, cursor, user_id=principal_id(http_request), model=model, since=since, until=until, include_text=include_text
+    )
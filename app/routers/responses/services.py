@@ -1,44 +1,431 @@
-from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+import json
+import time
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from typing import AsyncContextManager, AsyncIterator, Callable, List, Optional
+from fastapi import Depends, HTTPException
+import asyncio
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, SessionLocal
+from app.database.write_behind import response_writer
 from app.utils.logger import get_logger
-from app.utils.error_handler import handle_exception
+from app.utils.data_validation import ResponseRequest
+from app.providers import provider_registry
+from app.utils.cache import response_cache, request_key
+from app.utils.semantic_cache import semantic_cache
+from app.utils.singleflight import single_flight
+from app.utils.rate_limit import rate_limiter, estimate_tokens
+from app.utils.tokenizer import context_tokens, count_tokens, fit_request
+from app.utils.scheduler import scheduler
+from app.utils.metrics import CACHE_LOOKUPS, DB_ACQUIRE_LATENCY, DB_COMMIT_LATENCY, TIME_TO_FIRST_TOKEN, TOKENS
+from app.utils.resilience import CircuitOpenError, DeadlineExceeded
+from app.utils.pagination import decode_cursor, page
 from app.config import settings
-from .models import Response, ResponseRequest
-from openai import OpenAI
+from app.database.models import Prompt
+from app.utils.openai_client import is_openai_error
+from .models import Response
 
-async def generate_response(request: ResponseRequest, db: Session = Depends(get_db)):
+def _response_to_dict(db_response: Response) -> dict:
+    """Serializes a Response row (cache entries, shared single-flight results, batch items)."""
+    return {
+        "id": db_response.id,
+        "text": db_response.text,
+        "model": db_response.model,
+        "parameters": db_response.parameters,
+        "generation_time": db_response.generation_time.isoformat(),
+        "prompt_tokens": db_response.prompt_tokens,
+        "completion_tokens": db_response.completion_tokens,
+        "prompt_id": db_response.prompt_id,
+    }
+
+
+def _response_from_dict(cached: dict) -> Response:
+    """Rebuilds a (detached) Response from `_response_to_dict` output without touching the database."""
+    return Response(**{**cached, "generation_time": datetime.fromisoformat(cached["generation_time"])})
+
+
+def _upstream_rate_limited(e: Exception) -> HTTPException:
+    """Passes a provider 429 on to the client instead of turning it into a 500."""
+    retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+    return HTTPException(
+        status_code=429,
+        detail="Upstream rate limit exceeded",
+        headers={"Retry-After": retry_after or "1"},
+    )
+
+
+def _upstream_unavailable(e: Exception) -> HTTPException:
+    """Maps resilience-layer failures: open circuit -> 503, exhausted budget -> 504."""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(
+            status_code=503,
+            detail="Model temporarily unavailable",
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.5)))},
+        )
+    return HTTPException(status_code=504, detail="Model did not answer in time")
+
+
+async def _complete(request: ResponseRequest) -> str:
+    """Generates the completion text on the best backend for the model (see app/providers)."""
+    text = await provider_registry.complete(request)
+    TOKENS.labels(request.model, "in").inc(count_tokens(request.prompt, request.model) + context_tokens(request))
+    TOKENS.labels(request.model, "out").inc(count_tokens(text, request.model))
+    return text
+
+
+async def _store_response(db: AsyncSession, request: ResponseRequest, text: str) -> Response:
+    """
+    Persists one Response row for the request. With write-behind enabled the row is
+    queued for a batched insert instead and returned without an id.
+    """
+    db_response = Response(
+        text=text,
+        model=request.model,
+        parameters=request.parameters,
+        generation_time=datetime.utcnow(),
+        # Counts cached by fit_request's; the context is billed as prompt tokens
+        prompt_tokens=count_tokens(request.prompt, request.model) + context_tokens(request),
+        completion_tokens=count_tokens(text, request.model),
+        prompt_id=request.prompt_id
+    )
+    if settings.WRITE_BEHIND_ENABLED:
+        await response_writer.submit({
+            "text": db_response.text,
+            "model": db_response.model,
+            "parameters": db_response.parameters,
+            "generation_time": db_response.generation_time,
+            "prompt_tokens": db_response.prompt_tokens,
+            "completion_tokens": db_response.completion_tokens,
+            "prompt_id": db_response.prompt_id,
+        })
+        return db_response
+    with DB_ACQUIRE_LATENCY.time():
+        await db.connection()  # Checks a pooled connection out now, so the wait is measured apart
+    db.add(db_response)
+    with DB_COMMIT_LATENCY.labels("responses").time():
+        await db.commit()
+    await db.refresh(db_response)
+    return db_response
+
+
+async def _complete_and_store(request: ResponseRequest) -> dict:
+    """Shared single-flight mode: one row for all coalesced callers, stored via its own session."""
+    text = await _complete(request)
+    async with SessionLocal() as db:
+        return _response_to_dict(await _store_response(db, request, text))
+
+
+async def generate_response(
+    request: ResponseRequest,
+    db: AsyncSession = Depends(get_db),
+    admission: Optional[Callable[[], AsyncContextManager]] = None,
+):
+    """
+    Answers `request` from the response caches or, on a miss, from the upstream, and
+    stores the new row.
+
+    Args:
+        request: The validated response request.
+        db: The session the row is stored with.
+        admission: Context manager factory (rate limit, scheduler slot) held around the
+            upstream call only, so cache hits cost the caller no budget.
+
+    Returns:
+        The Response row.
+    """
     logger = get_logger()
     try:
-        logger.info(f"Received response request: {request}")
-        openai = OpenAI(api_key=settings.OPENAI_API_KEY)
-        response = openai.chat.completions.create(
-            model=request.model,
-            messages=[
-                {"role": "user", "content": request.prompt}
-            ],
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
-            top_p=request.top_p,
-            frequency_penalty=request.frequency_penalty,
-            presence_penalty=request.presence_penalty,
-            # ... (Add any other model-specific parameters)
+        logger.info("Received response request: model=%s prompt_id=%s", request.model, request.prompt_id)
+        # Oversized prompts fail here, before any network call; max_tokens is clamped
+        request, _ = fit_request(request)
+        cache_key = request_key(request) if response_cache.is_cacheable(request) else None
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            CACHE_LOOKUPS.labels(request.model, "miss" if cached is None else "hit").inc()
+            if cached is not None:
+                # The key is shared by all callers: the hit is stored as the caller's own row
+                logger.info("Response cache hit: %s", cache_key)
+                return await _store_response(db, request, cached["text"])
+        # Near-duplicate prompts (rephrasings, whitespace) are answered from the semantic index,
+        # which embeds the prompt alone: requests carrying earlier turns skip it
+        semantic = cache_key is not None and semantic_cache.enabled and not request.context
+        if semantic:
+            similar = await semantic_cache.lookup(db, request, Response)
+            CACHE_LOOKUPS.labels(request.model, "semantic_miss" if similar is None else "semantic_hit").inc()
+            if similar is not None:
+                logger.info("Semantic cache hit: id=%s", similar.id)
+                return await _store_response(db, request, similar.text)
+        # Concurrent identical requests share one upstream call (see app/utils/singleflight.py)
+        coalesce = settings.SINGLEFLIGHT_ENABLED and request.cache is not False
+        flight_key = cache_key or request_key(request)
+        async with admission() if admission is not None else nullcontext():
+            if coalesce and settings.SINGLEFLIGHT_SHARE_RESPONSE:
+                db_response = _response_from_dict(
+                    await single_flight.do(flight_key, lambda: _complete_and_store(request))
+                )
+            else:
+                if coalesce:
+                    text = await single_flight.do(flight_key, lambda: _complete(request))
+                else:
+                    text = await _complete(request)
+                db_response = await _store_response(db, request, text)
+        if cache_key:
+            await response_cache.set(cache_key, _response_to_dict(db_response))
+        if semantic:
+            await semantic_cache.add(request, db_response.id)
+        logger.info("Generated response: id=%s model=%s", db_response.id, db_response.model)
+        return db_response
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise _upstream_unavailable(e)
+    except Exception as e:
+        if is_openai_error(e, "RateLimitError"):
+            logger.warning("OpenAI rate limit: %s", e)
+            raise _upstream_rate_limited(e)
+        if is_openai_error(e):
+            logger.error("OpenAI API Error: %s", e)
+            raise HTTPException(status_code=500, detail="Error connecting to OpenAI API")
+        logger.error("Error generating response: %s", e)
+        raise  # Mapped to an error response by the app-level exception handler
+
+
+async def _finish_stream(stream, request: ResponseRequest, text: str) -> Optional[Response]:
+    """Closes the upstream stream and persists the accumulated text, if any."""
+    await stream.close()
+    if not text:
+        return None
+    async with SessionLocal() as db:
+        return await _store_response(db, request, text)
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    """Formats one Server-Sent Event."""
+    payload = json.dumps(data)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+async def stream_response(request: ResponseRequest) -> AsyncIterator[str]:
+    """
+    Relays completion deltas as Server-Sent Events while accumulating the final text.
+
+    The `Response` row is persisted once, when the upstream stream ends or the client
+    disconnects. Only the first `settings.STREAM_MAX_RESPONSE_CHARS` characters are kept
+    in memory (and persisted); everything is still relayed to the client.
+
+    Args:
+        request: The validated response request, already fitted with `fit_request`.
+
+    Yields:
+        SSE-formatted strings: one `data` event per delta, then a `done` event carrying
+        the stored response id and the time-to-first-byte, or an `error` event.
+    """
+    logger = get_logger()
+    limit = settings.STREAM_MAX_RESPONSE_CHARS
+    chunks: List[str] = []
+    size = 0
+    truncated = False
+    ttfb: Optional[float] = None
+    start = time.perf_counter()
+    try:
+        # Only opening the stream is retried; a stream is never hedged
+        stream = await provider_registry.open_stream(request)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.warning("Upstream unavailable: %s", e)
+        yield _sse({"detail": _upstream_unavailable(e).detail}, event="error")
+        return
+    except Exception as e:
+        if not is_openai_error(e):
+            raise
+        logger.error("OpenAI API Error: %s", e)
+        yield _sse({"detail": "Error connecting to OpenAI API"}, event="error")
+        return
+
+    try:
+        async for delta in stream:
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+                TIME_TO_FIRST_TOKEN.labels(request.model).observe(ttfb)
+            if size < limit:
+                kept = delta[: limit - size]
+                chunks.append(kept)
+                size += len(kept)
+                truncated = truncated or len(kept) < len(delta)
+            else:
+                truncated = True
+            yield _sse({"delta": delta})
+    except Exception as e:
+        if not is_openai_error(e):
+            raise
+        logger.error("OpenAI API Error while streaming: %s", e)
+        yield _sse({"detail": "Error connecting to OpenAI API"}, event="error")
+    finally:
+        # Runs on normal completion, upstream errors and client disconnects alike. The
+        # cleanup runs as its own task so a disconnect cancelling us cannot interrupt it.
+        db_response = await asyncio.shield(
+            asyncio.ensure_future(_finish_stream(stream, request, "".join(chunks)))
         )
-        db_response = Response(
-            text=response.choices[0].message.content,
-            model=request.model,
-            parameters=str(request.parameters),
-            generation_time=datetime.utcnow(),
-            prompt_id=request.prompt_id
+        TOKENS.labels(request.model, "in").inc(count_tokens(request.prompt, request.model) + context_tokens(request))
+        TOKENS.labels(request.model, "out").inc(count_tokens("".join(chunks), request.model))
+        logger.info(
+            "Streamed response: id=%s chars=%d truncated=%s ttfb=%s",
+            db_response.id if db_response else None, size, truncated, ttfb,
         )
-        db.add(db_response)
-        db.commit()
-        db.refresh(db_response)
-        logger.info(f"Generated response: {db_response}")
-        return db_response
-    except openai.error.OpenAIError as e:
-        logger.error(f"OpenAI API Error: {e}")
-        raise HTTPException(status_code=500, detail="Error connecting to OpenAI API")
+
+    yield _sse(
+        {
+            "id": db_response.id if db_response else None,
+            "ttfb_ms": round(ttfb * 1000, 2) if ttfb is not None else None,
+            "truncated": truncated,
+        },
+        event="done",
+    )
+
+
+async def generate_item(
+    request: ResponseRequest,
+    user: str,
+    priority: str = "batch",
+    max_wait: Optional[float] = None,
+) -> dict:
+    """
+    Generates the response to one item of a batch (POST /responses/batch, app.batch)
+    through `generate_response`, with its own database session.
+
+    Unless answered from a cache, the item goes through the user's rate limit, waiting
+    up to `max_wait` seconds for budget (reported as a 429 error after that), and
+    through the scheduler (items it sheds are reported as 503s).
+
+    Args:
+        request: The validated response request.
+        user: The rate-limit key of the caller (see `app.utils.rate_limit.user_key`).
+        priority: Scheduler priority class of the item.
+        max_wait: Seconds to wait for rate-limit budget. Defaults to `settings.RATE_LIMIT_BATCH_MAX_WAIT`.
+
+    Returns:
+        `{"response": {...}}` on success or `{"error": {"status_code", "detail"}}`.
+    """
+    try:
+        if max_wait is None:
+            max_wait = settings.RATE_LIMIT_BATCH_MAX_WAIT
+
+        @asynccontextmanager
+        async def admission():
+            async with rate_limiter.limit(user, request.model, estimate_tokens(request), max_wait=max_wait):
+                async with scheduler.slot(request.model, priority):
+                    yield
+
+        async with SessionLocal() as db:
+            db_response = await generate_response(request, db, admission)
+        return {"response": _response_to_dict(db_response)}
+    except HTTPException as e:
+        return {"error": {"status_code": e.status_code, "detail": e.detail}}
     except Exception as e:
-        logger.error(f"Error generating response: {e}")
-        return handle_exception(e, logger)
\ No newline at end of file
+        get_logger().error("Error generating batch item: %s", e)
+        return {"error": {"status_code": 500, "detail": "Internal server error"}}
+
+
+async def generate_batch(
+    requests: List[ResponseRequest], concurrency: int, user: str = "anonymous", priority: str = "batch"
+) -> AsyncIterator[dict]:
+    """
+    Fans a list of requests out through `generate_item` with at most `concurrency`
+    completions in flight.
+
+    Args:
+        requests: The validated response requests.
+        concurrency: Maximum number of concurrent completions.
+        user: The rate-limit key of the caller (see `app.utils.rate_limit.user_key`).
+        priority: Scheduler priority class of the items.
+
+    Yields:
+        One dict per request, in completion order: `{"index", "response"}` on success or
+        `{"index", "error": {"status_code", "detail"}}` when that item failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, request: ResponseRequest) -> dict:
+        async with semaphore:
+            return {"index": index, **await generate_item(request, user, priority)}
+
+    tasks = [asyncio.ensure_future(run(index, request)) for index, request in enumerate(requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:  # Client went away: stop the remaining items
+            task.cancel()
+
+
+async def list_responses(
+    db: AsyncSession,
+    limit: int,
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    model: Optional[str] = None,
+    prompt_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    include_text: bool = False,
+) -> dict:
+    """
+    Returns one page of responses, newest first.
+
+    Pages are keyset-paginated on (generation_time, id): each page continues strictly
+    below the last row of the previous one, so the cost of a page does not grow with
+    its depth the way OFFSET does. Every filter combination is served by one of the
+    composite indexes on `responses`. On a partitioned Postgres table the
+    generation_time bounds (the cursor's included) also prune the partitions outside
+    the range. The `text` column is only selected with `include_text`.
+
+    Args:
+        db: Database session.
+        limit: Page size.
+        cursor: `next_cursor` of the previous page, or None for the first page.
+        user_id: Only responses to prompts of this user.
+        model: Only responses generated by this model.
+        prompt_id: Only responses to this prompt.
+        since: Only responses generated at or after this time.
+        until: Only responses generated before this time.
+        include_text: Also return the response text.
+
+    Returns:
+        `{"items": [...], "next_cursor": str | None}`.
+
+    Raises:
+        HTTPException: 400 when the cursor is malformed.
+    """
+    after = decode_cursor(cursor, [datetime, int])
+    columns = [
+        Response.id,
+        Response.model,
+        Response.parameters,
+        Response.generation_time,
+        Response.prompt_tokens,
+        Response.completion_tokens,
+        Response.prompt_id,
+    ]
+    if include_text:
+        columns.append(Response.text)
+    query = select(*columns)
+    if user_id is not None:
+        query = query.join(Prompt, Response.prompt_id == Prompt.id).where(Prompt.user_id == user_id)
+    if model is not None:
+        query = query.where(Response.model == model)
+    if prompt_id is not None:
+        query = query.where(Response.prompt_id == prompt_id)
+    if since is not None:
+        query = query.where(Response.generation_time >= since)
+    if after is not None:
+        # The plain upper bound lets the planner seek to the cursor; the row comparison
+        # alone is not used as an index bound everywhere (e.g. SQLite)
+        query = query.where(
+            Response.generation_time <= after[0], tuple_(Response.generation_time, Response.id) < tuple(after)
+        )
+    if until is not None and (after is None or until <= after[0]):
+        query = query.where(Response.generation_time < until)
+    query = query.order_by(Response.generation_time.desc(), Response.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    return page(rows, limit, lambda row: [row.generation_time, row.id])
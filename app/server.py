@@ -0,0 +1,36 @@
+from uvicorn.workers import UvicornWorker
+from app.config import settings
+
+
+class DrainingUvicornWorker(UvicornWorker):
+    """
+    The uvicorn gunicorn worker with a bounded graceful shutdown.
+
+    On SIGTERM (a stop, a reload or recycling after `max_requests`) the worker stops
+    accepting connections and lets in-flight requests, completions and SSE streams
+    included, run for up to `settings.SERVER_DRAIN_TIMEOUT` seconds; what is still
+    running then is cancelled (a cancelled stream still persists the text it relayed).
+    The app's shutdown hook runs next and flushes the write-behind queue. The stock
+    worker waits for connections without a limit until gunicorn kills it, which skips
+    the shutdown hook.
+    """
+
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": settings.SERVER_DRAIN_TIMEOUT}
+
+
+def reset_after_fork() -> None:
+    """
+    Drops process state a worker inherits from the preloading master: pooled database
+    connections, shared HTTP/Redis clients and the logging listener (whose thread is
+    not copied by fork). Each is recreated by the worker on first use or by the app's
+    startup hook. Nothing is closed, since the master still owns those resources.
+    """
+    from app.database import engine
+    from app.utils.logger import discard_logging
+    from app.utils.openai_client import discard_openai_client
+    from app.utils.redis_client import discard_redis
+
+    engine.sync_engine.dispose(close=False)
+    discard_openai_client()
+    discard_redis()
+    discard_logging()
@@ -1,12 +1,15 @@
-from typing import Optional
+import time
+from typing import NamedTuple, Optional
 from datetime import timedelta, datetime
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import HTTPBearer
 from jose import jwt, JWTError
-from app.database import get_db
-from sqlalchemy.orm import Session
+from app.database import get_db, SessionLocal
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.models import User
 from app.config import settings
+from app.utils.cache import TTLCache
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -20,7 +23,8 @@ def create_access_token(user_id: int, expires_delta: Optional[timedelta] = None)
 
 def verify_token(token: str, issuer: str = None, audience: str = None):
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+        # `sub` holds the integer user id (see create_access_token), so skip jose's string check
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM], options={"verify_sub": False})
         return payload
     except JWTError:
         raise HTTPException(
@@ -29,25 +33,106 @@ def verify_token(token: str, issuer: str = None, audience: str = None):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-async def authenticate_user(request: Request, db: Session = Depends(get_db)):
+class Principal(NamedTuple):
+    """The authenticated user as attached to `request.state.user`."""
+    id: int
+    username: str
+
+
+class TokenCache:
+    """
+    Bounded cache of verified token -> Principal. An entry lives for at most
+    `settings.AUTH_CACHE_TTL` seconds and never past the token's own `exp` claim.
+    """
+
+    def __init__(self, max_entries: int = settings.AUTH_CACHE_MAX_ENTRIES, ttl: float = settings.AUTH_CACHE_TTL):
+        self._cache = TTLCache(max_entries, ttl)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        principal = self._cache.get(token)
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    def set(self, token: str, principal: Principal, exp: Optional[float]) -> None:
+        ttl = self.ttl if exp is None else min(self.ttl, exp - time.time())
+        if ttl > 0:
+            self._cache.set(token, principal, ttl=ttl)
+
+    def revoke_token(self, token: str) -> None:
+        self._cache.delete(token)
+
+    def invalidate_user(self, user_id: int) -> None:
+        # Revocations are rare, so a scan of the (bounded) cache is fine here.
+        for token, principal in self._cache.items():
+            if principal.id == user_id:
+                self._cache.delete(token)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+token_cache = TokenCache()
+
+
+def invalidate_user(user_id: int) -> None:
+    """
+    Drops every cached token of a user; call when the user is revoked or deleted.
+    Only this process's cache is cleared: other workers keep accepting the user's
+    tokens until their entries expire, at most `settings.AUTH_CACHE_TTL` seconds.
+
+    Args:
+        user_id: The id of the revoked user.
+    """
+    token_cache.invalidate_user(user_id)
+
+
+async def _load_principal(db: AsyncSession, user_id) -> Optional[Principal]:
+    row = (await db.execute(select(User.id, User.username).where(User.id == user_id))).first()
+    return Principal(id=row.id, username=row.username) if row else None
+
+
+async def authenticate_user(request: Request, db: Optional[AsyncSession] = None) -> Principal:
     authorization: str = request.headers.get("Authorization")
     if not authorization:
         raise HTTPException(
             status_code=401, detail="Authorization header is missing"
         )
     token = authorization.split(" ")[1]
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = verify_token(token)
         user_id = payload.get("sub")
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        if db is None:
+            # Called from the middleware, outside of FastAPI's dependency injection
+            async with SessionLocal() as session:
+                principal = await _load_principal(session, user_id)
+        else:
+            principal = await _load_principal(db, user_id)
+        if not principal:
             raise HTTPException(status_code=404, detail="User not found")
-        return user
+        token_cache.set(token, principal, payload.get("exp"))
+        return principal
     except JWTError as e:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
 
 bearer_scheme = HTTPBearer()
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    user = authenticate_user(request, db)
+def principal_id(request: Request) -> Optional[int]:
+    # The authenticated user's id; None without authentication (DEBUG)
+    principal = getattr(request.state, "user", None)
+    return principal.id if principal is not None else None
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):
+    # The auth middleware already resolved the user for this request
+    user = getattr(request.state, "user", None)
+    if user is None:
+        user = await authenticate_user(request, db)
     return user
\ No newline at end of file
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.redis_client import get_redis
+
+REDIS_KEY_PREFIX = "response-cache:"
+
+
+def normalize_request(request) -> Dict[str, Any]:
+    """
+    Returns the fields of a ResponseRequest that determine the completion. The caller
+    and prompt_id are left out, so callers share entries; a hit is stored as a new row
+    for the caller (app/routers/responses/services.py).
+
+    Args:
+        request: The validated ResponseRequest.
+
+    Returns:
+        A plain dict with the prompt text, model and sampling parameters, plus the
+        earlier chat messages when the request carries any.
+    """
+    normalized = {
+        "prompt": request.prompt.strip(),
+        "model": request.model,
+        "max_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "frequency_penalty": request.frequency_penalty,
+        "presence_penalty": request.presence_penalty,
+        "parameters": request.parameters or {},
+    }
+    if request.context:
+        normalized["context"] = request.context
+    return normalized
+
+
+def request_key(request) -> str:
+    """
+    Returns a stable hash of the normalized request (parameters are key-sorted).
+
+    Args:
+        request: The validated ResponseRequest.
+
+    Returns:
+        A hex SHA-256 digest.
+    """
+    payload = json.dumps(normalize_request(request), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def items(self):
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of generated responses: a local TTLCache in front of an optional
+    shared Redis tier (REDIS_HOST/REDIS_PORT). Redis failures are logged and treated
+    as misses so the cache never fails a request.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = settings.RESPONSE_CACHE_TTL,
+        use_redis: bool = settings.RESPONSE_CACHE_REDIS,
+        redis=None,
+    ):
+        self.local = TTLCache(max_entries, ttl)
+        self.ttl = ttl
+        self.use_redis = use_redis or redis is not None
+        self._redis = redis
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, request) -> bool:
+        """
+        Only deterministic requests (temperature 0) are cached unless the caller opts in
+        with `cache=True`; `cache=False` always bypasses the cache.
+        """
+        if not settings.RESPONSE_CACHE_ENABLED or request.cache is False:
+            return False
+        return request.cache is True or request.temperature == 0
+
+    def _get_redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.use_redis:
+            try:
+                raw = await self._get_redis().get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                get_logger().warning("Response cache Redis read failed: %s", e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self.local.set(key, value)
+                self.hits += 1
+                self.redis_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.local.set(key, value)
+        if self.use_redis:
+            try:
+                await self._get_redis().set(
+                    REDIS_KEY_PREFIX + key, json.dumps(value, default=str), ex=int(self.ttl)
+                )
+            except Exception as e:
+                get_logger().warning("Response cache Redis write failed: %s", e)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.local.evictions,
+            "size": len(self.local),
+        }
+
+
+response_cache = ResponseCache()
@@ -1,4 +1,5 @@
-from typing import Union, Dict, Any
+from datetime import datetime
+from typing import Union, Dict, Any, List, Optional
 from pydantic import BaseModel, validator, ValidationError
 from app.utils.logger import get_logger
 from app.config import settings  # For accessing configuration settings
@@ -24,7 +25,7 @@ class DataValidator:
             prompt_model = PromptCreate(**prompt)
             return prompt_model.dict()
         except ValidationError as e:
-            self.logger.error(f"Prompt validation error: {e}")
+            self.logger.error("Prompt validation error: %s", e)
             raise
 
     def validate_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
@@ -43,9 +44,17 @@ class DataValidator:
             response_model = ResponseRequest(**response)
             return response_model.dict()
         except ValidationError as e:
-            self.logger.error(f"Response validation error: {e}")
+            self.logger.error("Response validation error: %s", e)
             raise
 
+def served_model(value: str) -> str:
+    # Valid models are the ones some registered backend serves (see app/providers)
+    from app.providers import provider_registry
+
+    if not provider_registry.serves(value):
+        raise ValueError(f"Invalid model: {value} (available: {', '.join(provider_registry.models())})")
+    return value
+
 class PromptCreate(BaseModel):
     text: str
     model: str = "text-davinci-003"  # Example model name
@@ -89,10 +98,152 @@ class ResponseRequest(BaseModel):
     prompt: str
     model: str
     parameters: Union[Dict[str, Any], None] = None
+    prompt_id: Optional[int] = None
+    max_tokens: int = 100
+    temperature: float = 0.5
+    top_p: float = 1.0
+    frequency_penalty: float = 0.0
+    presence_penalty: float = 0.0
+    cache: Optional[bool] = None  # None: cache only deterministic requests; True/False: force
+    # Earlier chat messages ({"role", "content"}) sent before the prompt; the conversation API fills it in
+    context: Optional[List[Dict[str, str]]] = None
     # ... (Other parameters based on the OpenAI model)
 
     @validator("model")
     def model_validation(cls, value):
-        if value not in settings.VALID_OPENAI_MODELS:
-            raise ValueError(f"Invalid OpenAI model: {value}")
-        return value
\ No newline at end of file
+        return served_model(value)
+
+    @validator("context")
+    def context_messages(cls, value):
+        for message in value or ():
+            if set(message) != {"role", "content"} or message["role"] not in ("system", "user", "assistant"):
+                raise ValueError('context messages are {"role": "system", "user" or "assistant", "content": str}')
+        return value
+
+class PromptBatchCreate(BaseModel):
+    prompts: List[PromptCreate]
+
+    @validator("prompts")
+    def prompts_size(cls, value):
+        if not value:
+            raise ValueError("prompts must not be empty")
+        if len(value) > settings.PROMPT_BATCH_MAX_SIZE:
+            raise ValueError(f"at most {settings.PROMPT_BATCH_MAX_SIZE} prompts per batch")
+        return value
+
+class ResponseBatchRequest(BaseModel):
+    requests: List[ResponseRequest]
+    concurrency: Optional[int] = None  # Capped at settings.BATCH_MAX_CONCURRENCY
+    stream: bool = False  # Emit NDJSON lines as items complete instead of one ordered list
+
+    @validator("requests")
+    def requests_size(cls, value):
+        if not value:
+            raise ValueError("requests must not be empty")
+        if len(value) > settings.RESPONSE_BATCH_MAX_SIZE:
+            raise ValueError(f"at most {settings.RESPONSE_BATCH_MAX_SIZE} requests per batch")
+        return value
+
+    @validator("concurrency")
+    def concurrency_positive(cls, value):
+        if value is not None and value <= 0:
+            raise ValueError("concurrency must be a positive integer")
+        return value
+
+class ConversationCreate(BaseModel):
+    model: str
+    system_prompt: Optional[str] = None
+
+    @validator("model")
+    def model_validation(cls, value):
+        return served_model(value)
+
+class ConversationMessage(BaseModel):
+    text: str
+    max_tokens: int = 100  # Also the room kept free for the reply when windowing the history
+    temperature: float = 0.5
+    top_p: float = 1.0
+    frequency_penalty: float = 0.0
+    presence_penalty: float = 0.0
+    cache: Optional[bool] = None
+
+    @validator("max_tokens")
+    def max_tokens_positive(cls, value):
+        if value <= 0:
+            raise ValueError("max_tokens must be a positive integer")
+        return value
+
+    @validator("temperature", "top_p", "frequency_penalty", "presence_penalty")
+    def unit_range(cls, value):
+        if value < 0 or value > 1:
+            raise ValueError("must be between 0 and 1")
+        return value
+
+# Read API output. `text` is only present when the caller asks for it (include_text=true)
+class PromptOut(BaseModel):
+    id: int
+    model: str
+    parameters: Optional[Dict[str, Any]] = None
+    token_count: Optional[int] = None
+    user_id: Optional[int] = None
+    text: Optional[str] = None
+
+class ResponseOut(BaseModel):
+    id: Optional[int] = None  # None while the row is queued for write-behind (WRITE_BEHIND_ENABLED)
+    model: str
+    parameters: Optional[Dict[str, Any]] = None
+    generation_time: datetime
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    prompt_id: Optional[int] = None
+    text: Optional[str] = None
+
+class PromptPage(BaseModel):
+    items: List[PromptOut]
+    next_cursor: Optional[str] = None  # Pass back as `cursor` for the next page; None on the last one
+
+class ResponsePage(BaseModel):
+    items: List[ResponseOut]
+    next_cursor: Optional[str] = None
+
+class ConversationOut(BaseModel):
+    id: int
+    model: str
+    system_prompt: Optional[str] = None
+    summary: Optional[str] = None
+    summarized_turns: int = 0
+    turn_count: int = 0
+    user_id: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
+
+class ConversationPage(BaseModel):
+    items: List[ConversationOut]
+    next_cursor: Optional[str] = None
+
+class TurnOut(BaseModel):
+    position: int
+    prompt_id: int
+    response_id: Optional[int] = None  # None until a write-behind row is flushed
+    text: str
+    reply: str
+    prompt_tokens: int
+    reply_tokens: int
+
+class TurnPage(BaseModel):
+    items: List[TurnOut]
+    next_cursor: Optional[str] = None
+
+class ConversationReply(TurnOut):
+    context_turns: int  # Earlier turns sent with the message; older ones were trimmed or summarized
+    context_tokens: int  # Tokens of the system prompt, summary and those turns
+
+
+def validate_prompt(prompt: Dict[str, Any]) -> Dict[str, Any]:
+    """Module-level shortcut for `DataValidator().validate_prompt`."""
+    return DataValidator().validate_prompt(prompt)
+
+
+def validate_response(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Module-level shortcut for `DataValidator().validate_response`."""
+    return DataValidator().validate_response(response)
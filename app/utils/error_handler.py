@@ -1,7 +1,7 @@
 from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
 from app.utils.logger import get_logger
-from openai.error import OpenAIError
+from app.utils.openai_client import is_openai_error
 from sqlalchemy.exc import OperationalError
 
 async def handle_exception(exc: Exception, logger: get_logger, request: Request) -> JSONResponse:
@@ -16,9 +16,9 @@ async def handle_exception(exc: Exception, logger: get_logger, request: Request)
     Returns:
         A JSONResponse containing a formatted error message.
     """
-    logger.error(f"Request: {request.method} {request.url}\nError: {exc}")
+    logger.error("Request: %s %s\nError: %s", request.method, request.url, exc)
 
-    if isinstance(exc, OpenAIError):
+    if is_openai_error(exc):
         error_message = f"OpenAI API Error: {exc}"
         status_code = 500
     elif isinstance(exc, OperationalError):
@@ -1,21 +1,155 @@
+import json
 import logging
+import logging.handlers
+import queue
+import random
+from typing import Dict, Optional
 from app.config import settings
 
+LOGGER_NAME = "ai_response_wrapper"
+
+# Background thread that owns the file handler; started once by configure_logging().
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is
+# emitted as an additional JSON field.
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records of each configured level."""
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands the record over untouched. The stock handler merges the
+    message arguments in the calling thread; here that happens on the listener thread,
+    so the request path only pays for the enqueue.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_sample_rates(value: str) -> Dict[int, float]:
+    """
+    Parses `LOG_SAMPLE_RATES` (e.g. "INFO=0.1,DEBUG=0.01") into {levelno: rate}.
+
+    Args:
+        value: Comma-separated LEVEL=rate pairs.
+
+    Returns:
+        A dict mapping logging levels to the fraction of records to keep.
+    """
+    rates = {}
+    for pair in filter(None, (part.strip() for part in value.split(","))):
+        level, rate = pair.split("=", 1)
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+def _build_file_handler() -> logging.Handler:
+    if settings.LOG_ROTATION == "external":
+        # Several processes share the file (gunicorn workers): each reopens it once logrotate moved it
+        return logging.handlers.WatchedFileHandler(settings.LOG_FILE)
+    if settings.LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            settings.LOG_FILE, when=settings.LOG_ROTATE_WHEN, backupCount=settings.LOG_BACKUP_COUNT
+        )
+    return logging.handlers.RotatingFileHandler(
+        settings.LOG_FILE, maxBytes=settings.LOG_MAX_BYTES, backupCount=settings.LOG_BACKUP_COUNT
+    )
+
+
+def configure_logging(level: str = settings.LOG_LEVEL, handler: Optional[logging.Handler] = None) -> logging.Logger:
+    """
+    Configures the application logger once: JSON lines written by a background
+    QueueListener to a rotating file, with per-level sampling applied on the caller side.
+
+    Args:
+        level: The logging level to use. Defaults to `settings.LOG_LEVEL`.
+        handler: Optional handler replacing the rotating file handler (e.g. in tests).
+
+    Returns:
+        The configured logging.Logger instance.
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    if _listener is not None:
+        return logger
+    target = handler or _build_file_handler()
+    target.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+    _listener.start()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(settings.LOG_SAMPLE_RATES)))
+    logger.handlers = [queue_handler]
+    logger.setLevel(getattr(logging, level.upper()))
+    logger.propagate = False
+    return logger
+
+
+def shutdown_logging() -> None:
+    """
+    Stops the listener thread after it has written every queued record.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        logging.getLogger(LOGGER_NAME).handlers = []
+
+
+def discard_logging() -> None:
+    """
+    Forgets a listener inherited from the parent process, whose thread did not survive
+    the fork; the next `configure_logging` or `get_logger` call starts this process's own.
+    """
+    global _listener
+    _listener = None
+    logging.getLogger(LOGGER_NAME).handlers = []
+
+
 def get_logger(level: str = settings.LOG_LEVEL) -> logging.Logger:
     """
-    Returns a configured logger instance.
+    Returns the application logger, configuring it on first use.
 
     Args:
         level: The logging level to use (e.g., "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"). Defaults to `settings.LOG_LEVEL`.
+               Only applied when the logger is configured.
 
     Returns:
         A configured logging.Logger instance.
     """
-    logger = logging.getLogger("ai_response_wrapper")
-    logging.basicConfig(
-        level=getattr(logging, level.upper()),
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        filename="app.log",
-        filemode="a",
-    )
-    return logger
\ No newline at end of file
+    if _listener is None:
+        return configure_logging(level)
+    return logging.getLogger(LOGGER_NAME)
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from fastapi import HTTPException
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from prometheus_client.registry import Collector
+from sqlalchemy.exc import OperationalError
+from app.config import settings
+from app.utils.openai_client import is_openai_error
+
+# Buckets from 5ms to ~1min: wide enough for both local DB calls and slow completions.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Total request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+AUTH_LATENCY = Histogram("auth_duration_seconds", "Time spent authenticating a request", buckets=LATENCY_BUCKETS)
+DB_ACQUIRE_LATENCY = Histogram(
+    "db_session_acquire_seconds", "Time to check a connection out of the pool", buckets=LATENCY_BUCKETS
+)
+DB_COMMIT_LATENCY = Histogram("db_commit_seconds", "Time spent committing", ["table"], buckets=LATENCY_BUCKETS)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Model call latency including retries",
+    ["provider", "model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "time_to_first_token_seconds", "Time until the first streamed delta", ["model"], buckets=LATENCY_BUCKETS
+)
+TOKENS = Counter("tokens_total", "Prompt (in) and completion (out) tokens", ["model", "direction"])
+CACHE_LOOKUPS = Counter("response_cache_lookups_total", "Response cache lookups", ["model", "result"])
+QUEUE_WAIT = Histogram(
+    "scheduler_queue_wait_seconds", "Time spent waiting for an upstream slot", ["model", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+SHED_REQUESTS = Counter("scheduler_shed_total", "Requests rejected by admission control", ["model", "priority", "reason"])
+ERRORS = Counter("errors_total", "Failed requests by error class", ["error_class", "route"])
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a timer",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+# Registered StatsCollectors, also rendered in multiprocess mode (see `render_metrics`)
+_stats_collectors: List["StatsCollector"] = []
+
+
+class StatsCollector(Collector):
+    """
+    Exposes a component's `stats()` dict as gauges at scrape time, so counters the
+    component already keeps (cache hits, queue depth, ...) cost nothing on the hot path.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], Dict]):
+        self.prefix = prefix
+        self.stats = stats
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        for name, value in self.stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield GaugeMetricFamily(f"{self.prefix}_{name}", f"{self.prefix} {name}", value=value)
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict]) -> None:
+    """
+    Registers a component's `stats()` with the default registry.
+
+    Args:
+        prefix: Metric name prefix, e.g. "response_cache".
+        stats: Zero-argument callable returning a dict of numbers.
+    """
+    collector = StatsCollector(prefix, stats)
+    REGISTRY.register(collector)
+    _stats_collectors.append(collector)
+
+
+def render_metrics():
+    """
+    Returns the current metrics in the Prometheus text format.
+
+    Under gunicorn (PROMETHEUS_MULTIPROC_DIR set, see gunicorn.conf.py) the counters and
+    histograms are aggregated over every worker from their files; the `register_stats`
+    gauges are those of the worker serving the scrape.
+
+    Returns:
+        A (body, content type) tuple.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _stats_collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class LoopLagMonitor:
+    """
+    Background task recording how late the event loop runs a timer set `interval`
+    seconds ahead (`event_loop_lag_seconds`). Every request on the worker waits that
+    long too: lag comes from blocking calls and CPU-bound stretches on the loop.
+    """
+
+    def __init__(self, interval: float = settings.LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.samples = 0
+        self.last = 0.0
+        self.max = 0.0
+
+    async def start(self) -> None:
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - expected)
+            self.max = max(self.max, self.last)
+            self.samples += 1
+            EVENT_LOOP_LAG.observe(self.last)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"samples": self.samples, "last_seconds": self.last, "max_seconds": self.max}
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording `http_request_duration_seconds` and `errors_total`.
+
+    The route label is the matched path template (e.g. "/responses/"), never the raw
+    URL, so label cardinality stays bounded. Written against the ASGI interface rather
+    than BaseHTTPMiddleware to keep the per-request overhead to a few microseconds.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            ERRORS.labels(classify_exception(exc), _route(scope)).inc()
+            raise
+        finally:
+            route = _route(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
+        if status >= 400:
+            ERRORS.labels("http", route).inc()
+
+
+def _route(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def classify_exception(exc: Exception) -> str:
+    """
+    Returns the error class of an exception, matching the branches of
+    `app.utils.error_handler.handle_exception`.
+
+    Args:
+        exc: The raised exception.
+
+    Returns:
+        One of "openai", "database", "http" or "unexpected".
+    """
+    if is_openai_error(exc):
+        return "openai"
+    if isinstance(exc, OperationalError):
+        return "database"
+    if isinstance(exc, HTTPException):
+        return "http"
+    return "unexpected"
@@ -0,0 +1,104 @@
+import sys
+from typing import TYPE_CHECKING, Optional
+from app.config import settings
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Process-wide client shared by every route. Created in the startup hook and
+# closed in the shutdown hook of app/main.py. The SDK (and httpx) is imported when
+# the first client is built, not with the app.
+_client: Optional["AsyncOpenAI"] = None
+
+
+def is_openai_error(exc: BaseException, name: str = "OpenAIError") -> bool:
+    """
+    Returns whether `exc` is an instance of the OpenAI SDK exception class `name`,
+    without importing the SDK: until a client was built it is not loaded, and nothing
+    can have raised one of its errors.
+
+    Args:
+        exc: The exception to classify.
+        name: An exception class of the `openai` module, e.g. "RateLimitError".
+
+    Returns:
+        True if `exc` is an instance of `openai.<name>`.
+    """
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(exc, getattr(openai, name))
+
+
+def build_openai_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> "AsyncOpenAI":
+    """
+    Builds an AsyncOpenAI client backed by a pooled keep-alive httpx client.
+
+    Args:
+        base_url: API base URL. Defaults to `settings.OPENAI_BASE_URL`.
+        api_key: API key. Defaults to `settings.OPENAI_API_KEY`.
+
+    Returns:
+        A configured AsyncOpenAI instance.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    limits = httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+    http_client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=settings.OPENAI_HTTP2)
+    return AsyncOpenAI(
+        api_key=api_key or settings.OPENAI_API_KEY,
+        base_url=base_url or settings.OPENAI_BASE_URL,
+        timeout=timeout,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+async def init_openai_client() -> "AsyncOpenAI":
+    """
+    Creates the shared client if it does not exist yet.
+
+    Returns:
+        The shared AsyncOpenAI instance.
+    """
+    global _client
+    if _client is None:
+        _client = build_openai_client()
+    return _client
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    """
+    Returns the shared client, creating it lazily when the startup hook has not run
+    (e.g. in scripts and tests).
+
+    Returns:
+        The shared AsyncOpenAI instance.
+    """
+    global _client
+    if _client is None:
+        _client = build_openai_client()
+    return _client
+
+
+def discard_openai_client() -> None:
+    """
+    Drops the shared client without closing it, in a process forked after it was
+    created: its connections belong to the parent.
+    """
+    global _client
+    _client = None
+
+
+async def close_openai_client() -> None:
+    """
+    Closes the shared client and its connection pool.
+    """
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,63 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+from fastapi import HTTPException
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encodes the sort key of the last row of a page as an opaque cursor.
+
+    Args:
+        values: The row's sort key, e.g. `[id]` or `[generation_time, id]`.
+
+    Returns:
+        A URL-safe base64 string.
+    """
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], types: Sequence[type]) -> Optional[List[Any]]:
+    """
+    Decodes a cursor produced by `encode_cursor`.
+
+    Args:
+        cursor: The `cursor` query parameter, or None for the first page.
+        types: The type of each sort key column (`int` or `datetime`).
+
+    Returns:
+        The sort key values, or None when `cursor` is None.
+
+    Raises:
+        HTTPException: 400 when the cursor is malformed.
+    """
+    if cursor is None:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types)]
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page(rows: Sequence[Any], limit: int, key) -> dict:
+    """
+    Builds a page from a query that fetched `limit + 1` rows.
+
+    Args:
+        rows: The fetched rows, in page order.
+        limit: The requested page size.
+        key: Returns the sort key of a row (see `encode_cursor`).
+
+    Returns:
+        `{"items": [...], "next_cursor": str | None}` with each item a dict of the
+        selected columns; `next_cursor` is None on the last page.
+    """
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
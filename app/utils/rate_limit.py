@@ -0,0 +1,288 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from fastapi import HTTPException
+from app.config import settings
+from app.utils.cache import TTLCache
+from app.utils.logger import get_logger
+from app.utils.redis_client import get_redis
+from app.utils.tokenizer import context_tokens, count_tokens
+
+REDIS_KEY_PREFIX = "rate-limit:"
+
+# Refills both buckets of a (user, model) pair, then takes one request and `tokens`
+# tokens if both have enough and the user is below its in-flight limit. Returns the
+# number of seconds to wait as a string (Redis truncates Lua numbers to integers):
+# "0" when admitted, "-1" when only the in-flight limit was hit.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local function level(key, rate, capacity)
+    local state = redis.call("hmget", key, "level", "updated")
+    local current = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    return math.min(capacity, current + math.max(0, now - updated) * rate)
+end
+local request_rate, token_rate = tonumber(ARGV[2]), tonumber(ARGV[4])
+local request_capacity, token_capacity = tonumber(ARGV[3]), tonumber(ARGV[5])
+local cost, max_in_flight = tonumber(ARGV[6]), tonumber(ARGV[7])
+local wait = 0
+local requests, tokens
+if request_rate > 0 then
+    requests = level(KEYS[1], request_rate, request_capacity)
+    if requests < 1 then wait = math.max(wait, (1 - requests) / request_rate) end
+end
+if token_rate > 0 then
+    tokens = level(KEYS[2], token_rate, token_capacity)
+    if tokens < cost then wait = math.max(wait, (cost - tokens) / token_rate) end
+end
+if wait > 0 then return tostring(wait) end
+if max_in_flight > 0 and tonumber(redis.call("get", KEYS[3]) or "0") >= max_in_flight then
+    return "-1"
+end
+if requests then
+    redis.call("hset", KEYS[1], "level", requests - 1, "updated", now)
+    redis.call("expire", KEYS[1], 120)
+end
+if tokens then
+    redis.call("hset", KEYS[2], "level", tokens - cost, "updated", now)
+    redis.call("expire", KEYS[2], 120)
+end
+if redis.call("incr", KEYS[3]) == 1 then
+    -- Only the first slot sets the TTL, so a busy user's leaked slots still expire
+    redis.call("expire", KEYS[3], tonumber(ARGV[8]))
+end
+return "0"
+"""
+
+# Frees one in-flight slot; the key is deleted instead of going below zero (a slot
+# whose counter already expired must not hand out an extra one).
+RELEASE_SCRIPT = """
+if redis.call("decr", KEYS[1]) <= 0 then
+    redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def estimate_tokens(request) -> int:
+    """
+    Returns a rough upper bound of the tokens a completion request will consume.
+
+    Args:
+        request: The validated ResponseRequest.
+
+    Returns:
+        Prompt and context tokens plus the requested `max_tokens`.
+    """
+    return count_tokens(request.prompt, request.model) + context_tokens(request) + (request.max_tokens or 0)
+
+
+class TokenBucket:
+    """Classic token bucket: holds up to `capacity` units and refills at `rate` units per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 when they already are)."""
+        if self.rate <= 0 or self.level >= amount:
+            return 0.0
+        return (min(amount, self.capacity) - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate > 0:
+            self.level -= amount
+
+
+class RateLimiter:
+    """
+    Per-user, per-model admission control for upstream completions.
+
+    Each (user, model) pair has a token bucket for requests per minute and one for
+    (estimated) tokens per minute; each user additionally has a cap on concurrent
+    in-flight completions. A limit of 0 disables that check. Rejections raise a 429
+    whose Retry-After tells the client when the buckets will have refilled.
+
+    Buckets live in-process by default. With `use_redis` the check runs as one Lua
+    script against Redis so every worker shares the same budget.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = settings.RATE_LIMIT_ENABLED,
+        requests_per_minute: int = settings.RATE_LIMIT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = settings.RATE_LIMIT_TOKENS_PER_MINUTE,
+        max_in_flight: int = settings.RATE_LIMIT_MAX_IN_FLIGHT,
+        use_redis: bool = settings.RATE_LIMIT_REDIS,
+        redis=None,
+        max_keys: int = 100000,
+    ):
+        self.enabled = enabled
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.use_redis = use_redis or redis is not None
+        self._redis = redis
+        # An idle bucket is full again after a minute, so forgetting it is harmless.
+        self._buckets = TTLCache(max_keys, ttl=60)
+        self._in_flight: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    def _get_redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def _buckets_for(self, user: str, model: str):
+        key = f"{user}:{model}"
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = (
+                TokenBucket(self.requests_per_minute / 60, self.requests_per_minute),
+                TokenBucket(self.tokens_per_minute / 60, self.tokens_per_minute),
+            )
+        self._buckets.set(key, buckets)
+        return buckets
+
+    def _try_acquire_local(self, user: str, model: str, tokens: int) -> float:
+        requests, budget = self._buckets_for(user, model)
+        now = time.monotonic()
+        requests.refill(now)
+        budget.refill(now)
+        wait = max(requests.wait_time(1), budget.wait_time(tokens))
+        if wait > 0:
+            return wait
+        if self.max_in_flight and self._in_flight.get(user, 0) >= self.max_in_flight:
+            return -1.0
+        requests.take(1)
+        budget.take(tokens)
+        self._in_flight[user] = self._in_flight.get(user, 0) + 1
+        return 0.0
+
+    async def _try_acquire_redis(self, user: str, model: str, tokens: int) -> float:
+        prefix = REDIS_KEY_PREFIX + user
+        result = await self._get_redis().eval(
+            ACQUIRE_SCRIPT,
+            3,
+            f"{prefix}:{model}:requests",
+            f"{prefix}:{model}:tokens",
+            f"{prefix}:in-flight",
+            time.time(),
+            self.requests_per_minute / 60,
+            self.requests_per_minute,
+            self.tokens_per_minute / 60,
+            self.tokens_per_minute,
+            tokens,
+            self.max_in_flight,
+            int(settings.OPENAI_TIMEOUT) + 60,  # Frees slots of workers that died mid-request
+        )
+        return float(result)
+
+    async def acquire(self, user: str, model: str, tokens: int, max_wait: float = 0.0) -> Optional[str]:
+        """
+        Admits one completion or raises a 429.
+
+        Args:
+            user: The user key (see `user_key`).
+            model: The requested model.
+            tokens: Estimated tokens of the request (see `estimate_tokens`).
+            max_wait: Seconds the caller is willing to wait for the buckets to refill
+                instead of being rejected right away (used by batch jobs).
+
+        Returns:
+            The backend that admitted the request ("redis", or "local" also when Redis
+            failed), to hand back to `release`; None when rate limiting is disabled.
+
+        Raises:
+            HTTPException: 429 with a Retry-After header.
+        """
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        while True:
+            backend = "redis" if self.use_redis else "local"
+            if self.use_redis:
+                try:
+                    wait = await self._try_acquire_redis(user, model, tokens)
+                except Exception as e:
+                    get_logger().warning("Rate limit Redis check failed, using local buckets: %s", e)
+                    backend = "local"
+                    wait = self._try_acquire_local(user, model, tokens)
+            else:
+                wait = self._try_acquire_local(user, model, tokens)
+            if wait == 0:
+                self.admitted += 1
+                return backend
+            retry_after = wait if wait > 0 else 1.0  # In-flight limit: no refill time to report
+            if loop.time() + retry_after > deadline:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Rate limit exceeded" if wait > 0 else "Too many concurrent requests",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                )
+            await asyncio.sleep(min(retry_after, 1.0))
+
+    async def release(self, user: str, backend: Optional[str] = "local") -> None:
+        """
+        Frees the in-flight slot taken by a successful `acquire`.
+
+        Args:
+            user: The same user key passed to `acquire`.
+            backend: What `acquire` returned: the slot is freed where it was taken.
+        """
+        if backend is None:
+            return
+        if backend == "redis":
+            try:
+                await self._get_redis().eval(RELEASE_SCRIPT, 1, f"{REDIS_KEY_PREFIX}{user}:in-flight")
+            except Exception as e:
+                # The counter expires on its own (see `_try_acquire_redis`)
+                get_logger().warning("Rate limit Redis release failed: %s", e)
+            return
+        remaining = self._in_flight.get(user, 0) - 1
+        if remaining > 0:
+            self._in_flight[user] = remaining
+        else:
+            self._in_flight.pop(user, None)
+
+    @asynccontextmanager
+    async def limit(self, user: str, model: str, tokens: int, max_wait: float = 0.0) -> AsyncIterator[None]:
+        """Holds an admission (and in-flight slot) for the duration of the block."""
+        backend = await self.acquire(user, model, tokens, max_wait)
+        try:
+            yield
+        finally:
+            await self.release(user, backend)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "in_flight": sum(self._in_flight.values()),
+        }
+
+
+def user_key(principal) -> str:
+    """
+    Returns the rate-limit key of the authenticated principal (`request.state.user`).
+
+    Args:
+        principal: The Principal attached by the auth middleware, or None.
+
+    Returns:
+        "user:<id>", or "anonymous" when authentication is disabled (DEBUG).
+    """
+    return f"user:{principal.id}" if principal is not None else "anonymous"
+
+
+rate_limiter = RateLimiter()
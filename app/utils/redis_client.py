@@ -0,0 +1,39 @@
+from app.config import settings
+
+# Process-wide asyncio Redis client shared by every Redis-backed component.
+# redis.asyncio is imported on first use so deployments without Redis never load it.
+_redis = None
+
+
+def get_redis():
+    """
+    Returns the shared redis.asyncio client for REDIS_HOST/REDIS_PORT, creating it lazily.
+
+    Returns:
+        A redis.asyncio.Redis instance.
+    """
+    global _redis
+    if _redis is None:
+        import redis.asyncio as aioredis
+
+        _redis = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    return _redis
+
+
+def discard_redis() -> None:
+    """
+    Drops the shared client without closing it, in a process forked after it was
+    created: its connections belong to the parent.
+    """
+    global _redis
+    _redis = None
+
+
+async def close_redis() -> None:
+    """
+    Closes the shared client if it was ever created.
+    """
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.openai_client import is_openai_error
+from app.utils.scheduler import request_timeout
+
+# Upstream status codes worth another attempt; anything else 4xx is the caller's fault.
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while a model's circuit is open."""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Circuit for {key} is open")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's upstream time budget ran out before a successful attempt."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Returns whether an upstream failure is transient.
+
+    Args:
+        exc: The exception raised by an attempt.
+
+    Returns:
+        True for timeouts, connection errors and 408/409/429/5xx responses.
+    """
+    httpx = sys.modules.get("httpx")  # Loaded with the first HTTP client
+    if isinstance(exc, asyncio.TimeoutError) or (httpx is not None and isinstance(exc, httpx.TransportError)):
+        return True
+    if is_openai_error(exc, "APITimeoutError") or is_openai_error(exc, "APIConnectionError"):
+        return True
+    if is_openai_error(exc, "APIStatusError"):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    Returns the delay requested by the upstream's `Retry-After` header, if any.
+
+    Args:
+        exc: The exception raised by an attempt.
+
+    Returns:
+        The delay in seconds, or None when the header is missing or not a number.
+    """
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    Returns the delay before the next attempt: exponential backoff with full jitter,
+    but never shorter than what the upstream asked for.
+
+    Args:
+        attempt: The number of the attempt that just failed (1-based).
+        base: Delay scale of the first retry in seconds.
+        cap: Upper bound of the jittered delay in seconds.
+        retry_after: The upstream's `Retry-After`, if any.
+
+    Returns:
+        The delay in seconds.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    return max(delay, retry_after) if retry_after is not None else delay
+
+
+class LatencyWindow:
+    """Rolling window of recent successful call latencies."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; open rejects calls
+    for `reset_timeout` seconds, then lets a single probe through (half-open). The
+    probe's outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self, key: str) -> None:
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(key, max(retry_after, 0.0))
+        if state == "half_open":
+            self._probing = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_cancel(self) -> None:
+        self._probing = False  # Let the next caller probe instead
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or (self.failure_threshold and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class ResilientCaller:
+    """
+    Runs upstream calls with retries, an overall deadline, optional hedging and a
+    circuit breaker per key (the model name).
+
+    Each attempt gets the time left in the request's budget as its timeout. Transient
+    failures (see `is_retryable`) are retried with jittered exponential backoff that
+    honors `Retry-After`, as long as the delay still fits in the budget. With hedging
+    on, a second identical attempt is started when the first one has not answered
+    after the key's p95 latency, and the first result wins.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = settings.UPSTREAM_MAX_ATTEMPTS,
+        backoff_base: float = settings.UPSTREAM_BACKOFF_BASE,
+        backoff_max: float = settings.UPSTREAM_BACKOFF_MAX,
+        deadline: float = settings.UPSTREAM_DEADLINE,
+        hedge: bool = settings.UPSTREAM_HEDGE_ENABLED,
+        hedge_percentile: float = settings.UPSTREAM_HEDGE_PERCENTILE,
+        hedge_min_samples: int = settings.UPSTREAM_HEDGE_MIN_SAMPLES,
+        failure_threshold: int = settings.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = settings.CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyWindow] = {}
+        self.retries = 0
+        self.hedges = 0
+        self.short_circuited = 0
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def latencies(self, key: str) -> LatencyWindow:
+        window = self._latencies.get(key)
+        if window is None:
+            window = self._latencies[key] = LatencyWindow()
+        return window
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        window = self.latencies(key)
+        if len(window) < self.hedge_min_samples:
+            return None  # Not enough data to know what "slow" is yet
+        return window.percentile(self.hedge_percentile)
+
+    async def call(
+        self,
+        key: str,
+        fn: Callable[[float], Awaitable[Any]],
+        deadline: Optional[float] = None,
+        hedge: Optional[bool] = None,
+    ) -> Any:
+        """
+        Calls `fn` until it succeeds, fails permanently or the budget runs out.
+
+        Args:
+            key: Circuit/latency key, usually the model name.
+            fn: Coroutine function making one attempt; receives the attempt's timeout in seconds.
+            deadline: Overall budget in seconds. Defaults to `settings.UPSTREAM_DEADLINE`.
+            hedge: Overrides the hedging setting (e.g. off for streams).
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            CircuitOpenError: The key's circuit is open.
+            DeadlineExceeded: The budget ran out.
+            Exception: The last attempt's error when it is not retryable or no attempts are left.
+        """
+        logger = get_logger()
+        breaker = self.breaker(key)
+        loop = asyncio.get_running_loop()
+        budget_end = loop.time() + (self.deadline if deadline is None else deadline)
+        hedge = self.hedge if hedge is None else hedge
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                breaker.before_call(key)
+            except CircuitOpenError:
+                self.short_circuited += 1
+                raise
+            remaining = budget_end - loop.time()
+            start = loop.time()
+            try:
+                if hedge:
+                    result = await self._hedged(key, fn, remaining)
+                else:
+                    result = await asyncio.wait_for(fn(remaining), timeout=remaining)
+            except asyncio.CancelledError:
+                breaker.record_cancel()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success()  # The upstream answered; the request was bad
+                    raise
+                if isinstance(e, asyncio.TimeoutError) and self._client_limited():
+                    # The client's own short budget ran out: says nothing about the upstream
+                    breaker.record_cancel()
+                    raise DeadlineExceeded(f"No answer from {key} within the request budget") from e
+                breaker.record_failure()
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, retry_after_seconds(e))
+                remaining = budget_end - loop.time()
+                if attempt >= self.max_attempts or delay >= remaining:
+                    if isinstance(e, asyncio.TimeoutError) or remaining <= 0:
+                        raise DeadlineExceeded(f"No answer from {key} within the request budget") from e
+                    raise
+                logger.warning(
+                    "Upstream attempt %d for %s failed (%s), retrying in %.2fs",
+                    attempt, key, type(e).__name__, delay,
+                )
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            self.latencies(key).add(loop.time() - start)
+            return result
+
+    def _client_limited(self) -> bool:
+        # Only timeouts with the full budget count against the circuit; a client asking
+        # for less (`X-Request-Timeout`) must not open it for everyone
+        timeout = request_timeout.get()
+        return timeout is not None and timeout < self.deadline
+
+    async def _hedged(self, key: str, fn: Callable[[float], Awaitable[Any]], remaining: float) -> Any:
+        loop = asyncio.get_running_loop()
+        end = loop.time() + remaining
+        hedge_after = self.hedge_delay(key)
+        tasks = [asyncio.ensure_future(fn(remaining))]
+        try:
+            if hedge_after is not None and hedge_after < remaining:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    self.hedges += 1
+                    tasks.append(asyncio.ensure_future(fn(end - loop.time())))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=end - loop.time(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "short_circuited": self.short_circuited,
+            "circuits": {key: breaker.state for key, breaker in self._breakers.items()},
+        }
+
+
+upstream = ResilientCaller()
@@ -0,0 +1,226 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional
+from fastapi import HTTPException
+from app.config import settings
+from app.utils.metrics import QUEUE_WAIT, SHED_REQUESTS
+
+# Priority classes, most urgent first.
+PRIORITIES = {"interactive": 0, "batch": 1, "background": 2}
+
+# Absolute event-loop time by which the current request must be answered. Set by
+# `Scheduler.slot` so the upstream call only gets what is left after queueing.
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# The budget that deadline was set from, in seconds: shorter than `UPSTREAM_DEADLINE` when
+# the client asked for less (`X-Request-Timeout`)
+request_timeout: ContextVar[Optional[float]] = ContextVar("request_timeout", default=None)
+
+
+def remaining_budget(default: float) -> float:
+    """
+    Returns the seconds left until the current request's deadline.
+
+    Args:
+        default: Budget to use when no deadline was set (outside the scheduler).
+
+    Returns:
+        The remaining budget in seconds, at most `default`.
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return default
+    return min(default, deadline - asyncio.get_running_loop().time())
+
+
+def _user_priorities() -> Dict[str, str]:
+    return json.loads(settings.SCHEDULER_USER_PRIORITIES) if settings.SCHEDULER_USER_PRIORITIES else {}
+
+
+def resolve_priority(principal, header: Optional[str], default: str = "interactive") -> str:
+    """
+    Returns the priority class of a request.
+
+    The class configured for the user (`SCHEDULER_USER_PRIORITIES`, keyed by user id)
+    or the endpoint's `default` is the highest the request can get; an `X-Priority`
+    header can lower it (e.g. a client marking its own bulk traffic) but never raise it.
+
+    Args:
+        principal: The authenticated user (`request.state.user`), or None.
+        header: The `X-Priority` header value, if any.
+        default: The endpoint's class ("interactive" for single requests, "batch" for batches).
+
+    Returns:
+        One of `PRIORITIES`.
+    """
+    ceiling = default
+    if principal is not None:
+        configured = _user_priorities().get(str(principal.id))
+        if configured in PRIORITIES and PRIORITIES[configured] > PRIORITIES[ceiling]:
+            ceiling = configured
+    if header in PRIORITIES and PRIORITIES[header] > PRIORITIES[ceiling]:
+        return header
+    return ceiling
+
+
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters: List[list] = []  # Heap of [priority rank, sequence, future]
+        self.service_time = 0.0  # Moving average of how long a slot is held
+
+    def queued_ahead(self, rank: int) -> int:
+        return sum(1 for waiter in self.waiters if waiter[0] <= rank and not waiter[2].done())
+
+
+class Scheduler:
+    """
+    Admission control in front of the upstream.
+
+    Each model has at most `max_concurrency` requests running; the rest wait in a
+    priority queue (interactive before batch before background, FIFO within a class),
+    bounded by `max_queue` across all models. A request that cannot be expected to
+    finish before its deadline, going by the queue ahead of it and the model's recent
+    service time, is shed right away with a 503 instead of timing out later.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = settings.SCHEDULER_MAX_CONCURRENCY_PER_MODEL,
+        max_queue: int = settings.SCHEDULER_MAX_QUEUE,
+        enabled: bool = settings.SCHEDULER_ENABLED,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._sequence = itertools.count()
+        self.queued = 0
+        self.shed = 0
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = _ModelQueue(self.max_concurrency)
+        return queue
+
+    def _shed(self, model: str, priority: str, reason: str, retry_after: float) -> HTTPException:
+        self.shed += 1
+        SHED_REQUESTS.labels(model, priority, reason).inc()
+        return HTTPException(
+            status_code=503,
+            detail="Server is at capacity, retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def acquire(self, model: str, priority: str, deadline: float) -> float:
+        """
+        Waits for a slot for `model`.
+
+        Args:
+            model: The requested model.
+            priority: One of `PRIORITIES`.
+            deadline: Absolute event-loop time by which the request must be answered.
+
+        Returns:
+            The time spent queued, in seconds.
+
+        Raises:
+            HTTPException: 503 with Retry-After when the request is shed.
+        """
+        if not self.enabled:
+            return 0.0
+        loop = asyncio.get_running_loop()
+        queue = self._queue(model)
+        rank = PRIORITIES[priority]
+        start = loop.time()
+        if queue.active < queue.limit and not queue.queued_ahead(rank):
+            queue.active += 1
+            QUEUE_WAIT.labels(model, priority).observe(0.0)
+            return 0.0
+        if self.queued >= self.max_queue:
+            raise self._shed(model, priority, "queue_full", queue.service_time)
+        expected_wait = (queue.queued_ahead(rank) + 1) * queue.service_time / queue.limit
+        if start + expected_wait + queue.service_time > deadline:
+            raise self._shed(model, priority, "deadline", expected_wait)
+
+        waiter = loop.create_future()
+        heapq.heappush(queue.waiters, [rank, next(self._sequence), waiter])
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=deadline - start - queue.service_time)
+        except asyncio.TimeoutError:
+            raise self._shed(model, priority, "deadline", queue.service_time)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(model, 0.0)  # The slot was handed to us as we were cancelled
+            raise
+        finally:
+            self.queued -= 1
+        waited = loop.time() - start
+        QUEUE_WAIT.labels(model, priority).observe(waited)
+        return waited
+
+    def release(self, model: str, held_for: float) -> None:
+        """
+        Frees a slot, handing it straight to the most urgent waiter if there is one.
+
+        Args:
+            model: The model passed to `acquire`.
+            held_for: How long the slot was held, for the service time estimate.
+        """
+        if not self.enabled:
+            return
+        queue = self._queue(model)
+        if held_for:
+            queue.service_time = held_for if not queue.service_time else 0.8 * queue.service_time + 0.2 * held_for
+        while queue.waiters:
+            _, _, waiter = heapq.heappop(queue.waiters)
+            if not waiter.done():
+                waiter.set_result(None)  # `active` stays the same: the slot changes hands
+                return
+        queue.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str, timeout: Optional[float] = None) -> AsyncIterator[float]:
+        """
+        Holds a slot for `model` for the duration of the block and sets `request_deadline`.
+
+        Args:
+            model: The requested model.
+            priority: One of `PRIORITIES`.
+            timeout: The request's time budget in seconds. Defaults to `settings.UPSTREAM_DEADLINE`.
+
+        Yields:
+            The time spent queued, in seconds.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = timeout or settings.UPSTREAM_DEADLINE
+        deadline = loop.time() + timeout
+        token = request_deadline.set(deadline)
+        timeout_token = request_timeout.set(timeout)
+        try:
+            waited = await self.acquire(model, priority, deadline)
+            start = loop.time()
+            try:
+                yield waited
+            finally:
+                self.release(model, loop.time() - start)
+        finally:
+            request_deadline.reset(token)
+            request_timeout.reset(timeout_token)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "active": sum(queue.active for queue in self._queues.values()),
+            "shed": self.shed,
+        }
+
+
+scheduler = Scheduler()
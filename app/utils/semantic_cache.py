@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Dict, Optional
+from app.config import settings
+from app.utils.cache import TTLCache, normalize_request
+from app.utils.logger import get_logger
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def namespace(request) -> str:
+    """
+    Returns the index partition of a request: its model plus a hash of the sampling
+    parameters, so only answers generated with the same settings are reused.
+
+    Args:
+        request: The validated ResponseRequest.
+
+    Returns:
+        "<model>:<16 hex digits>".
+    """
+    params = normalize_request(request)
+    del params["prompt"]
+    payload = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{request.model}:{hashlib.blake2b(payload.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+class SemanticCache:
+    """
+    Opt-in cache answering prompts that are near-duplicates of earlier ones.
+
+    The prompt is embedded (see `app.utils.vector_index.EMBEDDERS`) and looked up in a
+    `VectorIndex` of past responses with the same model and sampling parameters; a match whose cosine
+    similarity reaches `threshold` is answered with the stored Response row. Only
+    requests the exact-match cache would cache are considered (temperature 0 or
+    `cache=True`). Rows queued by the write-behind writer have no id yet and are not
+    indexed. A disabled cache builds no index and never imports numpy.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = settings.SEMANTIC_CACHE_ENABLED,
+        threshold: float = settings.SEMANTIC_CACHE_THRESHOLD,
+        embedder: str = settings.SEMANTIC_CACHE_EMBEDDER,
+        dim: int = settings.SEMANTIC_CACHE_DIM,
+        max_entries: int = settings.SEMANTIC_CACHE_MAX_ENTRIES,
+        path: str = settings.SEMANTIC_CACHE_PATH,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.path = path
+        self.embedder = None
+        self.index = None
+        if enabled:
+            from app.utils.vector_index import EMBEDDERS, VectorIndex
+
+            self.embedder = EMBEDDERS[embedder](dim)
+            self.index = VectorIndex(dim, max_entries)
+        # Lookup and insert of a miss embed the same prompt; remember the last few
+        self._vectors = TTLCache(1024, ttl=float("inf"))
+        self._training: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def _embed(self, text: str) -> "np.ndarray":
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        vector = self._vectors.get(key)
+        if vector is None:
+            vector = await self.embedder.embed(text)
+            self._vectors.set(key, vector)
+        return vector
+
+    async def lookup(self, db, request, response_model):
+        """
+        Returns the stored answer of the most similar earlier prompt, or None.
+
+        Args:
+            db: The request's database session.
+            request: The validated ResponseRequest.
+            response_model: The Response ORM class to load the row with.
+
+        Returns:
+            The Response row, or None on a miss.
+        """
+        match = self.index.search(await self._embed(request.prompt.strip()), namespace(request))
+        if match is not None and match[1] >= self.threshold:
+            row = await db.get(response_model, match[0])
+            if row is not None:
+                self.hits += 1
+                return row
+            self.index.remove(match[2])  # The row was deleted
+        self.misses += 1
+        return None
+
+    async def add(self, request, response_id: Optional[int]) -> None:
+        """
+        Indexes a freshly stored response under its prompt.
+
+        Args:
+            request: The ResponseRequest the response answers.
+            response_id: Id of the stored Response row (None: not stored yet, skipped).
+        """
+        if response_id is None:
+            return
+        self.index.add(await self._embed(request.prompt.strip()), namespace(request), response_id)
+        if self.index.needs_training() and (self._training is None or self._training.done()):
+            self._training = asyncio.ensure_future(self._train())
+
+    async def _train(self) -> None:
+        try:
+            result = await asyncio.to_thread(self.index.train)
+            self.index.apply_training(result)
+            get_logger().info("Semantic cache index trained: entries=%d clusters=%d", result[3], len(result[0]))
+        except Exception as e:
+            get_logger().warning("Semantic cache index training failed: %s", e)
+
+    async def load(self) -> None:
+        """Restores the index from `path` (startup); a missing or incompatible snapshot is ignored."""
+        if self.index is None or not self.path or not os.path.exists(self.path):
+            return
+        try:
+            loaded = await asyncio.to_thread(self.index.load, self.path, self.embedder.name)
+        except Exception as e:
+            get_logger().warning("Semantic cache snapshot %s could not be read: %s", self.path, e)
+            return
+        if loaded:
+            get_logger().info("Semantic cache loaded: entries=%d", len(self.index))
+        else:
+            get_logger().warning("Semantic cache snapshot %s does not match the configuration", self.path)
+
+    async def save(self) -> None:
+        """Writes the index to `path` (shutdown)."""
+        if self.path and self.index is not None and len(self.index):
+            await asyncio.to_thread(self.index.save, self.path, self.embedder.name)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.index) if self.index is not None else 0,
+            "evictions": self.index.evictions if self.index is not None else 0,
+        }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+from app.config import settings
+from app.utils.logger import get_logger
+from app.utils.redis_client import get_redis
+
+LOCK_PREFIX = "singleflight:lock:"
+RESULT_PREFIX = "singleflight:result:"
+
+# Deletes the lock only if it still holds our token (the lock may have expired and
+# been taken over by another worker in the meantime).
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _result_key(key: str, token: str) -> str:
+    return f"{RESULT_PREFIX}{key}:{token}"
+
+
+class _Call:
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as a task; concurrent callers with the
+    same key await that task instead of starting their own. Results and exceptions are
+    delivered to every waiter. A waiter being cancelled only cancels the shared work
+    once no other waiter is left.
+
+    With `use_redis`, a Redis lock extends this across workers: the worker holding the
+    lock runs the work and publishes the (JSON-serializable) result, the others poll
+    for it and fall back to running the work themselves if the leader disappears.
+    """
+
+    def __init__(
+        self,
+        use_redis: bool = settings.SINGLEFLIGHT_REDIS,
+        lock_ttl: float = settings.SINGLEFLIGHT_LOCK_TTL,
+        poll_interval: float = settings.SINGLEFLIGHT_POLL_INTERVAL,
+        redis=None,
+    ):
+        self.use_redis = use_redis or redis is not None
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._redis = redis
+        self._inflight: Dict[str, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def _get_redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `fn` once for all concurrent callers of `key` and returns its result.
+
+        Args:
+            key: The coalescing key (e.g. `app.utils.cache.request_key`).
+            fn: Zero-argument coroutine function doing the actual work.
+
+        Returns:
+            The result of `fn`.
+        """
+        call = self._inflight.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(self._execute(key, fn)))
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                call.task.cancel()  # Nobody is left waiting for the result
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    async def _execute(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if self.use_redis:
+            return await self._execute_shared(key, fn)
+        self.executions += 1
+        return await fn()
+
+    async def _execute_shared(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        logger = get_logger()
+        redis = self._get_redis()
+        lock_key = LOCK_PREFIX + key
+        token = uuid.uuid4().hex
+        try:
+            leader = await redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            logger.warning("Single-flight Redis lock failed, running locally: %s", e)
+            self.executions += 1
+            return await fn()
+
+        if leader:
+            try:
+                self.executions += 1
+                result = await fn()
+                try:
+                    # Under this flight's token: a later flight of the same key never reads it
+                    await redis.set(_result_key(key, token), json.dumps(result), px=int(self.lock_ttl * 1000))
+                except Exception as e:
+                    logger.warning("Single-flight Redis publish failed: %s", e)
+                return result
+            finally:
+                try:
+                    await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logger.warning("Single-flight Redis unlock failed: %s", e)
+
+        # Another worker leads: wait for the result of its flight while its lock is alive.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_ttl
+        try:
+            leader_token = await redis.get(lock_key)
+            if leader_token is not None:
+                if isinstance(leader_token, bytes):
+                    leader_token = leader_token.decode()
+                result_key = _result_key(key, leader_token)
+                while loop.time() < deadline:
+                    raw = await redis.get(result_key)
+                    if raw is not None:
+                        self.coalesced += 1
+                        return json.loads(raw)
+                    if not await redis.exists(lock_key):
+                        break
+                    await asyncio.sleep(self.poll_interval)
+                raw = await redis.get(result_key)
+                if raw is not None:
+                    self.coalesced += 1
+                    return json.loads(raw)
+        except Exception as e:
+            logger.warning("Single-flight Redis poll failed, running locally: %s", e)
+        self.executions += 1
+        return await fn()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,178 @@
+import hashlib
+import math
+import re
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from app.config import settings
+from app.utils.cache import TTLCache
+
+# Context window (prompt + completion tokens) per model; others use settings.DEFAULT_CONTEXT_WINDOW.
+MODEL_CONTEXT_WINDOWS = {
+    "text-davinci-003": 4097,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "echo": 8192,
+}
+
+# Chat formatting tokens each message costs on top of its content (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Words, numbers and single punctuation marks: roughly the pieces a BPE tokenizer splits on.
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def context_window(model: str) -> int:
+    return MODEL_CONTEXT_WINDOWS.get(model, settings.DEFAULT_CONTEXT_WINDOW)
+
+
+def estimate(text: str) -> int:
+    """
+    Estimates the token count of `text` without a vocabulary: the larger of the number
+    of word/punctuation pieces and one token per 4 characters. Tends to overestimate
+    slightly for English, which is the safe side for budgeting.
+    """
+    return max(len(_PIECE_RE.findall(text)), math.ceil(len(text) / 4))
+
+
+class Tokenizer:
+    """
+    Counts prompt tokens locally, with an LRU cache of counts keyed by a hash of the text.
+
+    Uses tiktoken when it is installed (`settings.TOKENIZER` "auto" or "tiktoken") and
+    the `estimate` heuristic otherwise, so the dependency stays optional.
+    """
+
+    def __init__(self, kind: str = settings.TOKENIZER, max_entries: int = settings.TOKEN_COUNT_CACHE_SIZE):
+        self.kind = kind
+        self._counts = TTLCache(max_entries, ttl=float("inf"))
+        self._encodings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _encoding(self, model: str):
+        """Returns the tiktoken encoding for `model`, or None to use the estimator."""
+        if self.kind == "estimate":
+            return None
+        if model not in self._encodings:
+            try:
+                import tiktoken
+            except ImportError:
+                if self.kind == "tiktoken":
+                    raise
+                self._encodings[model] = None
+            else:
+                try:
+                    self._encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    self._encodings[model] = tiktoken.get_encoding("cl100k_base")
+        return self._encodings[model]
+
+    def count(self, text: str, model: str) -> int:
+        """
+        Returns the number of tokens of `text` for `model`.
+
+        Args:
+            text: Prompt or completion text.
+            model: Model name (selects the encoding).
+
+        Returns:
+            The token count.
+        """
+        key = model + ":" + hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        count = self._counts.get(key)
+        if count is not None:
+            self.hits += 1
+            return count
+        self.misses += 1
+        encoding = self._encoding(model)
+        count = len(encoding.encode(text)) if encoding is not None else estimate(text)
+        self._counts.set(key, count)
+        return count
+
+    def truncate(self, text: str, model: str, max_tokens: int) -> str:
+        """
+        Returns the longest prefix of `text` that fits in `max_tokens` tokens.
+
+        Args:
+            text: The text to shorten.
+            model: Model name (selects the encoding).
+            max_tokens: Token budget for the text.
+
+        Returns:
+            The (possibly) shortened text.
+        """
+        encoding = self._encoding(model)
+        if encoding is not None:
+            return encoding.decode(encoding.encode(text)[:max_tokens])
+        while text and estimate(text) > max_tokens:
+            text = text[: max(0, min(len(text) - 1, int(len(text) * max_tokens / estimate(text))))]
+        return text
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._counts)}
+
+
+tokenizer = Tokenizer()
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """
+    Returns the token count of `text` for `model` using the shared tokenizer.
+
+    Args:
+        text: Prompt or completion text.
+        model: Model name (selects the encoding).
+
+    Returns:
+        The token count.
+    """
+    return tokenizer.count(text, model)
+
+
+def context_tokens(request) -> int:
+    """
+    Returns the token count of the earlier chat messages a ResponseRequest carries
+    (`request.context`), formatting overhead included; 0 without context.
+    """
+    return sum(count_tokens(message["content"], request.model) + MESSAGE_OVERHEAD_TOKENS for message in request.context or ())
+
+
+def fit_request(request, overflow: Optional[str] = None) -> Tuple[object, int]:
+    """
+    Fits a ResponseRequest into its model's context window before any network call.
+
+    A prompt that leaves less than `settings.MIN_COMPLETION_TOKENS` for the completion
+    (after the earlier messages of `request.context`, which callers window beforehand)
+    is rejected with a 400 or, with `overflow="truncate"`, shortened. `max_tokens` is
+    then clamped to what is left of the window.
+
+    Args:
+        request: The validated ResponseRequest.
+        overflow: "reject" or "truncate". Defaults to `settings.PROMPT_OVERFLOW`.
+
+    Returns:
+        The (possibly adjusted) request and its prompt token count.
+
+    Raises:
+        HTTPException: 400 when the prompt does not fit and overflow is "reject" or
+            the context leaves no room for it.
+    """
+    overflow = overflow or settings.PROMPT_OVERFLOW
+    window = context_window(request.model)
+    prompt_tokens = count_tokens(request.prompt, request.model)
+    history_tokens = context_tokens(request)
+    prompt_budget = window - history_tokens - settings.MIN_COMPLETION_TOKENS
+    changes = {}
+    if prompt_tokens > prompt_budget:
+        if overflow != "truncate" or prompt_budget <= 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Prompt has {prompt_tokens} tokens; {request.model} accepts at most {prompt_budget}",
+            )
+        changes["prompt"] = tokenizer.truncate(request.prompt, request.model, prompt_budget)
+        prompt_tokens = count_tokens(changes["prompt"], request.model)
+    if request.max_tokens > window - history_tokens - prompt_tokens:
+        changes["max_tokens"] = window - history_tokens - prompt_tokens
+    if changes:
+        request = request.copy(update=changes)
+    return request, prompt_tokens
@@ -0,0 +1,356 @@
+import json
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config import settings
+
+# Embedders and the vector index of the semantic cache (app/utils/semantic_cache.py), apart
+# from it so that numpy is only imported when the cache is enabled.
+
+# Snapshot format version; bump when the arrays saved by `VectorIndex.save` change.
+SNAPSHOT_VERSION = 1
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Local embedder needing no network or model: word unigrams and character trigrams
+    of the normalized text (lowercased, punctuation and extra whitespace dropped) are
+    hashed into `dim` signed buckets. Prompts that differ only by rephrasing a few
+    words or by formatting end up with a high cosine similarity.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = settings.SEMANTIC_CACHE_DIM):
+        self.dim = dim
+
+    async def embed(self, text: str) -> np.ndarray:
+        return self.embed_sync(text)
+
+    def embed_sync(self, text: str) -> np.ndarray:
+        words = _WORD_RE.findall(text.lower())
+        normalized = " " + " ".join(words) + " "
+        features = words + [normalized[i:i + 3] for i in range(len(normalized) - 2)]
+        # crc32 rather than hash(): the buckets must not change between processes
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+        vector = np.zeros(self.dim, dtype=np.float32)
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dim, signs)
+        return _normalize(vector)
+
+
+class OpenAIEmbedder:
+    """Embeds with the upstream embeddings endpoint (e.g. text-embedding-3-small) via the shared client."""
+
+    name = "openai"
+
+    def __init__(self, dim: int = settings.SEMANTIC_CACHE_DIM, model: str = settings.SEMANTIC_CACHE_EMBEDDING_MODEL):
+        self.dim = dim
+        self.model = model
+
+    async def embed(self, text: str) -> np.ndarray:
+        from app.utils.openai_client import get_openai_client
+
+        result = await get_openai_client().embeddings.create(model=self.model, input=text, dimensions=self.dim)
+        return _normalize(np.asarray(result.data[0].embedding, dtype=np.float32))
+
+
+# Embedder classes by `settings.SEMANTIC_CACHE_EMBEDDER` name; register new ones here.
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "openai": OpenAIEmbedder,
+}
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """
+    Bounded in-memory index of unit vectors, each pointing at a stored Response id.
+
+    Vectors live in one preallocated float32 matrix (grown by doubling up to
+    `max_entries`), with parallel arrays for the response id, namespace, cluster and
+    last use. Until enough vectors are in, a search scans them all. Then an
+    inverted-file (IVF) coarse quantizer is trained: vectors are assigned to the
+    nearest of `nlist` k-means centroids, each cluster keeps a posting list of its
+    slots, and a search only scores the vectors of the `nprobe` closest clusters. A
+    full index evicts the least recently used 1% of its entries at once.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        max_entries: int = settings.SEMANTIC_CACHE_MAX_ENTRIES,
+        nlist: int = settings.SEMANTIC_CACHE_NLIST,
+        nprobe: int = settings.SEMANTIC_CACHE_NPROBE,
+    ):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_on = 0  # Live entries when the centroids were trained
+        # Per cluster: slots as of the last rebuild, plus slots assigned since. Slots
+        # freed or reassigned later stay listed until the next rebuild; a search
+        # checks the namespace of every candidate anyway.
+        self._postings: List[np.ndarray] = []
+        self._appended: List[List[int]] = []
+        self._appended_count = 0
+        self.evictions = 0
+        self._allocate(min(max_entries, 1024))
+        self._size = 0  # High-water mark of used slots
+        self._free: List[int] = []
+        self._clock = 0
+        self._namespaces: Dict[str, int] = {}
+
+    def _allocate(self, capacity: int) -> None:
+        old = getattr(self, "vectors", None)
+        size = 0 if old is None else len(old)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        ids = np.full(capacity, -1, dtype=np.int64)
+        spaces = np.full(capacity, -1, dtype=np.int32)
+        lists = np.full(capacity, -1, dtype=np.int32)
+        used = np.zeros(capacity, dtype=np.int64)
+        generations = np.zeros(capacity, dtype=np.int64)
+        if old is not None:
+            vectors[:size] = self.vectors
+            ids[:size] = self.ids
+            spaces[:size] = self.spaces
+            lists[:size] = self.lists
+            used[:size] = self.used
+            generations[:size] = self.generations
+        self.vectors, self.ids, self.spaces, self.lists = vectors, ids, spaces, lists
+        self.used, self.generations = used, generations
+
+    def __len__(self) -> int:
+        return self._size - len(self._free)
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _slots(self, count: int) -> np.ndarray:
+        """Returns `count` free slots, growing the arrays or evicting as needed."""
+        slots = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        count -= len(slots)
+        if count and self._size + count > len(self.vectors) and len(self.vectors) < self.max_entries:
+            capacity = len(self.vectors)
+            while capacity < self._size + count and capacity < self.max_entries:
+                capacity *= 2
+            self._allocate(min(capacity, self.max_entries))
+        fresh = min(count, len(self.vectors) - self._size)
+        slots.extend(range(self._size, self._size + fresh))
+        self._size += fresh
+        count -= fresh
+        if count:
+            self._evict(max(count, self.max_entries // 100))
+            slots.extend(self._free.pop() for _ in range(count))
+        return np.asarray(slots, dtype=np.int64)
+
+    def _evict(self, count: int) -> None:
+        live = np.flatnonzero(self.spaces[: self._size] >= 0)
+        count = min(count, len(live))
+        oldest = live[np.argpartition(self.used[live], count - 1)[:count]]
+        self.spaces[oldest] = -1
+        self.ids[oldest] = -1
+        self._free.extend(oldest.tolist())
+        self.evictions += count
+
+    def add(self, vector: np.ndarray, space: str, response_id: int) -> int:
+        """
+        Inserts one vector.
+
+        Args:
+            vector: Unit vector of length `dim`.
+            space: The request's namespace (see `namespace`).
+            response_id: Id of the stored Response row.
+
+        Returns:
+            The slot the vector was stored in.
+        """
+        return int(self.add_many(vector[None, :], space, np.asarray([response_id]))[0])
+
+    def add_many(self, vectors: np.ndarray, space: str, response_ids: np.ndarray) -> np.ndarray:
+        """Bulk `add` of the rows of `vectors` (benchmarks, snapshot loading)."""
+        code = self._namespaces.setdefault(space, len(self._namespaces))
+        slots = self._slots(len(vectors))
+        self.vectors[slots] = vectors
+        self.ids[slots] = response_ids
+        self.spaces[slots] = code
+        self.lists[slots] = self._assign(vectors) if self.centroids is not None else -1
+        self._clock += 1
+        self.used[slots] = self._clock
+        self.generations[slots] += 1
+        if self.centroids is not None:
+            for slot, cluster in zip(slots.tolist(), self.lists[slots].tolist()):
+                self._appended[cluster].append(slot)
+            self._appended_count += len(slots)
+            if self._appended_count > len(self) // 4:
+                self._rebuild_postings()
+        return slots
+
+    def _rebuild_postings(self) -> None:
+        live = np.flatnonzero(self.spaces[: self._size] >= 0)
+        order = live[np.argsort(self.lists[live], kind="stable")]
+        bounds = np.searchsorted(self.lists[order], np.arange(len(self.centroids) + 1))
+        self._postings = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        self._appended = [[] for _ in self.centroids]
+        self._appended_count = 0
+
+    def remove(self, slot: int) -> None:
+        if self.spaces[slot] >= 0:
+            self.spaces[slot] = -1
+            self.ids[slot] = -1
+            self._free.append(slot)
+
+    def search(self, vector: np.ndarray, space: str) -> Optional[Tuple[int, float, int]]:
+        """
+        Finds the most similar vector in `space`.
+
+        Args:
+            vector: Unit query vector.
+            space: The request's namespace.
+
+        Returns:
+            (response id, cosine similarity, slot) of the best match, or None when the
+            namespace has no vectors in the probed clusters.
+        """
+        code = self._namespaces.get(space)
+        if code is None:
+            return None
+        if self.centroids is None:
+            candidates = np.flatnonzero(self.spaces[: self._size] == code)
+        else:
+            closeness = self.centroids @ vector
+            nprobe = min(self.nprobe, len(closeness))
+            probed = np.argpartition(-closeness, nprobe - 1)[:nprobe].tolist()
+            candidates = np.concatenate(
+                [self._postings[c] for c in probed]
+                + [np.fromiter(self._appended[c], dtype=np.int64, count=len(self._appended[c])) for c in probed]
+            )
+            candidates = candidates[self.spaces[candidates] == code]
+        if not len(candidates):
+            return None
+        scores = self.vectors[candidates] @ vector
+        best = int(scores.argmax())
+        slot = int(candidates[best])
+        self.used[slot] = self._tick()
+        return int(self.ids[slot]), float(scores[best]), slot
+
+    def needs_training(self) -> bool:
+        live = len(self)
+        return live >= self.nlist * 16 and live >= 4 * self.trained_on
+
+    def _assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        centroids = self.centroids if centroids is None else centroids
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 65536):  # Bounds the size of the score matrix
+            lists[start:start + 65536] = (vectors[start:start + 65536] @ centroids.T).argmax(axis=1)
+        return lists
+
+    def train(self, iterations: int = 8, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """
+        Runs k-means over a sample of the live vectors and assigns every slot to a cluster.
+
+        Only reads the index, so it can run in a worker thread; `apply_training` then
+        installs the result on the event loop.
+
+        Returns:
+            (centroids, cluster per slot, slot generations at assignment, live entries).
+        """
+        size = self._size
+        vectors, generations = self.vectors, self.generations[:size].copy()
+        live = np.flatnonzero(self.spaces[:size] >= 0)
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(live, size=min(len(live), self.nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]  # Keep the centroid of an empty cluster where it was
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms == 0, 1, norms)
+        return centroids, self._assign(vectors[:size], centroids), generations, len(live)
+
+    def apply_training(self, result: Tuple[np.ndarray, np.ndarray, np.ndarray, int]) -> None:
+        centroids, lists, generations, trained_on = result
+        size = len(lists)
+        self.centroids = centroids
+        self.lists[:size] = lists
+        # Slots written while training ran in the thread are assigned again here
+        stale = np.concatenate([
+            np.flatnonzero(self.generations[:size] != generations),
+            np.arange(size, self._size),
+        ])
+        if len(stale):
+            self.lists[stale] = self._assign(self.vectors[stale])
+        self.trained_on = trained_on
+        self._rebuild_postings()
+
+    def save(self, path: str, embedder: str) -> None:
+        """Writes the index to `path` (uncompressed .npz, replaced atomically)."""
+        size = self._size
+        tmp = f"{path}.{os.getpid()}.tmp.npz"  # Workers of one server save concurrently
+        np.savez(
+            tmp,
+            meta=np.asarray(json.dumps({
+                "version": SNAPSHOT_VERSION,
+                "embedder": embedder,
+                "dim": self.dim,
+                "namespaces": self._namespaces,
+                "clock": self._clock,
+                "trained_on": self.trained_on,
+            })),
+            vectors=self.vectors[:size],
+            ids=self.ids[:size],
+            spaces=self.spaces[:size],
+            lists=self.lists[:size],
+            used=self.used[:size],
+            centroids=self.centroids if self.centroids is not None else np.zeros((0, self.dim), dtype=np.float32),
+        )
+        os.replace(tmp, path)
+
+    def load(self, path: str, embedder: str) -> bool:
+        """
+        Replaces the contents of the index with the snapshot at `path`.
+
+        Returns:
+            False (leaving the index untouched) when the snapshot was made with another
+            embedder or dimension, or holds more entries than `max_entries`.
+        """
+        with np.load(path) as snapshot:
+            meta = json.loads(str(snapshot["meta"]))
+            if (
+                meta["version"] != SNAPSHOT_VERSION
+                or meta["embedder"] != embedder
+                or meta["dim"] != self.dim
+                or len(snapshot["ids"]) > self.max_entries
+            ):
+                return False
+            size = len(snapshot["ids"])
+            self.vectors = self.ids = None
+            self._allocate(max(size, min(self.max_entries, 1024)))
+            self.vectors[:size] = snapshot["vectors"]
+            self.ids[:size] = snapshot["ids"]
+            self.spaces[:size] = snapshot["spaces"]
+            self.lists[:size] = snapshot["lists"]
+            self.used[:size] = snapshot["used"]
+            centroids = snapshot["centroids"]
+            self.centroids = centroids if len(centroids) else None
+        self._size = size
+        self._free = np.flatnonzero(self.spaces[:size] < 0).tolist()
+        self._namespaces = meta["namespaces"]
+        self._clock = meta["clock"]
+        self.trained_on = meta["trained_on"]
+        if self.centroids is not None:
+            self._rebuild_postings()
+        return True
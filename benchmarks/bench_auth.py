@@ -0,0 +1,51 @@
+"""Per-request overhead of authenticate_user with and without the token cache.
+
+Usage:
+    DATABASE_URL=sqlite:///./bench_auth.sqlite python -m benchmarks.bench_auth [--requests 2000]
+
+"uncached" clears the cache before every call, which is what the middleware did
+before: decode the JWT and query the user on every request.
+"""
+import argparse
+import asyncio
+import time
+from unittest.mock import MagicMock
+from sqlalchemy import delete
+from app.database import Base, SessionLocal, engine
+from app.database.models import User
+from app.utils.auth import authenticate_user, create_access_token, token_cache
+
+
+async def setup() -> str:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        await db.execute(delete(User).where(User.id == 1))
+        db.add(User(id=1, username="bench", api_key="bench"))
+        await db.commit()
+    return create_access_token(1)
+
+
+async def measure(request, n: int, cached: bool) -> float:
+    token_cache.clear()
+    start = time.perf_counter()
+    for _ in range(n):
+        if not cached:
+            token_cache.clear()
+        await authenticate_user(request)
+    return (time.perf_counter() - start) / n
+
+
+async def main(n: int):
+    token = await setup()
+    request = MagicMock(headers={"Authorization": f"Bearer {token}"})
+    for name, cached in (("uncached", False), ("cached", True)):
+        per_call = await measure(request, n, cached)
+        print(f"{name:>8}: {per_call * 1e6:.1f}us per request over {n} requests")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(main(parser.parse_args().requests))
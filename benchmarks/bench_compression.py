@@ -0,0 +1,124 @@
+"""Storage savings and encode/decode cost of the compressed text columns.
+
+Usage:
+    python -m benchmarks.bench_compression [--rows 20000] [--url postgresql://user:pw@localhost/db]
+
+Takes the texts of the latest `--rows` responses from `--url`, or generates a
+synthetic corpus of completions (sentences drawn from a fixed vocabulary with
+Markdown structure, lengths from a few words to a few KB) when no URL is given.
+For each codec setting it reports the stored size relative to the UTF-8 text and
+the per-value encode/decode cost. The dictionary is trained on one half of the
+corpus and measured on the other, as it would be in production. Finally it inserts
+the corpus into two SQLite tables, plain String vs CompressedText, and compares
+the file sizes (which is what the buffer cache and every row fetch pay for).
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from app.database import types
+from app.database.types import CompressedText, TextCodec, train_dictionary
+
+WORDS = (
+    "the model response request token prompt user data value function return error result "
+    "first second example because should would could which there their about into using "
+    "python code list string number table query index cache latency throughput server client "
+    "important note however therefore additionally finally step following section summary"
+).split()
+
+
+def synthetic_corpus(rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(rows):
+        paragraphs = []
+        for _ in range(rng.choice([1, 1, 2, 3, 5, 8, 13])):
+            sentences = [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 18))).capitalize() + "."
+                for _ in range(rng.randint(1, 5))
+            ]
+            prefix = rng.choice(["", "", "- ", "1. ", "## ", "**Note:** "])
+            paragraphs.append(prefix + " ".join(sentences))
+        corpus.append("\n\n".join(paragraphs))
+    return corpus
+
+
+def database_corpus(url: str, rows: int):
+    from app.database.models import Response
+
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        texts = conn.execute(select(Response.text).order_by(Response.id.desc()).limit(rows)).scalars().all()
+    engine.dispose()
+    return list(texts)
+
+
+def measure(codec: TextCodec, corpus):
+    encoded, encode_times, decode_times = [], [], []
+    for text in corpus:
+        start = time.perf_counter()
+        stored = codec.encode(text)
+        encode_times.append(time.perf_counter() - start)
+        encoded.append(stored)
+    for stored in encoded:
+        start = time.perf_counter()
+        codec.decode(stored)
+        decode_times.append(time.perf_counter() - start)
+    return (
+        sum(map(len, encoded)),
+        statistics.median(encode_times) * 1e6,
+        statistics.median(decode_times) * 1e6,
+    )
+
+
+def sqlite_file_size(corpus, column_type) -> int:
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    engine = create_engine(f"sqlite:///{path}")
+    table = Table("texts", MetaData(), Column("id", Integer, primary_key=True), Column("text", column_type))
+    table.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert(), [{"text": text} for text in corpus])
+    engine.dispose()
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--url", help="sync database URL to take real response texts from")
+    parser.add_argument("--min-bytes", type=int, default=256)
+    parser.add_argument("--dict-size", type=int, default=65536)
+    args = parser.parse_args()
+
+    corpus = database_corpus(args.url, args.rows) if args.url else synthetic_corpus(args.rows)
+    training, corpus = corpus[: len(corpus) // 2], corpus[len(corpus) // 2:]
+    raw = sum(len(text.encode("utf-8")) for text in corpus)
+    print(f"{len(corpus)} texts, {raw / len(corpus):.0f} bytes on average, {raw / 1e6:.1f}MB in total")
+
+    variants = [("none", None), ("zlib", None)]
+    try:
+        dictionary = train_dictionary(training, args.dict_size)
+        variants += [("zlib", dictionary), ("zstd", None), ("zstd", dictionary)]
+    except ImportError:
+        print("zstandard is not installed: zstd and dictionary rows skipped")
+    for kind, dictionary in variants:
+        codec = TextCodec(kind, args.min_bytes, dictionaries=[dictionary] if dictionary else [])
+        stored, encode_us, decode_us = measure(codec, corpus)
+        name = kind + ("+dict" if dictionary else "")
+        print(f"{name:10s} stored {stored / raw:6.1%} of raw | encode p50 {encode_us:7.1f}us | decode p50 {decode_us:7.1f}us")
+
+    plain = sqlite_file_size(corpus, String)
+    kind, dictionary = variants[-1]
+    types.text_codec = TextCodec(kind, args.min_bytes, dictionaries=[dictionary] if dictionary else [])
+    compressed = sqlite_file_size(corpus, CompressedText)
+    print(f"sqlite file: String {plain / 1e6:.1f}MB, CompressedText ({types.text_codec.kind}) "
+          f"{compressed / 1e6:.1f}MB ({compressed / plain:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""p50/p99 request latency with a blocking sync session vs the async engine.
+
+Usage:
+    python -m benchmarks.bench_db [--concurrency 200] [--url postgresql://user:pw@localhost/bench]
+
+Each simulated request awaits a short upstream call and then inserts one prompt,
+mirroring create_prompt/generate_response. "sync" runs db.commit() on the event loop
+the way the routers used to; "async" uses the same engine setup as app.database. The
+event-loop lag column shows how long other requests were starved meanwhile. Point
+--url at Postgres for representative numbers: SQLite serializes writers either way.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.database import Base, async_database_url, engine_options
+from app.database.models import Prompt
+
+
+async def monitor_loop_lag(samples, interval=0.005):
+    """Records how late the event loop wakes us up; blocking DB calls show up here."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - expected)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_sync(url: str, concurrency: int, upstream: float):
+    engine = create_engine(url)
+    Session = sessionmaker(bind=engine)
+
+    async def one(i):
+        start = time.perf_counter()
+        await asyncio.sleep(upstream)
+        db = Session()
+        try:
+            db.add(Prompt(text=f"prompt {i}", model="gpt-3.5-turbo"))
+            db.commit()
+        finally:
+            db.close()
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(one(i) for i in range(concurrency)))
+    engine.dispose()
+    return latencies
+
+
+async def run_async(url: str, concurrency: int, upstream: float):
+    async_url = async_database_url(url)
+    engine = create_async_engine(async_url, **engine_options(async_url))
+    Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def one(i):
+        start = time.perf_counter()
+        await asyncio.sleep(upstream)
+        async with Session() as db:
+            db.add(Prompt(text=f"prompt {i}", model="gpt-3.5-turbo"))
+            await db.commit()
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(one(i) for i in range(concurrency)))
+    await engine.dispose()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--upstream", type=float, default=0.02, help="simulated upstream latency (s)")
+    parser.add_argument("--url", default="sqlite:///./bench_db.sqlite")
+    args = parser.parse_args()
+
+    setup = create_engine(args.url)
+    Base.metadata.create_all(setup)
+    setup.dispose()
+
+    async def measure(runner):
+        lag = [0.0]
+        monitor = asyncio.ensure_future(monitor_loop_lag(lag))
+        try:
+            return await runner(args.url, args.concurrency, args.upstream), lag
+        finally:
+            monitor.cancel()
+
+    for name, runner in (("sync", run_sync), ("async", run_async)):
+        latencies, lag = asyncio.run(measure(runner))
+        print(
+            f"{name:>5}: p50={statistics.median(latencies) * 1000:.1f}ms "
+            f"p99={percentile(latencies, 99) * 1000:.1f}ms "
+            f"max loop lag={max(lag) * 1000:.1f}ms over {args.concurrency} concurrent requests"
+        )
+
+
+if __name__ == "__main__":
+    main()
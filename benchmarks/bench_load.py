@@ -0,0 +1,391 @@
+"""Throughput, latency percentiles and event-loop lag of the service under load.
+
+Usage:
+    python -m benchmarks.bench_load [--concurrency 32 | --rps 100] [--duration 30] [--input traffic.jsonl]
+        [--endpoint responses] [--url http://127.0.0.1:8000] [--output report.json] [--compare baseline.json]
+
+Replays a JSONL file of request bodies in the input format of `python -m app.batch`
+(`custom_id` is ignored; an `"endpoint"` field overrides --endpoint for that record),
+cycling through it, or synthetic prompts without --input. `/prompts/` gets the
+record's `prompt` as its `text`.
+
+Closed loop (--concurrency N): N clients each send their next request as soon as the
+previous one is answered. Open loop (--rps R): requests start at a fixed rate whatever
+the response times, and latency counts from a request's scheduled start, so a server
+falling behind shows in the tail instead of slowing the load down.
+
+Without --url the service is started for the run: uvicorn (gunicorn with --workers)
+on a fresh SQLite database (--database-url for another one), authentication and rate
+limits off, its models answered by the stub of benchmarks/stub_server.py, whose
+latency, streaming and fault options are accepted here. With --url the target is
+used as is (--token adds a bearer token).
+
+The report has the throughput, p50/p95/p99 latency (and time to first byte for
+`responses/stream`), requests by status, the driver's own event-loop lag (a saturated
+driver skews everything) and the service's, from `event_loop_lag_seconds` in its
+/metrics. --output writes it as JSON; --compare prints the relative change of each
+number against an earlier report, e.g. one from the previous commit.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+from benchmarks.stub_server import StubServer, add_stub_arguments, stub_from_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = {"prompts": "/prompts/", "responses": "/responses/", "responses/stream": "/responses/stream"}
+
+WORDS = (
+    "the service answers prompts with completions from a model and stores both so that "
+    "clients can page through their history cache results and stream long replies"
+).split()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> Optional[str]:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def load_traffic(path: Optional[str], endpoint: str, synthetic: int, model: str) -> List[Tuple[str, dict]]:
+    """
+    Reads the requests to replay.
+
+    Args:
+        path: JSONL file of request bodies, or None for `synthetic` generated prompts.
+        endpoint: Key of `ENDPOINTS` for records without an `"endpoint"` field.
+        synthetic: Number of distinct synthetic prompts.
+        model: Model of the synthetic prompts.
+
+    Returns:
+        (path, JSON body) pairs.
+    """
+    if path is None:
+        rng = random.Random(0)
+        records = [
+            {"prompt": f"Request {i}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))), "model": model}
+            for i in range(synthetic)
+        ]
+    else:
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    traffic = []
+    for record in records:
+        record.pop("custom_id", None)
+        target = ENDPOINTS[record.pop("endpoint", endpoint)]
+        if target == "/prompts/" and "text" not in record:
+            record["text"] = record.pop("prompt")
+        traffic.append((target, record))
+    if not traffic:
+        raise ValueError(f"{path} has no requests")
+    return traffic
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies: List[float] = []  # Successful requests only
+        self.ttfb: List[float] = []
+        self.statuses: Counter = Counter()
+
+
+async def send(client: httpx.AsyncClient, path: str, body: dict, result: LoadResult, started: float) -> None:
+    try:
+        if path.endswith("/stream"):
+            first_byte = None
+            async with client.stream("POST", path, json=body) as response:
+                async for _ in response.aiter_raw():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                status = response.status_code
+            if first_byte is not None and status < 400:
+                result.ttfb.append(first_byte)
+        else:
+            status = (await client.post(path, json=body)).status_code
+    except httpx.HTTPError as e:
+        result.statuses[type(e).__name__] += 1
+        return
+    result.statuses[str(status)] += 1
+    if status < 400:
+        result.latencies.append(time.perf_counter() - started)
+
+
+async def closed_loop(client, requests: Iterator[Tuple[str, dict]], concurrency: int, deadline: float, result: LoadResult):
+    async def client_loop():
+        for path, body in requests:  # Shared by the clients: each request is sent once
+            if time.perf_counter() >= deadline:
+                return
+            await send(client, path, body, result, time.perf_counter())
+
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+
+async def open_loop(client, requests: Iterator[Tuple[str, dict]], rps: float, deadline: float, result: LoadResult):
+    tasks = set()
+    start = time.perf_counter()
+    for index, (path, body) in enumerate(requests):
+        scheduled = start + index / rps
+        if scheduled >= deadline:
+            break
+        if scheduled > time.perf_counter():
+            await asyncio.sleep(scheduled - time.perf_counter())
+        task = asyncio.ensure_future(send(client, path, body, result, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def monitor_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def lag_buckets(client: httpx.AsyncClient) -> Dict[float, float]:
+    """Cumulative bucket counts of the service's `event_loop_lag_seconds`; empty when it has none."""
+    try:
+        response = await client.get("/metrics")
+    except httpx.HTTPError:
+        return {}
+    for family in text_string_to_metric_families(response.text if response.status_code == 200 else ""):
+        if family.name == "event_loop_lag_seconds":
+            return {float(s.labels["le"]): s.value for s in family.samples if s.name.endswith("_bucket")}
+    return {}
+
+
+def histogram_quantile(buckets: Dict[float, float], q: float) -> Optional[float]:
+    """Quantile of a cumulative histogram, interpolated within its bucket as Prometheus does."""
+    bounds = sorted(buckets)
+    if not bounds or buckets[bounds[-1]] == 0:
+        return None
+    rank = q * buckets[bounds[-1]]
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        if buckets[bound] >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(buckets[bound] - below, 1e-9)
+        lower, below = bound, buckets[bound]
+    return lower
+
+
+async def run_load(args, base_url: str, traffic: List[Tuple[str, dict]]) -> Dict[str, Any]:
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else None
+    limits = httpx.Limits(max_connections=args.concurrency or None, max_keepalive_connections=args.concurrency or None)
+    requests = itertools.cycle(traffic)
+    if args.requests:
+        requests = itertools.islice(requests, args.requests)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=args.timeout) as client:
+        for phase in ("warmup", "measure"):
+            seconds = args.warmup if phase == "warmup" else args.duration
+            if seconds <= 0:
+                continue
+            result, lag = LoadResult(), []
+            before = await lag_buckets(client)
+            monitor = asyncio.ensure_future(monitor_loop_lag(lag))
+            start = time.perf_counter()
+            if args.rps:
+                await open_loop(client, requests, args.rps, start + seconds, result)
+            else:
+                await closed_loop(client, requests, args.concurrency, start + seconds, result)
+            elapsed = time.perf_counter() - start
+            monitor.cancel()
+            after = await lag_buckets(client)
+    server_lag = {bound: count - before.get(bound, 0.0) for bound, count in after.items()}
+
+    def ms(values):
+        return {
+            "mean": round(1000 * sum(values) / len(values), 2) if values else 0.0,
+            **{f"p{pct}": round(1000 * percentile(values, pct), 2) for pct in (50, 95, 99)},
+            "max": round(1000 * max(values), 2) if values else 0.0,
+        }
+
+    report = {
+        "requests": sum(result.statuses.values()),
+        "ok": len(result.latencies),
+        "statuses": dict(sorted(result.statuses.items())),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(result.latencies) / elapsed, 2),
+        "latency_ms": ms(result.latencies),
+        "client_loop_lag_ms": ms(lag),
+        "server_loop_lag_ms": None,
+    }
+    if result.ttfb:
+        report["ttfb_ms"] = ms(result.ttfb)
+    if server_lag:
+        report["server_loop_lag_ms"] = {
+            f"p{round(q * 100)}": round(1000 * (histogram_quantile(server_lag, q) or 0.0), 2) for q in (0.5, 0.95, 0.99)
+        }
+    return report
+
+
+class Service:
+    """The app in a subprocess, on a fresh database, with the stub as its upstream."""
+
+    def __init__(self, upstream_url: str, workers: int = 1, database_url: Optional[str] = None):
+        self.port = free_port()
+        self.upstream_url = upstream_url
+        self.workers = workers
+        self.database_url = database_url
+        self.process: Optional[subprocess.Popen] = None
+        self.directory = ""
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix="bench-load-")
+        env = {
+            **os.environ,
+            "DATABASE_URL": self.database_url or f"sqlite:///{self.directory}/bench.db",
+            "DEBUG": "true",  # No authentication
+            "RATE_LIMIT_ENABLED": "false",  # All the load comes from one anonymous user
+            "OPENAI_BASE_URL": self.upstream_url,
+            "OPENAI_API_KEY": "stub",
+            "SECRET_KEY": os.environ.get("SECRET_KEY", "bench"),
+            "LOG_FILE": os.path.join(self.directory, "app.log"),
+        }
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT, env=env, check=True, capture_output=True)
+        if self.workers > 1:
+            env.update(
+                SERVER_BIND=f"127.0.0.1:{self.port}",
+                SERVER_WORKERS=str(self.workers),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(self.directory, "metrics"),
+            )
+            command = [sys.executable, "-m", "gunicorn", "app.main:app"]
+        else:
+            command = [
+                sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(self.port),
+                "--log-level", "warning", "--no-access-log",
+            ]
+        self.process = subprocess.Popen(command, cwd=ROOT, env=env)
+        deadline = time.monotonic() + 60
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The service exited with status {self.process.returncode}")
+            try:
+                if httpx.get(self.base_url + "/metrics").status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("The service did not start within 60s")
+            time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def flatten(report: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    numbers = {}
+    for key, value in report.items():
+        if key == "config":
+            continue
+        if isinstance(value, dict):
+            numbers.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers[prefix + key] = value
+    return numbers
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """One line per number of either report: old value, new value and relative change."""
+    before, after = flatten(old), flatten(new)
+    lines = []
+    for key in sorted(set(before) | set(after)):
+        a, b = before.get(key), after.get(key)
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+        lines.append(f"  {key:<28} {a if a is not None else '-':>10} -> {b if b is not None else '-':>10}  {change}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=32, help="closed loop: clients sending back to back")
+    mode.add_argument("--rps", type=float, help="open loop: requests started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of load before measuring")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--input", help="JSONL of request bodies (default: synthetic prompts)")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="responses")
+    parser.add_argument("--synthetic", type=int, default=1000, help="distinct synthetic prompts")
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="model of the synthetic prompts")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--url", help="target service (default: start one)")
+    parser.add_argument("--token", help="bearer token for --url")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers of the started service")
+    parser.add_argument("--database-url", help="database of the started service (default: a fresh SQLite file)")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", help="an earlier JSON report to compare with")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    if args.rps:
+        args.concurrency = None
+
+    traffic = load_traffic(args.input, args.endpoint, args.synthetic, args.model)
+    if args.url:
+        report = asyncio.run(run_load(args, args.url, traffic))
+    else:
+        stub = stub_from_arguments(args)
+        with StubServer(stub, port=free_port()) as upstream, Service(upstream.base_url, args.workers, args.database_url) as service:
+            report = asyncio.run(run_load(args, service.base_url, traffic))
+            stats = stub.state.stats
+            report["upstream"] = {"requests": stats.requests, "errors": stats.errors, "max_in_flight": stats.max_in_flight}
+    report["config"] = {
+        "commit": git_commit(),
+        "mode": "open" if args.rps else "closed",
+        **{key: value for key, value in vars(args).items() if key not in ("token", "output", "compare")},
+    }
+
+    latency, lag = report["latency_ms"], report["server_loop_lag_ms"]
+    print(
+        f"{report['requests']} requests in {report['duration_s']}s: {report['throughput_rps']} req/s ok, "
+        f"statuses {report['statuses']}"
+    )
+    print(f"latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    if "ttfb_ms" in report:
+        print(f"ttfb ms:    p50 {report['ttfb_ms']['p50']}  p95 {report['ttfb_ms']['p95']}  p99 {report['ttfb_ms']['p99']}")
+    print(f"event-loop lag ms: service {lag or 'n/a'}, driver p99 {report['client_loop_lag_ms']['p99']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            print(f"\nchange against {args.compare}:")
+            print("\n".join(compare(json.load(f), report)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Per-call cost of a log statement on the request path.
+
+Usage:
+    python -m benchmarks.bench_logging [--records 50000]
+
+"file" is the previous setup: logging.basicConfig with a FileHandler, so every call
+formats the record and writes it to disk on the calling (event loop) thread.
+"queue" is app.utils.logger: the caller only enqueues the record and a listener
+thread formats it as JSON and writes it to the rotating file.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from app.utils.logger import configure_logging, shutdown_logging
+
+
+def measure(logger: logging.Logger, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        logger.info("Generated response: id=%s model=%s", i, "gpt-3.5-turbo")
+    return (time.perf_counter() - start) / n
+
+
+def main(n: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        file_logger = logging.getLogger("bench_file")
+        file_handler = logging.FileHandler(os.path.join(tmp, "file.log"))
+        file_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        file_logger.addHandler(file_handler)
+        file_logger.setLevel(logging.INFO)
+        file_logger.propagate = False
+        per_call = measure(file_logger, n)
+        file_handler.close()
+        print(f" file: {per_call * 1e6:.2f}us per call over {n} records")
+
+        queue_logger = configure_logging("INFO", handler=logging.FileHandler(os.path.join(tmp, "queue.log")))
+        per_call = measure(queue_logger, n)
+        start = time.perf_counter()
+        shutdown_logging()
+        drain = time.perf_counter() - start
+        print(f"queue: {per_call * 1e6:.2f}us per call over {n} records (listener drained in {drain:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=50000)
+    main(parser.parse_args().records)
@@ -0,0 +1,70 @@
+"""Concurrent requests per worker: per-call blocking client vs the shared pooled client.
+
+Usage:
+    python -m benchmarks.bench_openai_client [--requests 200] [--latency 0.05]
+
+Both modes run inside a single event loop (one uvicorn worker). The "blocking" mode
+reproduces the old `OpenAI(api_key=...)` + sync `create` call per request; the
+"pooled" mode goes through `app.utils.openai_client`.
+"""
+import argparse
+import asyncio
+import os
+import time
+from benchmarks.stub_server import StubServer, create_stub_app
+
+MODEL = "gpt-3.5-turbo"
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+async def run_blocking(base_url: str, n: int) -> None:
+    from openai import OpenAI
+
+    async def one():
+        client = OpenAI(api_key="stub", base_url=base_url)
+        client.chat.completions.create(model=MODEL, messages=MESSAGES)
+        client.close()
+
+    await asyncio.gather(*(one() for _ in range(n)))
+
+
+async def run_pooled(n: int) -> None:
+    from app.utils.openai_client import init_openai_client, close_openai_client
+
+    client = await init_openai_client()
+    try:
+        await asyncio.gather(
+            *(client.chat.completions.create(model=MODEL, messages=MESSAGES) for _ in range(n))
+        )
+    finally:
+        await close_openai_client()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = create_stub_app(latency=args.latency)
+    with StubServer(stub, port=args.port) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        for name, coro in (
+            ("blocking", lambda: run_blocking(server.base_url, args.requests)),
+            ("pooled", lambda: run_pooled(args.requests)),
+        ):
+            stub.state.stats.reset()
+            start = time.perf_counter()
+            asyncio.run(coro())
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>8}: {args.requests} requests in {elapsed:.2f}s "
+                f"({args.requests / elapsed:.1f} req/s), "
+                f"max concurrent upstream requests: {stub.state.stats.max_in_flight}"
+            )
+
+
+if __name__ == "__main__":
+    main()
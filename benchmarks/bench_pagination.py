@@ -0,0 +1,149 @@
+"""Keyset vs OFFSET pagination of the read APIs on a large `responses` table.
+
+Usage:
+    python -m benchmarks.bench_pagination [--rows 10000000] [--url sqlite:///./bench_pagination.sqlite]
+
+Seeds `--rows` responses (and one prompt per 10 responses) spread over a year and a
+few models, unless the table already holds that many rows, then times the queries
+behind GET /responses and GET /prompts/{id}/responses: the first page, and a page
+deep in the result set reached by keyset (WHERE (generation_time, id) < cursor) vs
+by OFFSET. Also prints the database's plan for each keyset query so a missing index
+shows up as a table scan. Point --url at Postgres for representative numbers.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select, text, tuple_
+from app.database import Base
+from app.database.models import Prompt, PromptBlob, Response
+from app.database.types import content_hash
+
+MODELS = ["gpt-4", "gpt-3.5-turbo", "text-davinci-003", "echo"]
+START = datetime(2024, 1, 1)
+COLUMNS = [
+    Response.id,
+    Response.model,
+    Response.parameters,
+    Response.generation_time,
+    Response.prompt_tokens,
+    Response.completion_tokens,
+    Response.prompt_id,
+]
+
+
+def seed(engine, rows: int, chunk: int = 50000):
+    prompts = max(1, rows // 10)
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        have = conn.execute(select(func.count()).select_from(Response)).scalar()
+        if have >= rows:
+            return
+        print(f"seeding {rows} responses and {prompts} prompts ...")
+        for offset in range(0, prompts, chunk):
+            chunk_ids = range(offset, min(prompts, offset + chunk))
+            conn.execute(PromptBlob.__table__.insert(), [
+                {"hash": content_hash(f"prompt {i}"), "text": f"prompt {i}"} for i in chunk_ids
+            ])
+            conn.execute(Prompt.__table__.insert(), [
+                {"blob_hash": content_hash(f"prompt {i}"), "model": MODELS[i % 4], "user_id": i % 1000, "token_count": 10}
+                for i in chunk_ids
+            ])
+        for offset in range(0, rows, chunk):
+            conn.execute(Response.__table__.insert(), [
+                {
+                    "text": "x" * 100,
+                    "model": MODELS[rng.randrange(4)],
+                    "generation_time": START + timedelta(seconds=i * 31536000 // rows),
+                    "prompt_tokens": 10,
+                    "completion_tokens": 100,
+                    "prompt_id": rng.randrange(1, prompts + 1),
+                }
+                for i in range(offset, min(rows, offset + chunk))
+            ])
+
+
+def timed(conn, query, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(query).all()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, rows
+
+
+def explain(conn, query):
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    return " | ".join(str(row[-1]) for row in conn.execute(text(prefix + str(compiled))))
+
+
+def after(base, row, until=None):
+    # Mirrors list_responses: an upper bound the planner can seek on, plus the exact row comparison
+    query = base.where(
+        Response.generation_time <= row.generation_time,
+        tuple_(Response.generation_time, Response.id) < (row.generation_time, row.id),
+    )
+    return query.where(Response.generation_time < until) if until is not None and until <= row.generation_time else query
+
+
+def compare(conn, name, base, limit, depth, until=None):
+    order = (Response.generation_time.desc(), Response.id.desc())
+    bounded = base.where(Response.generation_time < until) if until is not None else base
+    first_query = bounded.order_by(*order).limit(limit + 1)
+    first_ms, first = timed(conn, first_query)
+    if len(first) <= limit:
+        print(f"{name}: single page {first_ms:7.2f}ms ({len(first)} rows)")
+        print(f"    plan: {explain(conn, first_query)}")
+        return
+    # Walk to the page at `depth` rows by following cursors, as a client would
+    cursor_row, skipped = first[limit - 1], limit
+    while skipped < depth:
+        step = min(10000, depth - skipped)
+        rows = conn.execute(after(base, cursor_row, until).order_by(*order).limit(step)).all()
+        if len(rows) < step:
+            break
+        cursor_row, skipped = rows[-1], skipped + step
+    keyset = after(base, cursor_row, until).order_by(*order).limit(limit + 1)
+    keyset_ms, _ = timed(conn, keyset)
+    offset_ms, _ = timed(conn, bounded.order_by(*order).offset(skipped).limit(limit + 1), repeat=1)
+    print(f"{name}: first page {first_ms:7.2f}ms | page at row {skipped}: keyset {keyset_ms:7.2f}ms, "
+          f"offset {offset_ms:9.2f}ms")
+    print(f"    plan: {explain(conn, keyset)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--url", default="sqlite:///./bench_pagination.sqlite")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=1000000, help="rows skipped before the timed deep page")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    seed(engine, args.rows)
+    print(f"seeded in {time.perf_counter() - start:.0f}s")
+
+    with engine.connect() as conn:
+        compare(conn, "GET /responses", select(*COLUMNS), args.limit, args.depth)
+        compare(
+            conn, "GET /responses?model=gpt-4", select(*COLUMNS).where(Response.model == "gpt-4"),
+            args.limit, args.depth // 4,
+        )
+        compare(
+            conn, "GET /responses?since&until (30 days)",
+            select(*COLUMNS).where(Response.generation_time >= START + timedelta(days=100)),
+            args.limit, args.depth // 4, until=START + timedelta(days=130),
+        )
+        compare(
+            conn, "GET /prompts/{id}/responses", select(*COLUMNS).where(Response.prompt_id == 12345),
+            args.limit, 0,
+        )
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Bursty clients against the rate limiter.
+
+Usage:
+    python -m benchmarks.bench_rate_limit [--seconds 5] [--rpm 120] [--in-flight 4]
+
+One "greedy" user fires bursts of 50 concurrent requests every 100ms while a few
+"steady" users send one request every 250ms. Each admitted request holds its slot for
+a simulated upstream call. The greedy user should be held to its budget (mostly 429s)
+while the steady users are unaffected.
+"""
+import argparse
+import asyncio
+import collections
+import time
+from fastapi import HTTPException
+from app.utils.rate_limit import RateLimiter
+
+
+async def call(limiter, counts, user, upstream):
+    try:
+        async with limiter.limit(user, "gpt-3.5-turbo", 200):
+            await asyncio.sleep(upstream)
+        counts[user, 200] += 1
+    except HTTPException as e:
+        counts[user, e.status_code] += 1
+
+
+async def greedy(limiter, counts, stop, upstream):
+    while time.monotonic() < stop:
+        await asyncio.gather(*(call(limiter, counts, "greedy", upstream) for _ in range(50)))
+        await asyncio.sleep(0.1)
+
+
+async def steady(limiter, counts, user, stop, upstream):
+    while time.monotonic() < stop:
+        await call(limiter, counts, user, upstream)
+        await asyncio.sleep(0.25)
+
+
+async def main(seconds: float, rpm: int, in_flight: int):
+    limiter = RateLimiter(
+        enabled=True, requests_per_minute=rpm, tokens_per_minute=rpm * 200, max_in_flight=in_flight, use_redis=False
+    )
+    counts = collections.Counter()
+    stop = time.monotonic() + seconds
+    upstream = 0.05
+    await asyncio.gather(
+        greedy(limiter, counts, stop, upstream),
+        *(steady(limiter, counts, f"steady-{i}", stop, upstream) for i in range(3)),
+    )
+    for user in ["greedy"] + [f"steady-{i}" for i in range(3)]:
+        print(f"{user:>9}: admitted={counts[user, 200]:5d} rejected={counts[user, 429]:5d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rpm", type=int, default=120)
+    parser.add_argument("--in-flight", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.rpm, args.in_flight))
@@ -0,0 +1,75 @@
+"""Success rate and tail latency against a faulty upstream, with and without the
+resilience layer.
+
+Usage:
+    python -m benchmarks.bench_resilience [--requests 300] [--error-rate 0.1] [--slow-rate 0.02]
+
+The stub fails `--error-rate` of the requests with a 503 and answers `--slow-rate` of
+them after 1s instead of 20ms. "plain" makes one call per request, "retry" goes through
+ResilientCaller, and "retry+hedge" additionally hedges attempts slower than the p95.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from openai import AsyncOpenAI
+from app.utils.resilience import ResilientCaller
+from benchmarks.stub_server import StubServer, create_stub_app
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run(base_url: str, n: int, caller):
+    client = AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0)
+
+    def attempt(timeout):
+        return client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES, timeout=timeout)
+
+    async def one():
+        start = time.perf_counter()
+        try:
+            if caller is None:
+                await attempt(10)
+            else:
+                await caller.call("gpt-3.5-turbo", attempt)
+            return True, time.perf_counter() - start
+        except Exception:
+            return False, time.perf_counter() - start
+
+    results = []
+    for _ in range(n // 20):  # Waves of 20 so the latency window fills up
+        results += await asyncio.gather(*(one() for _ in range(20)))
+    await client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.02)
+    args = parser.parse_args()
+    stub = create_stub_app(latency=0.02, error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=1.0)
+    modes = {
+        "plain": lambda: None,
+        "retry": lambda: ResilientCaller(backoff_base=0.02, hedge=False, failure_threshold=0),
+        "retry+hedge": lambda: ResilientCaller(backoff_base=0.02, hedge=True, hedge_min_samples=20, failure_threshold=0),
+    }
+    with StubServer(stub) as server:
+        for name, make_caller in modes.items():
+            results = asyncio.run(run(server.base_url, args.requests, make_caller()))
+            latencies = [latency for ok, latency in results if ok]
+            ok = sum(1 for success, _ in results if success)
+            print(
+                f"{name:>11}: success={ok / len(results):.1%} "
+                f"p50={statistics.median(latencies) * 1000:.0f}ms p99={percentile(latencies, 99) * 1000:.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Semantic cache index: lookup latency and recall at scale, and snapshot warm start.
+
+Usage:
+    python -m benchmarks.bench_semantic_cache [--entries 1000000] [--dim 256] [--nlist 1024] [--nprobe 8]
+
+Fills a VectorIndex with synthetic clustered unit vectors (topics plus per-prompt
+noise, which is roughly what embeddings of real prompt traffic look like), trains
+the IVF quantizer and times lookups of perturbed copies of stored vectors against
+an exhaustive scan. Recall is the share of lookups where the IVF search returns the
+same entry as the exhaustive scan. Finally saves and reloads the index.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+from app.utils.vector_index import HashingEmbedder, VectorIndex
+
+
+def clustered(rng, count, dim, centers, noise):
+    topics = centers[rng.integers(0, len(centers), size=count)]
+    vectors = topics + noise * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    return (
+        statistics.median(ordered) * 1000,
+        ordered[int(len(ordered) * 0.99)] * 1000,
+    )
+
+
+def main(entries: int, dim: int, nlist: int, nprobe: int, queries: int):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((4096, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    index = VectorIndex(dim, max_entries=entries, nlist=nlist, nprobe=nprobe)
+
+    start = time.perf_counter()
+    for offset in range(0, entries, 100000):
+        count = min(100000, entries - offset)
+        index.add_many(clustered(rng, count, dim, centers, 0.05), "gpt-4:0", np.arange(offset, offset + count))
+    print(f"insert {entries} vectors: {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    index.apply_training(index.train())
+    print(f"train {nlist} clusters: {time.perf_counter() - start:.1f}s")
+
+    targets = rng.integers(0, entries, size=queries)
+    probes = index.vectors[targets] + 0.01 * rng.standard_normal((queries, dim)).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+
+    ivf, exact, found = [], [], 0
+    centroids = index.centroids
+    for probe in probes:
+        start = time.perf_counter()
+        match = index.search(probe, "gpt-4:0")
+        ivf.append(time.perf_counter() - start)
+        index.centroids = None  # Exhaustive scan of the same index
+        start = time.perf_counter()
+        best = index.search(probe, "gpt-4:0")
+        exact.append(time.perf_counter() - start)
+        index.centroids = centroids
+        found += match is not None and match[0] == best[0]
+    print(f"ivf lookup   p50={percentiles(ivf)[0]:7.2f}ms p99={percentiles(ivf)[1]:7.2f}ms recall={found / queries:.3f}")
+    print(f"exact lookup p50={percentiles(exact)[0]:7.2f}ms p99={percentiles(exact)[1]:7.2f}ms")
+
+    embedder = HashingEmbedder(dim)
+    prompt = "Summarize the following support ticket in two sentences. " * 8
+    start = time.perf_counter()
+    for _ in range(1000):
+        embedder.embed_sync(prompt)
+    print(f"hashing embed ({len(prompt)} chars): {(time.perf_counter() - start):.3f}ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "semantic-cache.npz")
+        start = time.perf_counter()
+        index.save(path, "hashing")
+        saved = time.perf_counter() - start
+        restored = VectorIndex(dim, max_entries=entries, nlist=nlist, nprobe=nprobe)
+        start = time.perf_counter()
+        restored.load(path, "hashing")
+        print(
+            f"snapshot {os.path.getsize(path) / 2**20:.0f}MiB: save={saved:.1f}s "
+            f"load={time.perf_counter() - start:.1f}s entries={len(restored)}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    main(args.entries, args.dim, args.nlist, args.nprobe, args.queries)
@@ -0,0 +1,65 @@
+"""Upstream calls with and without single-flight coalescing under a hot-prompt spike.
+
+Usage:
+    python -m benchmarks.bench_singleflight [--requests 500] [--distinct 5] [--latency 0.2]
+
+Fires `--requests` concurrent completions spread over `--distinct` prompts at a local
+stub server and counts how many calls actually reach it.
+"""
+import argparse
+import asyncio
+import os
+import time
+from benchmarks.stub_server import StubServer, create_stub_app
+
+
+async def run(n: int, distinct: int, coalesce: bool) -> None:
+    from app.utils.openai_client import init_openai_client, close_openai_client
+    from app.utils.singleflight import SingleFlight
+
+    client = await init_openai_client()
+    flight = SingleFlight(use_redis=False)
+
+    async def complete(prompt: str) -> str:
+        response = await client.chat.completions.create(
+            model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content
+
+    async def one(i: int) -> str:
+        prompt = f"popular prompt #{i % distinct}"
+        if coalesce:
+            return await flight.do(prompt, lambda: complete(prompt))
+        return await complete(prompt)
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(n)))
+    finally:
+        await close_openai_client()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = create_stub_app(latency=args.latency)
+    with StubServer(stub, port=args.port) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        for coalesce in (False, True):
+            stub.state.stats.reset()
+            start = time.perf_counter()
+            asyncio.run(run(args.requests, args.distinct, coalesce))
+            elapsed = time.perf_counter() - start
+            print(
+                f"single-flight={'on ' if coalesce else 'off'}: {args.requests} requests, "
+                f"{stub.state.stats.requests} upstream calls, {elapsed:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Import time of the app, as reported by `python -X importtime`.
+
+Usage:
+    python -m benchmarks.bench_startup [--module app.main] [--runs 5] [--top 20]
+
+Imports the module in fresh interpreters and keeps the fastest run (slower ones paid
+for a cold page cache or a noisy neighbour). Reports the total, the time by top-level
+package and the slowest modules, and flags the dependencies meant to load on first
+use (LAZY_DEPENDENCIES) that were imported anyway. tests/test_utils.py fails when the
+total exceeds IMPORT_TIME_BUDGET seconds or one of those dependencies is imported.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import Counter
+from typing import Dict, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported when first needed: provider SDKs and their HTTP stack, the semantic cache's
+# numpy, Redis, tokenizers. None of them should be paid for by importing the app.
+LAZY_DEPENDENCIES = ("openai", "httpx", "numpy", "redis", "tiktoken")
+
+IMPORT_TIME_BUDGET = float(os.environ.get("IMPORT_TIME_BUDGET", 1.5))
+
+
+def import_profile(module: str = "app.main") -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    Imports `module` in a fresh interpreter with `-X importtime`.
+
+    Args:
+        module: Dotted name of the module to import.
+
+    Returns:
+        The total import time in seconds and, per imported module, its
+        (self, cumulative) time in microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules[module][1] / 1e6, modules
+
+
+def fastest_import(module: str = "app.main", runs: int = 5) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """The `import_profile` of the fastest of `runs` imports."""
+    return min((import_profile(module) for _ in range(runs)), key=lambda profile: profile[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    total, modules = fastest_import(args.module, args.runs)
+    print(f"import {args.module}: {total * 1000:.0f}ms (fastest of {args.runs}, budget {IMPORT_TIME_BUDGET * 1000:.0f}ms)")
+    packages = Counter()
+    for name, (own, _) in modules.items():
+        packages[name.split(".")[0]] += own
+    print("\nby top-level package (self time):")
+    for name, own in packages.most_common(args.top):
+        print(f"  {own / 1000:8.1f}ms  {name}")
+    print("\nslowest modules (cumulative):")
+    for name, (_, cumulative) in sorted(modules.items(), key=lambda item: -item[1][1])[: args.top]:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+    eager = [name for name in LAZY_DEPENDENCIES if name in modules]
+    print(f"\nlazy dependencies imported eagerly: {', '.join(eager) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Local OpenAI-compatible stub server used by the benchmarks.
+
+Usage:
+    python -m benchmarks.stub_server [--port 8765] [--latency 0.05] [--distribution lognormal]
+        [--completion-tokens 50] [--tokens-per-second 100] [--error-rate 0.01]
+
+Serves `POST /v1/chat/completions`, streamed (`"stream": true`, Server-Sent Events)
+or not, and keeps track of how many requests were in flight at the same time.
+
+The latency before the first token is drawn per request from `distribution`, with
+mean `latency`: "fixed", "uniform" (0 to twice the mean), "exponential" or
+"lognormal" (`latency_sigma` sets its spread, hence the tail). With
+`completion_tokens` the reply is that many tokens long; with `tokens_per_second` they
+are generated at that rate, one SSE chunk per token when streamed and all at once,
+after the same delay, otherwise.
+
+Faults can be injected for resilience tests: a fraction of requests fails with
+`error_status` (and an optional Retry-After), a fraction is slowed down to
+`slow_latency`, and `stub.state.script` queues exact outcomes ("ok", "slow" or a
+status code) for the next requests.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class StubStats:
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.errors = 0
+
+    def reset(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.errors = 0
+
+
+def sample_latency(mean: float, distribution: str = "fixed", sigma: float = 0.5) -> float:
+    """
+    Draws a latency in seconds.
+
+    Args:
+        mean: The mean latency.
+        distribution: One of `DISTRIBUTIONS`.
+        sigma: Standard deviation of the underlying normal for "lognormal".
+
+    Returns:
+        A non-negative latency whose expected value is `mean`.
+    """
+    if mean <= 0 or distribution == "fixed":
+        return max(mean, 0.0)
+    if distribution == "uniform":
+        return random.uniform(0, 2 * mean)
+    if distribution == "exponential":
+        return random.expovariate(1 / mean)
+    if distribution == "lognormal":
+        return random.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+    raise ValueError(f"Unknown latency distribution: {distribution}")
+
+
+def create_stub_app(
+    latency: float = 0.05,
+    error_rate: float = 0.0,
+    error_status: int = 503,
+    retry_after: Optional[float] = None,
+    slow_rate: float = 0.0,
+    slow_latency: float = 1.0,
+    distribution: str = "fixed",
+    latency_sigma: float = 0.5,
+    completion_tokens: Optional[int] = None,
+    tokens_per_second: float = 0.0,
+) -> FastAPI:
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution: {distribution}")
+    stub = FastAPI()
+    stub.state.stats = StubStats()
+    stub.state.latency = latency
+    stub.state.error_rate = error_rate
+    stub.state.error_status = error_status
+    stub.state.retry_after = retry_after
+    stub.state.slow_rate = slow_rate
+    stub.state.slow_latency = slow_latency
+    stub.state.distribution = distribution
+    stub.state.latency_sigma = latency_sigma
+    stub.state.completion_tokens = completion_tokens
+    stub.state.tokens_per_second = tokens_per_second
+    stub.state.script = collections.deque()
+
+    def reply_tokens():
+        if stub.state.completion_tokens is None:
+            return ["This", " is", " a", " stubbed", " response"]
+        return [" token"] * stub.state.completion_tokens
+
+    def chunk(completion_id, model, delta, finish_reason=None):
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    async def stream(completion_id, model, tokens, stats):
+        try:
+            yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for token in tokens:
+                if stub.state.tokens_per_second > 0:
+                    await asyncio.sleep(1 / stub.state.tokens_per_second)
+                yield chunk(completion_id, model, {"content": token})
+            yield chunk(completion_id, model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+        finally:
+            stats.in_flight -= 1
+
+    @stub.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        stats = stub.state.stats
+        body = await request.json()
+        stats.requests += 1
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        state = stub.state
+        if state.script:
+            outcome = state.script.popleft()
+        elif random.random() < state.error_rate:
+            outcome = state.error_status
+        elif random.random() < state.slow_rate:
+            outcome = "slow"
+        else:
+            outcome = "ok"
+        tokens = reply_tokens()
+        streamed = bool(body.get("stream")) and not isinstance(outcome, int)
+        delay = state.slow_latency if outcome == "slow" else sample_latency(state.latency, state.distribution, state.latency_sigma)
+        if not streamed and not isinstance(outcome, int) and state.tokens_per_second > 0:
+            delay += len(tokens) / state.tokens_per_second
+        try:
+            await asyncio.sleep(delay)
+        except BaseException:
+            stats.in_flight -= 1
+            raise
+        if not streamed:
+            stats.in_flight -= 1
+        if isinstance(outcome, int):
+            stats.errors += 1
+            headers = {"Retry-After": str(state.retry_after)} if state.retry_after is not None else None
+            return JSONResponse(
+                status_code=outcome,
+                content={"error": {"message": "injected fault", "type": "server_error"}},
+                headers=headers,
+            )
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model", "stub")
+        if streamed:
+            return StreamingResponse(stream(completion_id, model, tokens, stats), media_type="text/event-stream")
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 5, "completion_tokens": len(tokens), "total_tokens": 5 + len(tokens)},
+        }
+
+    @stub.get("/stats")
+    async def read_stats():
+        return vars(stub.state.stats)
+
+    return stub
+
+
+class StubServer:
+    """Runs the stub app with uvicorn on a background thread."""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: int = 8765):
+        self.app = app
+        self.host = host
+        self.port = port
+        self._server = uvicorn.Server(
+            uvicorn.Config(app, host=host, port=port, log_level="warning", backlog=4096)
+        )
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the `create_stub_app` options to a benchmark's argument parser."""
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds before the first token")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="spread of the lognormal distribution")
+    parser.add_argument("--completion-tokens", type=int, help="reply length (default: a 5-token sentence)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="generation rate (0: instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=1.0)
+
+
+def stub_from_arguments(args: argparse.Namespace) -> FastAPI:
+    return create_stub_app(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        distribution=args.distribution,
+        latency_sigma=args.latency_sigma,
+        completion_tokens=args.completion_tokens,
+        tokens_per_second=args.tokens_per_second,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    print(f"OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    uvicorn.run(stub_from_arguments(args), host=args.host, port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic import BaseSettings
 from dotenv import load_dotenv
 
@@ -10,9 +11,158 @@ class Settings(BaseSettings):
     SECRET_KEY: str = os.environ.get("SECRET_KEY")
     DEBUG: bool = os.environ.get("DEBUG", False)
     LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_FILE: str = os.environ.get("LOG_FILE", "app.log")
+    LOG_ROTATION: str = os.environ.get("LOG_ROTATION", "size")  # "size", "time" or "external" (logrotate; the gunicorn.conf.py default)
+    LOG_MAX_BYTES: int = int(os.environ.get("LOG_MAX_BYTES", 50 * 1024 * 1024))
+    LOG_ROTATE_WHEN: str = os.environ.get("LOG_ROTATE_WHEN", "midnight")
+    LOG_BACKUP_COUNT: int = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+    LOG_SAMPLE_RATES: str = os.environ.get("LOG_SAMPLE_RATES", "")  # e.g. "INFO=0.1,DEBUG=0.01"
     REDIS_HOST: str = os.environ.get("REDIS_HOST", "localhost")
     REDIS_PORT: int = int(os.environ.get("REDIS_PORT", 6379))
 
+    # Production server (gunicorn.conf.py): SERVER_WORKERS=0 runs one worker per CPU; a worker is
+    # recycled after about SERVER_MAX_REQUESTS requests (0 never); on SIGTERM a worker stops accepting,
+    # gives in-flight requests SERVER_DRAIN_TIMEOUT seconds, then SERVER_SHUTDOWN_TIMEOUT for its shutdown hooks
+    SERVER_BIND: str = os.environ.get("SERVER_BIND", "0.0.0.0:8000")
+    SERVER_WORKERS: int = int(os.environ.get("SERVER_WORKERS", 0))
+    SERVER_MAX_REQUESTS: int = int(os.environ.get("SERVER_MAX_REQUESTS", 10000))
+    SERVER_MAX_REQUESTS_JITTER: int = int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", 1000))
+    SERVER_DRAIN_TIMEOUT: float = float(os.environ.get("SERVER_DRAIN_TIMEOUT", 30))
+    SERVER_SHUTDOWN_TIMEOUT: float = float(os.environ.get("SERVER_SHUTDOWN_TIMEOUT", 15))
+    SERVER_TIMEOUT: int = int(os.environ.get("SERVER_TIMEOUT", 60))  # Unresponsive worker is restarted
+
+    # Event-loop lag sampling (`event_loop_lag_seconds`, app/utils/metrics.py): seconds between samples, 0 disables
+    LOOP_LAG_INTERVAL: float = float(os.environ.get("LOOP_LAG_INTERVAL", 0.25))
+
+    # Async database engine pool
+    DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW: int = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT: float = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE: int = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING: bool = os.environ.get("DB_POOL_PRE_PING", True)
+
+    # Postgres range partitioning of `responses` by month (see app/database/partitions.py)
+    RESPONSES_PARTITION_MONTHS_AHEAD: int = int(os.environ.get("RESPONSES_PARTITION_MONTHS_AHEAD", 3))
+    RESPONSES_RETENTION_MONTHS: int = int(os.environ.get("RESPONSES_RETENTION_MONTHS", 0))  # 0 keeps everything
+    RESPONSES_RETENTION_ARCHIVE: bool = os.environ.get("RESPONSES_RETENTION_ARCHIVE", False)  # Detach, don't drop
+    PARTITION_MAINTENANCE_INTERVAL: float = float(os.environ.get("PARTITION_MAINTENANCE_INTERVAL", 3600))
+
+    # Storage of prompt/response text (app/database/types.py): values of at least
+    # TEXT_COMPRESSION_MIN_BYTES are compressed; TEXT_COMPRESSION_DICT lists trained dictionary
+    # files, comma-separated: the first is used to write, all of them to read
+    TEXT_COMPRESSION: str = os.environ.get("TEXT_COMPRESSION", "auto")  # "auto" (zstd if installed), "zstd", "zlib" or "none"
+    TEXT_COMPRESSION_MIN_BYTES: int = int(os.environ.get("TEXT_COMPRESSION_MIN_BYTES", 256))
+    TEXT_COMPRESSION_LEVEL: int = int(os.environ.get("TEXT_COMPRESSION_LEVEL", 3))
+    TEXT_COMPRESSION_DICT: str = os.environ.get("TEXT_COMPRESSION_DICT", "")
+
+    # Content-addressed prompt bodies: hashes this process knows are stored (`prompt_blobs`, app/routers/prompts/services.py)
+    PROMPT_BLOB_CACHE_SIZE: int = int(os.environ.get("PROMPT_BLOB_CACHE_SIZE", 100000))
+
+    # Write-behind batched persistence of generated responses; POST /responses then returns "id": null
+    WRITE_BEHIND_ENABLED: bool = os.environ.get("WRITE_BEHIND_ENABLED", False)
+    WRITE_BEHIND_QUEUE_SIZE: int = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 10000))
+    WRITE_BEHIND_BATCH_SIZE: int = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500))
+    WRITE_BEHIND_FLUSH_INTERVAL: float = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", 0.5))
+    WRITE_BEHIND_PUT_TIMEOUT: float = float(os.environ.get("WRITE_BEHIND_PUT_TIMEOUT", 1.0))
+    WRITE_BEHIND_MAX_ATTEMPTS: int = int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", 3))  # Then the batch is dropped
+    WRITE_BEHIND_RETRY_BACKOFF: float = float(os.environ.get("WRITE_BEHIND_RETRY_BACKOFF", 0.5))  # Doubles per retry
+
+    # Verified-token -> user cache used by the auth middleware. The cache is per
+    # process: invalidate_user() only clears the worker it runs in, so under several
+    # workers a revoked token stays accepted elsewhere for up to AUTH_CACHE_TTL.
+    # Lower the TTL (0 disables caching) where revocation must take effect at once.
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000))
+    AUTH_CACHE_TTL: float = float(os.environ.get("AUTH_CACHE_TTL", 300))
+
+    # Shared upstream HTTP client (created once at startup)
+    OPENAI_BASE_URL: Optional[str] = os.environ.get("OPENAI_BASE_URL")
+    OPENAI_MAX_CONNECTIONS: int = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+    OPENAI_KEEPALIVE_EXPIRY: float = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 30.0))
+    OPENAI_HTTP2: bool = os.environ.get("OPENAI_HTTP2", True)
+    OPENAI_TIMEOUT: float = float(os.environ.get("OPENAI_TIMEOUT", 60.0))
+    OPENAI_CONNECT_TIMEOUT: float = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5.0))
+    OPENAI_MAX_RETRIES: int = int(os.environ.get("OPENAI_MAX_RETRIES", 0))  # Retries are done by app/utils/resilience.py
+
+    # Completion backends: JSON list of {"name", "type", "models", "weight", ...}; empty uses
+    # app.providers.registry.DEFAULT_PROVIDERS (plus the test-only echo model with DEBUG)
+    PROVIDERS: str = os.environ.get("PROVIDERS", "")
+
+    # Local token counting and context-window budgeting (app/utils/tokenizer.py)
+    TOKENIZER: str = os.environ.get("TOKENIZER", "auto")  # "auto" (tiktoken if installed), "tiktoken" or "estimate"
+    TOKEN_COUNT_CACHE_SIZE: int = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", 10000))
+    DEFAULT_CONTEXT_WINDOW: int = int(os.environ.get("DEFAULT_CONTEXT_WINDOW", 4096))
+    MIN_COMPLETION_TOKENS: int = int(os.environ.get("MIN_COMPLETION_TOKENS", 16))
+    PROMPT_OVERFLOW: str = os.environ.get("PROMPT_OVERFLOW", "reject")  # "reject" (400) or "truncate"
+
+    # Conversations (app/routers/conversations): recent histories cached in memory; turns that no longer
+    # fit the model's context window are left out ("trim") or folded into a running summary ("summarize")
+    CONVERSATION_CACHE_SIZE: int = int(os.environ.get("CONVERSATION_CACHE_SIZE", 1000))
+    CONVERSATION_CACHE_TTL: float = float(os.environ.get("CONVERSATION_CACHE_TTL", 3600.0))
+    CONVERSATION_OVERFLOW: str = os.environ.get("CONVERSATION_OVERFLOW", "trim")
+    CONVERSATION_SUMMARY_TOKENS: int = int(os.environ.get("CONVERSATION_SUMMARY_TOKENS", 256))
+
+    # Admission control: per-model concurrency, bounded priority queue, deadline-based shedding
+    SCHEDULER_ENABLED: bool = os.environ.get("SCHEDULER_ENABLED", True)
+    SCHEDULER_MAX_CONCURRENCY_PER_MODEL: int = int(os.environ.get("SCHEDULER_MAX_CONCURRENCY_PER_MODEL", 64))
+    SCHEDULER_MAX_QUEUE: int = int(os.environ.get("SCHEDULER_MAX_QUEUE", 1000))
+    SCHEDULER_USER_PRIORITIES: str = os.environ.get("SCHEDULER_USER_PRIORITIES", "")  # JSON {"<user id>": "batch"}
+
+    # Upstream resilience: retries with backoff, per-request deadline, hedging, circuit breaker
+    UPSTREAM_MAX_ATTEMPTS: int = int(os.environ.get("UPSTREAM_MAX_ATTEMPTS", 3))
+    UPSTREAM_BACKOFF_BASE: float = float(os.environ.get("UPSTREAM_BACKOFF_BASE", 0.25))
+    UPSTREAM_BACKOFF_MAX: float = float(os.environ.get("UPSTREAM_BACKOFF_MAX", 8.0))
+    UPSTREAM_DEADLINE: float = float(os.environ.get("UPSTREAM_DEADLINE", 60.0))
+    UPSTREAM_HEDGE_ENABLED: bool = os.environ.get("UPSTREAM_HEDGE_ENABLED", False)
+    UPSTREAM_HEDGE_PERCENTILE: float = float(os.environ.get("UPSTREAM_HEDGE_PERCENTILE", 95))
+    UPSTREAM_HEDGE_MIN_SAMPLES: int = int(os.environ.get("UPSTREAM_HEDGE_MIN_SAMPLES", 20))
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+    CIRCUIT_RESET_TIMEOUT: float = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30.0))
+
+    # Batch endpoints (POST /prompts/batch, POST /responses/batch)
+    PROMPT_BATCH_MAX_SIZE: int = int(os.environ.get("PROMPT_BATCH_MAX_SIZE", 10000))
+    RESPONSE_BATCH_MAX_SIZE: int = int(os.environ.get("RESPONSE_BATCH_MAX_SIZE", 1000))
+    BATCH_MAX_CONCURRENCY: int = int(os.environ.get("BATCH_MAX_CONCURRENCY", 16))
+
+    # Read APIs (GET /prompts, GET /responses): keyset-paginated page sizes
+    PAGE_DEFAULT_SIZE: int = int(os.environ.get("PAGE_DEFAULT_SIZE", 50))
+    PAGE_MAX_SIZE: int = int(os.environ.get("PAGE_MAX_SIZE", 500))
+
+    # Streaming responses: upper bound on the text kept in memory for persistence
+    STREAM_MAX_RESPONSE_CHARS: int = int(os.environ.get("STREAM_MAX_RESPONSE_CHARS", 100000))
+
+    # Exact-match response cache (in-process LRU/TTL tier, optional shared Redis tier)
+    RESPONSE_CACHE_ENABLED: bool = os.environ.get("RESPONSE_CACHE_ENABLED", True)
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 10000))
+    RESPONSE_CACHE_TTL: float = float(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+    RESPONSE_CACHE_REDIS: bool = os.environ.get("RESPONSE_CACHE_REDIS", False)
+
+    # Opt-in semantic cache: answers near-duplicate prompts from an embedding index of past responses
+    SEMANTIC_CACHE_ENABLED: bool = os.environ.get("SEMANTIC_CACHE_ENABLED", False)
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92))  # Cosine similarity
+    SEMANTIC_CACHE_MAX_ENTRIES: int = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 100000))
+    SEMANTIC_CACHE_EMBEDDER: str = os.environ.get("SEMANTIC_CACHE_EMBEDDER", "hashing")  # "hashing" or "openai"
+    SEMANTIC_CACHE_DIM: int = int(os.environ.get("SEMANTIC_CACHE_DIM", 256))
+    SEMANTIC_CACHE_EMBEDDING_MODEL: str = os.environ.get("SEMANTIC_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+    SEMANTIC_CACHE_NLIST: int = int(os.environ.get("SEMANTIC_CACHE_NLIST", 256))  # Coarse clusters of the index
+    SEMANTIC_CACHE_NPROBE: int = int(os.environ.get("SEMANTIC_CACHE_NPROBE", 8))  # Clusters searched per lookup
+    SEMANTIC_CACHE_PATH: str = os.environ.get("SEMANTIC_CACHE_PATH", "")  # Snapshot file; empty disables persistence
+
+    # Single-flight coalescing of concurrent identical completion requests
+    SINGLEFLIGHT_ENABLED: bool = os.environ.get("SINGLEFLIGHT_ENABLED", True)
+    SINGLEFLIGHT_SHARE_RESPONSE: bool = os.environ.get("SINGLEFLIGHT_SHARE_RESPONSE", False)
+    SINGLEFLIGHT_REDIS: bool = os.environ.get("SINGLEFLIGHT_REDIS", False)
+    SINGLEFLIGHT_LOCK_TTL: float = float(os.environ.get("SINGLEFLIGHT_LOCK_TTL", 60.0))
+    SINGLEFLIGHT_POLL_INTERVAL: float = float(os.environ.get("SINGLEFLIGHT_POLL_INTERVAL", 0.05))
+
+    # Per-user/per-model admission control in front of the upstream (0 disables a limit)
+    RATE_LIMIT_ENABLED: bool = os.environ.get("RATE_LIMIT_ENABLED", True)
+    RATE_LIMIT_REQUESTS_PER_MINUTE: int = int(os.environ.get("RATE_LIMIT_REQUESTS_PER_MINUTE", 600))
+    RATE_LIMIT_TOKENS_PER_MINUTE: int = int(os.environ.get("RATE_LIMIT_TOKENS_PER_MINUTE", 200000))
+    RATE_LIMIT_MAX_IN_FLIGHT: int = int(os.environ.get("RATE_LIMIT_MAX_IN_FLIGHT", 16))
+    RATE_LIMIT_REDIS: bool = os.environ.get("RATE_LIMIT_REDIS", False)
+    RATE_LIMIT_BATCH_MAX_WAIT: float = float(os.environ.get("RATE_LIMIT_BATCH_MAX_WAIT", 30.0))
+
     class Config:
         env_file = ".env"  # Load environment variables from .env
 
@@ -0,0 +1,60 @@
+"""Production serving profile: gunicorn managing uvicorn workers.
+
+Usage:
+    gunicorn app.main:app
+
+gunicorn reads this file from the working directory. Settings come from the
+environment (see the SERVER_* settings in config.py). The app is imported once in
+the master (`preload_app`) and the workers are forked from it.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# All workers append to the one LOG_FILE. A size- or time-rotating handler in each of them
+# would rotate the file over the others' heads and lose lines, so unless configured
+# otherwise they reopen it after an external logrotate (WatchedFileHandler). Set before
+# settings are read.
+os.environ.setdefault("LOG_ROTATION", "external")
+
+from app.config import settings  # noqa: E402
+
+# Prometheus metrics of all workers, aggregated at scrape time from one file per
+# worker. Must be set before the app, hence prometheus_client, is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus-multiproc"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = settings.SERVER_BIND
+# Async workers: one event loop per core serves many concurrent completions
+workers = settings.SERVER_WORKERS or multiprocessing.cpu_count()
+worker_class = "app.server.DrainingUvicornWorker"
+preload_app = True
+max_requests = settings.SERVER_MAX_REQUESTS
+max_requests_jitter = settings.SERVER_MAX_REQUESTS_JITTER
+# A worker gets its drain period plus its shutdown hooks before gunicorn kills it
+graceful_timeout = int(settings.SERVER_DRAIN_TIMEOUT + settings.SERVER_SHUTDOWN_TIMEOUT)
+timeout = settings.SERVER_TIMEOUT
+
+
+def on_starting(server):
+    # Runs once, after the preload: files of a previous run would be summed into this
+    # one's counters, and the master's own are unused (workers write under their pid)
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    # The app imports the provider SDK on first use; importing it here, once, lets the
+    # forked workers share it instead of each importing it in its startup hook
+    import openai  # noqa: F401
+
+
+def post_fork(server, worker):
+    from app.server import reset_after_fork
+
+    reset_after_fork()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,58 @@
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine, pool
+from app.config import settings
+from app.database import Base
+import app.database.models  # noqa: F401 (registers the tables on Base.metadata)
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def sync_database_url(url: str) -> str:
+    """Migrations run on the sync drivers (psycopg2 / sqlite3) whatever the app uses."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    for async_driver in ("+asyncpg", "+aiosqlite"):
+        url = url.replace(async_driver, "", 1)
+    return url
+
+
+def database_url() -> str:
+    # `alembic -x url=...` or a Config's sqlalchemy.url (tests) win over DATABASE_URL
+    return (
+        context.get_x_argument(as_dictionary=True).get("url")
+        or config.get_main_option("sqlalchemy.url")
+        or sync_database_url(settings.DATABASE_URL)
+    )
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=database_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connectable = create_engine(database_url(), poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        # Batch mode lets ALTERs work on SQLite (tests, local development)
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+        with context.begin_transaction():
+            context.run_migrations()
+    connectable.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
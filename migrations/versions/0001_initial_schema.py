@@ -0,0 +1,57 @@
+"""Initial schema: users, prompts, responses
+
+The tables as `Base.metadata.create_all` used to create them. A database created that
+way is brought under migrations with `alembic stamp 0001` followed by
+`alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-11-01 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(), nullable=False, unique=True),
+        sa.Column("api_key", sa.String(), nullable=False),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_table(
+        "prompts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("text", sa.String(), nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("parameters", sa.String()),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_prompts_id", "prompts", ["id"])
+    op.create_table(
+        "responses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("text", sa.String(), nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("parameters", sa.String()),
+        sa.Column("generation_time", sa.DateTime(), nullable=False),
+        sa.Column("prompt_id", sa.Integer(), sa.ForeignKey("prompts.id")),
+    )
+    op.create_index("ix_responses_id", "responses", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("responses")
+    op.drop_table("prompts")
+    op.drop_table("users")
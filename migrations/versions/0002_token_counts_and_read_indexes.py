@@ -0,0 +1,44 @@
+"""Token count columns and the indexes of the paginated read APIs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-11-01 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("prompts") as batch:
+        batch.add_column(sa.Column("token_count", sa.Integer()))
+    with op.batch_alter_table("responses") as batch:
+        batch.add_column(sa.Column("prompt_tokens", sa.Integer()))
+        batch.add_column(sa.Column("completion_tokens", sa.Integer()))
+    op.create_index("ix_prompts_user_id_id", "prompts", ["user_id", "id"])
+    op.create_index("ix_prompts_model_id", "prompts", ["model", "id"])
+    op.create_index("ix_responses_generation_time_id", "responses", ["generation_time", "id"])
+    op.create_index("ix_responses_model_generation_time_id", "responses", ["model", "generation_time", "id"])
+    op.create_index("ix_responses_prompt_id_generation_time_id", "responses", ["prompt_id", "generation_time", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_responses_prompt_id_generation_time_id", "responses")
+    op.drop_index("ix_responses_model_generation_time_id", "responses")
+    op.drop_index("ix_responses_generation_time_id", "responses")
+    op.drop_index("ix_prompts_model_id", "prompts")
+    op.drop_index("ix_prompts_user_id_id", "prompts")
+    with op.batch_alter_table("responses") as batch:
+        batch.drop_column("completion_tokens")
+        batch.drop_column("prompt_tokens")
+    with op.batch_alter_table("prompts") as batch:
+        batch.drop_column("token_count")
@@ -0,0 +1,102 @@
+"""Range-partition responses by generation_time (Postgres only)
+
+`responses` becomes a table partitioned by month. The existing table is not copied.
+It is attached as the first partition, covering everything before the start of
+next month, and the partitions of the following months are created empty. After
+that, app.database.partitions creates new months ahead of time and retires expired
+ones. The partition DDL is copied here rather than imported, so that later changes to
+that module cannot change what this revision does. On a partitioned table the primary key has to include the partition key, so it
+becomes (id, generation_time); ids still come from the same sequence.
+
+On SQLite this revision does nothing.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-11-01 00:00:00
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = {
+    "ix_responses_id": "id",
+    "ix_responses_generation_time_id": "generation_time, id",
+    "ix_responses_model_generation_time_id": "model, generation_time, id",
+    "ix_responses_prompt_id_generation_time_id": "prompt_id, generation_time, id",
+}
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def create_partition_sql(start: datetime) -> str:
+    """The monthly partition of `responses` starting at `start`, as app.database.partitions names it."""
+    return (
+        f"CREATE TABLE IF NOT EXISTS responses_p{start:%Y_%m} PARTITION OF responses "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{add_months(start, 1):%Y-%m-%d %H:%M:%S}')"
+    )
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    boundary = add_months(month_start(datetime.utcnow()), 1)
+    op.execute("ALTER TABLE responses RENAME TO responses_legacy")
+    op.execute("ALTER TABLE responses_legacy RENAME CONSTRAINT responses_pkey TO responses_legacy_pkey")
+    for name in INDEXES:
+        op.execute(f"ALTER INDEX {name} RENAME TO {name.replace('ix_responses', 'ix_responses_legacy', 1)}")
+    # A validated CHECK matching the partition bound lets ATTACH skip its own full scan
+    op.execute(
+        f"ALTER TABLE responses_legacy ADD CONSTRAINT responses_legacy_bound "
+        f"CHECK (generation_time < '{boundary:%Y-%m-%d %H:%M:%S}') NOT VALID"
+    )
+    op.execute("ALTER TABLE responses_legacy VALIDATE CONSTRAINT responses_legacy_bound")
+
+    op.execute("CREATE TABLE responses (LIKE responses_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (generation_time)")
+    op.execute("ALTER TABLE responses ADD PRIMARY KEY (id, generation_time)")
+    op.execute("ALTER SEQUENCE responses_id_seq OWNED BY responses.id")
+    op.execute(
+        f"ALTER TABLE responses ATTACH PARTITION responses_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{boundary:%Y-%m-%d %H:%M:%S}')"
+    )
+    op.execute("ALTER TABLE responses_legacy DROP CONSTRAINT responses_legacy_bound")
+    # Created on the parent, each index is attached to the legacy table's equivalent
+    # one instead of being built again
+    for name, columns in INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON responses ({columns})")
+    op.execute("ALTER TABLE responses_legacy DROP CONSTRAINT IF EXISTS responses_prompt_id_fkey")
+    op.execute("ALTER TABLE responses ADD FOREIGN KEY (prompt_id) REFERENCES prompts (id)")
+    for month in range(settings.RESPONSES_PARTITION_MONTHS_AHEAD + 1):
+        op.execute(create_partition_sql(add_months(boundary, month)))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # Copies every row back into a plain table: plan for the time this takes
+    op.execute("CREATE TABLE responses_plain (LIKE responses INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO responses_plain SELECT * FROM responses")
+    op.execute("ALTER SEQUENCE responses_id_seq OWNED BY responses_plain.id")
+    op.execute("DROP TABLE responses")
+    op.execute("ALTER TABLE responses_plain RENAME TO responses")
+    op.execute("ALTER TABLE responses ADD PRIMARY KEY (id)")
+    op.execute("ALTER TABLE responses ADD FOREIGN KEY (prompt_id) REFERENCES prompts (id)")
+    for name, columns in INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON responses ({columns})")
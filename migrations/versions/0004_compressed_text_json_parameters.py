@@ -0,0 +1,188 @@
+"""Compressed text columns and JSON parameters
+
+`text` of prompts and responses becomes the tagged, compressed bytes of
+app.database.types.CompressedText, and `parameters` a JSON (JSONB on Postgres)
+document instead of the `str(dict)` repr it used to be. Existing rows are converted
+in Python, in batches of BATCH_SIZE rows walked by id, inside the migration's
+transaction. That holds the tables' lock for the whole conversion, so run it on a
+large database in a maintenance window, and VACUUM afterwards to reclaim the old
+column versions. It cannot be rendered offline (`--sql`).
+
+The storage format is copied here from app.database.types as of this revision rather
+than imported, so that later changes to that module cannot change what this revision
+does. Text is written with zlib, which needs nothing outside the standard library,
+and read back in any of the format's encodings (zstd needs the zstandard package,
+dictionaries the TEXT_COMPRESSION_DICT files they were written with).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-11-15 00:00:00
+
+"""
+import ast
+import functools
+import zlib
+from typing import Any, Dict, Optional, Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+# First byte of a stored text: how the rest is encoded. The dictionary variants carry the
+# dictionary's 4-byte crc32 next.
+RAW, ZLIB, ZLIB_DICT, ZSTD, ZSTD_DICT = range(5)
+
+JSONDocument = sa.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+
+@functools.lru_cache(maxsize=None)
+def dictionaries() -> Dict[bytes, bytes]:
+    found = {}
+    for path in filter(None, (p.strip() for p in settings.TEXT_COMPRESSION_DICT.split(","))):
+        with open(path, "rb") as f:
+            dictionary = f.read()
+        found[zlib.crc32(dictionary).to_bytes(4, "big")] = dictionary
+    return found
+
+
+def encode_text(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if settings.TEXT_COMPRESSION != "none" and len(raw) >= settings.TEXT_COMPRESSION_MIN_BYTES:
+        body = zlib.compress(raw, min(settings.TEXT_COMPRESSION_LEVEL, 9))
+        if 1 + len(body) < len(raw):
+            return bytes([ZLIB]) + body
+    return bytes([RAW]) + raw
+
+
+def decode_text(stored: bytes) -> str:
+    tag, body = stored[0], stored[1:]
+    dictionary = None
+    if tag in (ZLIB_DICT, ZSTD_DICT):
+        dict_id, body = body[:4], body[4:]
+        if dict_id not in dictionaries():
+            raise ValueError(f"Text compressed with unknown dictionary {dict_id.hex()} (see TEXT_COMPRESSION_DICT)")
+        dictionary = dictionaries()[dict_id]
+    if tag == RAW:
+        return body.decode("utf-8")
+    if tag == ZLIB:
+        return zlib.decompress(body).decode("utf-8")
+    if tag == ZLIB_DICT:
+        decompressor = zlib.decompressobj(zdict=dictionary[-32768:])
+        return (decompressor.decompress(body) + decompressor.flush()).decode("utf-8")
+    if tag in (ZSTD, ZSTD_DICT):
+        import zstandard
+
+        params = {} if dictionary is None else {"dict_data": zstandard.ZstdCompressionDict(dictionary)}
+        return zstandard.ZstdDecompressor(**params).decompress(body).decode("utf-8")
+    raise ValueError(f"Unknown text encoding tag {tag}")
+
+
+class CompressedText(sa.TypeDecorator):
+    impl = sa.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else encode_text(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else decode_text(bytes(value))
+
+
+def parse_legacy_parameters(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Reads a `str(dict)` parameters value; anything else is kept under "raw"."""
+    if value is None or value in ("", "None"):
+        return None
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return {"raw": value}
+    return parsed if isinstance(parsed, dict) else {"raw": value}
+
+
+def legacy_parameters(value: Optional[Dict[str, Any]]) -> str:
+    """The inverse of `parse_legacy_parameters`."""
+    if value is not None and list(value) == ["raw"]:
+        return value["raw"]
+    return str(value)
+
+
+def convert(table_name: str, old_types, new_types, to_parameters) -> None:
+    """Fills text_new/parameters_new from text/parameters for every row, BATCH_SIZE rows at a time."""
+    bind = op.get_bind()
+    keys = ["id", "generation_time"] if table_name == "responses" else ["id"]  # generation_time prunes partitions
+    source = sa.table(
+        table_name,
+        *(sa.column(key) for key in keys),
+        sa.column("text", old_types[0]),
+        sa.column("parameters", old_types[1]),
+    )
+    text_type, parameters_type = new_types
+    target = sa.table(
+        table_name,
+        *(sa.column(key) for key in keys),
+        sa.column("text_new", text_type),
+        sa.column("parameters_new", parameters_type),
+    )
+    update = (
+        target.update()
+        .where(*(target.c[key] == sa.bindparam("b_" + key) for key in keys))
+        .values(
+            text_new=sa.bindparam("b_text", type_=text_type),
+            parameters_new=sa.bindparam("b_parameters", type_=parameters_type),
+        )
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(source).where(source.c.id > last_id).order_by(source.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        bind.execute(update, [
+            {
+                **{"b_" + key: getattr(row, key) for key in keys},
+                "b_text": row.text,
+                "b_parameters": to_parameters(row.parameters),
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def swap_columns(table_name: str, old_types, new_types, to_parameters) -> None:
+    """Replaces the (text, parameters) columns of `old_types` by converted ones of `new_types`."""
+    with op.batch_alter_table(table_name) as batch:
+        batch.add_column(sa.Column("text_new", new_types[0]))
+        batch.add_column(sa.Column("parameters_new", new_types[1]))
+    convert(table_name, old_types, new_types, to_parameters)
+    with op.batch_alter_table(table_name) as batch:
+        batch.drop_column("text")
+        batch.drop_column("parameters")
+    with op.batch_alter_table(table_name) as batch:
+        batch.alter_column("text_new", new_column_name="text", nullable=False)
+        batch.alter_column("parameters_new", new_column_name="parameters")
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        raise RuntimeError("Revision 0004 converts rows in Python and cannot be rendered with --sql")
+    for table_name in ("prompts", "responses"):
+        swap_columns(table_name, (sa.String(), sa.String()), (CompressedText(), JSONDocument), parse_legacy_parameters)
+
+
+def downgrade() -> None:
+    if context.is_offline_mode():
+        raise RuntimeError("Revision 0004 converts rows in Python and cannot be rendered with --sql")
+    for table_name in ("prompts", "responses"):
+        swap_columns(table_name, (CompressedText(), JSONDocument), (sa.String(), sa.String()), legacy_parameters)
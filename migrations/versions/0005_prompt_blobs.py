@@ -0,0 +1,170 @@
+"""Content-addressed prompt bodies
+
+Prompt texts move to `prompt_blobs`, one row per distinct text keyed by its
+blake2b-256 hash. `prompts.text` is replaced by `prompts.blob_hash`. Existing
+prompts are converted in batches of BATCH_SIZE, walked by id, inside the
+migration's transaction (see 0004). It cannot be rendered offline (`--sql`).
+
+The text storage format and the hash are copied here from app.database.types as of
+this revision (see 0004) rather than imported.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-11-22 00:00:00
+
+"""
+import functools
+import hashlib
+import zlib
+from typing import Dict, Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+# First byte of a stored text: how the rest is encoded. The dictionary variants carry the
+# dictionary's 4-byte crc32 next.
+RAW, ZLIB, ZLIB_DICT, ZSTD, ZSTD_DICT = range(5)
+
+
+@functools.lru_cache(maxsize=None)
+def dictionaries() -> Dict[bytes, bytes]:
+    found = {}
+    for path in filter(None, (p.strip() for p in settings.TEXT_COMPRESSION_DICT.split(","))):
+        with open(path, "rb") as f:
+            dictionary = f.read()
+        found[zlib.crc32(dictionary).to_bytes(4, "big")] = dictionary
+    return found
+
+
+def encode_text(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if settings.TEXT_COMPRESSION != "none" and len(raw) >= settings.TEXT_COMPRESSION_MIN_BYTES:
+        body = zlib.compress(raw, min(settings.TEXT_COMPRESSION_LEVEL, 9))
+        if 1 + len(body) < len(raw):
+            return bytes([ZLIB]) + body
+    return bytes([RAW]) + raw
+
+
+def decode_text(stored: bytes) -> str:
+    tag, body = stored[0], stored[1:]
+    dictionary = None
+    if tag in (ZLIB_DICT, ZSTD_DICT):
+        dict_id, body = body[:4], body[4:]
+        if dict_id not in dictionaries():
+            raise ValueError(f"Text compressed with unknown dictionary {dict_id.hex()} (see TEXT_COMPRESSION_DICT)")
+        dictionary = dictionaries()[dict_id]
+    if tag == RAW:
+        return body.decode("utf-8")
+    if tag == ZLIB:
+        return zlib.decompress(body).decode("utf-8")
+    if tag == ZLIB_DICT:
+        decompressor = zlib.decompressobj(zdict=dictionary[-32768:])
+        return (decompressor.decompress(body) + decompressor.flush()).decode("utf-8")
+    if tag in (ZSTD, ZSTD_DICT):
+        import zstandard
+
+        params = {} if dictionary is None else {"dict_data": zstandard.ZstdCompressionDict(dictionary)}
+        return zstandard.ZstdDecompressor(**params).decompress(body).decode("utf-8")
+    raise ValueError(f"Unknown text encoding tag {tag}")
+
+
+class CompressedText(sa.TypeDecorator):
+    impl = sa.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else encode_text(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else decode_text(bytes(value))
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=32).digest()
+
+
+blobs = sa.table(
+    "prompt_blobs",
+    sa.column("hash", sa.LargeBinary()),
+    sa.column("text", CompressedText()),
+)
+
+
+def upsert_blobs(rows):
+    if op.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(blobs).values(rows).on_conflict_do_nothing(index_elements=["hash"])
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        raise RuntimeError("Revision 0005 converts rows in Python and cannot be rendered with --sql")
+    op.create_table(
+        "prompt_blobs",
+        sa.Column("hash", sa.LargeBinary(32), primary_key=True),
+        sa.Column("text", CompressedText(), nullable=False),
+    )
+    with op.batch_alter_table("prompts") as batch:
+        batch.add_column(sa.Column("blob_hash", sa.LargeBinary(32)))
+
+    bind = op.get_bind()
+    prompts = sa.table("prompts", sa.column("id"), sa.column("text", CompressedText()), sa.column("blob_hash"))
+    set_hash = prompts.update().where(prompts.c.id == sa.bindparam("b_id")).values(blob_hash=sa.bindparam("b_hash"))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(prompts.c.id, prompts.c.text).where(prompts.c.id > last_id).order_by(prompts.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        hashes = [content_hash(row.text) for row in rows]
+        texts = dict(zip(hashes, (row.text for row in rows)))
+        bind.execute(upsert_blobs([{"hash": digest, "text": texts[digest]} for digest in sorted(texts)]))
+        bind.execute(set_hash, [{"b_id": row.id, "b_hash": digest} for row, digest in zip(rows, hashes)])
+        last_id = rows[-1].id
+
+    with op.batch_alter_table("prompts") as batch:
+        batch.drop_column("text")
+        batch.alter_column("blob_hash", nullable=False, existing_type=sa.LargeBinary(32))
+        batch.create_foreign_key("fk_prompts_blob_hash", "prompt_blobs", ["blob_hash"], ["hash"])
+
+
+def downgrade() -> None:
+    if context.is_offline_mode():
+        raise RuntimeError("Revision 0005 converts rows in Python and cannot be rendered with --sql")
+    with op.batch_alter_table("prompts") as batch:
+        batch.add_column(sa.Column("text", CompressedText()))
+    bind = op.get_bind()
+    prompts = sa.table("prompts", sa.column("id"), sa.column("text", CompressedText()), sa.column("blob_hash"))
+    set_text = prompts.update().where(prompts.c.id == sa.bindparam("b_id")).values(text=sa.bindparam("b_text"))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(prompts.c.id, blobs.c.text)
+            .join(blobs, blobs.c.hash == prompts.c.blob_hash)
+            .where(prompts.c.id > last_id)
+            .order_by(prompts.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(set_text, [{"b_id": row.id, "b_text": row.text} for row in rows])
+        last_id = rows[-1].id
+    with op.batch_alter_table("prompts") as batch:
+        batch.drop_constraint("fk_prompts_blob_hash", type_="foreignkey")
+        batch.drop_column("blob_hash")
+        batch.alter_column("text", nullable=False)
+    op.drop_table("prompt_blobs")
@@ -0,0 +1,60 @@
+"""Conversations and their turns
+
+`conversations` holds a chat session (model, system prompt, running summary) and
+`conversation_turns` one row per exchange: the user message as a prompt and the reply
+with its response id. The id is a plain column, since partitioned `responses` cannot be
+the target of a foreign key on Postgres. The text columns hold app.database.types
+CompressedText values, which are plain binary columns to the database.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-11-29 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversations",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("system_prompt", sa.LargeBinary()),
+        sa.Column("summary", sa.LargeBinary()),
+        sa.Column("summarized_turns", sa.Integer(), nullable=False),
+        sa.Column("turn_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_conversations_id", "conversations", ["id"])
+    op.create_index("ix_conversations_user_id_id", "conversations", ["user_id", "id"])
+    op.create_table(
+        "conversation_turns",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id"), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.Column("prompt_id", sa.Integer(), sa.ForeignKey("prompts.id"), nullable=False),
+        sa.Column("response_id", sa.Integer()),
+        sa.Column("reply", sa.LargeBinary(), nullable=False),
+        sa.Column("prompt_tokens", sa.Integer(), nullable=False),
+        sa.Column("reply_tokens", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("conversation_id", "position", name="uq_conversation_turns_conversation_id_position"),
+    )
+    op.create_index("ix_conversation_turns_id", "conversation_turns", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("conversation_turns")
+    op.drop_index("ix_conversations_user_id_id", "conversations")
+    op.drop_table("conversations")
@@ -39,6 +39,11 @@ BACKEND_TIMEOUT=60
 # Set health check intervals (in seconds)
 HEALTH_CHECK_INTERVAL=5
 
+# Backend address and graceful stop budget (see gunicorn.conf.py)
+SERVER_BIND="${SERVER_BIND:-0.0.0.0:8000}"
+BACKEND_PORT="${SERVER_BIND##*:}"
+STOP_TIMEOUT=$(( ${SERVER_DRAIN_TIMEOUT:-30} + ${SERVER_SHUTDOWN_TIMEOUT:-15} + 5 ))
+
 # Utility functions
 log_info() {
   echo "$(date +"%Y-%m-%d %H:%M:%S") INFO: $*"
@@ -48,10 +53,28 @@ log_error() {
   echo "$(date +"%Y-%m-%d %H:%M:%S") ERROR: $*" >&2
 }
 
+stop_process() {
+  local pid="$1"
+  local waited=0
+  kill -TERM "$pid" 2>/dev/null || return 0
+  while kill -0 "$pid" 2>/dev/null && [[ "$waited" -lt "$STOP_TIMEOUT" ]]; do
+    sleep 1
+    waited=$((waited + 1))
+  done
+  if kill -0 "$pid" 2>/dev/null; then
+    log_error "Process $pid still running after $STOP_TIMEOUT seconds, killing it"
+    kill -9 "$pid"
+  fi
+}
+
 cleanup() {
   log_info "Cleaning up processes and files..."
+  # SIGTERM: the workers drain in-flight requests, then run the app's shutdown hooks
+  if [ -n "${BACKEND_PID:-}" ]; then
+    stop_process "$BACKEND_PID"
+  fi
   if [ -f "$PID_FILE" ]; then
-    kill -9 $(cat "$PID_FILE")
+    stop_process "$(cat "$PID_FILE")"
   fi
   rm -f "$PID_FILE"
   # ... (add any other cleanup steps if needed)
@@ -61,7 +84,7 @@ check_dependencies() {
   log_info "Checking for dependencies..."
   which psql || log_error "psql not found. Install PostgreSQL."
   which pg_ctl || log_error "pg_ctl not found. Install PostgreSQL."
-  which uvicorn || log_error "uvicorn not found. Install FastAPI."
+  which gunicorn || log_error "gunicorn not found. Install requirements.txt."
 }
 
 # Health check functions
@@ -104,10 +127,11 @@ start_database() {
 
 start_backend() {
   log_info "Starting backend server..."
-  nohup uvicorn main:app --host 0.0.0.0 --port 8000 &
-  wait_for_service 8000 "$BACKEND_TIMEOUT" "$HEALTH_CHECK_INTERVAL"
-  store_pid $(pgrep uvicorn)
-  log_info "Backend server started on http://localhost:8000"
+  # Workers per CPU, preloaded app, worker recycling and graceful drain: gunicorn.conf.py
+  gunicorn app.main:app &
+  BACKEND_PID=$!
+  wait_for_service "$BACKEND_PORT" "$BACKEND_TIMEOUT" "$HEALTH_CHECK_INTERVAL"
+  log_info "Backend server started on http://localhost:$BACKEND_PORT"
 }
 
 store_pid() {
@@ -120,9 +144,12 @@ check_dependencies
 if [[ "$DATABASE_URL" == *"postgresql"* ]]; then
   start_database
 fi
-start_backend
 
-# Trap exit signals
-trap cleanup EXIT ERR
+# Trap exit signals: stop the backend gracefully when this script is stopped or fails
+trap cleanup EXIT
+trap 'exit 0' INT TERM
+start_backend
 
-log_info "Application started successfully"
\ No newline at end of file
+log_info "Application started successfully"
+# Stay in the foreground so a supervisor's SIGTERM reaches cleanup
+wait "$BACKEND_PID"
\ No newline at end of file
@@ -5,7 +5,7 @@ from app.database import SessionLocal
 from app.config import settings
 from app.utils.auth import create_access_token
 from app.utils.logger import get_logger
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -32,13 +32,15 @@ def client():
 
 @pytest.fixture(scope="function")
 def mock_openai():
-    with patch("app.routers.responses.services.OpenAI") as mock_openai:
-        mock_openai.return_value.chat.completions.create.return_value = MagicMock(
-            choices=[
-                MagicMock(
-                    message=MagicMock(content="This is a mocked response")
-                )
-            ]
+    with patch("app.providers.openai_compatible.get_openai_client") as mock_openai:
+        mock_openai.return_value.chat.completions.create = AsyncMock(
+            return_value=MagicMock(
+                choices=[
+                    MagicMock(
+                        message=MagicMock(content="This is a mocked response")
+                    )
+                ]
+            )
         )
         yield mock_openai
 
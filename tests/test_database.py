@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from app.routers.prompts import models as prompt_models
 from app.routers.responses import models as response_models
@@ -5,12 +6,20 @@ from app.database import SessionLocal, engine
 from app.config import settings
 from app.utils.auth import create_access_token
 from app.utils.logger import get_logger
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
-from openai.error import OpenAIError
+from openai import OpenAIError
+from app.database.write_behind import ResponseWriter
+from app.database.partitions import add_months, create_partition_sql, plan_maintenance, upper_bound
+from app.database import types
+from app.database.types import TextCodec
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, select
 
 # Configure test environment
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL.replace("postgres://", "postgresql://")
@@ -34,13 +43,15 @@ def client():
 
 @pytest.fixture(scope="function")
 def mock_openai():
-    with patch("app.routers.responses.services.OpenAI") as mock_openai:
-        mock_openai.return_value.chat.completions.create.return_value = MagicMock(
-            choices=[
-                MagicMock(
-                    message=MagicMock(content="This is a mocked response")
-                )
-            ]
+    with patch("app.providers.openai_compatible.get_openai_client") as mock_openai:
+        mock_openai.return_value.chat.completions.create = AsyncMock(
+            return_value=MagicMock(
+                choices=[
+                    MagicMock(
+                        message=MagicMock(content="This is a mocked response")
+                    )
+                ]
+            )
         )
         yield mock_openai
 
@@ -186,4 +197,210 @@ def test_validate_response_valid_input():
 def test_validate_response_invalid_input():
     response_data = {"prompt": "My test prompt", "model": "invalid_model"}
     with pytest.raises(Exception):
-        validate_response(response_data)
\ No newline at end of file
+        validate_response(response_data)
+
+class RecordingSession:
+    def __init__(self, batches, delay=0.0, failures=None):
+        self.batches = batches
+        self.delay = delay
+        self.failures = failures  # Flush attempts left to fail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, rows):
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures.pop()
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(rows))
+
+    async def commit(self):
+        pass
+
+def _row(i):
+    return {"text": f"response {i}", "model": "text-davinci-003", "generation_time": datetime.utcnow()}
+
+def test_write_behind_flushes_full_batches():
+    batches = []
+    writer = ResponseWriter(max_queue=100, batch_size=5, flush_interval=10, put_timeout=1,
+                            session_factory=lambda: RecordingSession(batches))
+    async def run():
+        await writer.start()
+        for i in range(10):
+            await writer.submit(_row(i))
+        await asyncio.sleep(0.05)
+        assert [len(b) for b in batches] == [5, 5]
+        await writer.stop()
+    asyncio.run(run())
+    assert writer.stats()["flushed_rows"] == 10
+
+def test_write_behind_flushes_on_interval():
+    batches = []
+    writer = ResponseWriter(max_queue=100, batch_size=500, flush_interval=0.02, put_timeout=1,
+                            session_factory=lambda: RecordingSession(batches))
+    async def run():
+        await writer.start()
+        await writer.submit(_row(1))
+        await asyncio.sleep(0.1)
+        assert [len(b) for b in batches] == [1]
+        await writer.stop()
+    asyncio.run(run())
+
+def test_write_behind_stop_flushes_queued_rows():
+    batches = []
+    writer = ResponseWriter(max_queue=100, batch_size=500, flush_interval=60, put_timeout=1,
+                            session_factory=lambda: RecordingSession(batches))
+    async def run():
+        await writer.start()
+        for i in range(3):
+            await writer.submit(_row(i))
+        await writer.stop()
+    asyncio.run(run())
+    assert sum(len(b) for b in batches) == 3
+    assert writer.stats()["queue_depth"] == 0
+
+def test_write_behind_rejects_when_queue_is_full():
+    batches = []
+    writer = ResponseWriter(max_queue=1, batch_size=1, flush_interval=0, put_timeout=0.01,
+                            session_factory=lambda: RecordingSession(batches, delay=0.2))
+    async def run():
+        await writer.start()
+        await writer.submit(_row(1))  # Picked up by the (slow) flush
+        await asyncio.sleep(0.01)
+        await writer.submit(_row(2))  # Fills the queue
+        with pytest.raises(HTTPException) as exc:
+            await writer.submit(_row(3))
+        assert exc.value.status_code == 503
+        await writer.stop()
+    asyncio.run(run())
+    assert writer.stats()["rejected_rows"] == 1
+
+def test_write_behind_retries_failed_flushes_then_counts_dropped_rows():
+    batches, failures = [], [1, 1]
+    writer = ResponseWriter(max_queue=100, batch_size=2, flush_interval=60, put_timeout=1, max_attempts=3,
+                            retry_backoff=0.001, session_factory=lambda: RecordingSession(batches, failures=failures))
+    async def run():
+        await writer.start()
+        for i in range(2):
+            await writer.submit(_row(i))  # Written on the third attempt
+        await asyncio.sleep(0.05)
+        failures.extend([1, 1, 1])
+        for i in range(2, 4):
+            await writer.submit(_row(i))  # Every attempt fails
+        await writer.stop()
+    asyncio.run(run())
+    assert [len(b) for b in batches] == [2]
+    assert writer.stats()["retries"] == 4
+    assert writer.stats()["dropped_rows"] == 2
+
+
+def _bound(start, end):
+    return f"FOR VALUES FROM ('{start}') TO ('{end}')"
+
+def test_add_months_wraps_years():
+    assert add_months(datetime(2024, 11, 1), 3) == datetime(2025, 2, 1)
+    assert add_months(datetime(2024, 1, 1), -1) == datetime(2023, 12, 1)
+
+def test_create_partition_sql_covers_one_month():
+    sql = create_partition_sql(datetime(2024, 12, 1))
+    assert "responses_p2024_12 PARTITION OF responses" in sql
+    assert "FROM ('2024-12-01 00:00:00') TO ('2025-01-01 00:00:00')" in sql
+
+def test_upper_bound_parses_partition_bounds():
+    assert upper_bound("FOR VALUES FROM (MINVALUE) TO ('2024-06-01 00:00:00')") == datetime(2024, 6, 1)
+    assert upper_bound("DEFAULT") is None
+
+def test_plan_maintenance_creates_missing_months_and_expires_old_partitions():
+    partitions = [
+        ("responses_legacy", "FOR VALUES FROM (MINVALUE) TO ('2024-03-01 00:00:00')"),
+        ("responses_p2024_03", _bound("2024-03-01 00:00:00", "2024-04-01 00:00:00")),
+        ("responses_p2024_04", _bound("2024-04-01 00:00:00", "2024-05-01 00:00:00")),
+        ("responses_p2024_05", _bound("2024-05-01 00:00:00", "2024-06-01 00:00:00")),
+    ]
+    missing, expired = plan_maintenance(partitions, datetime(2024, 5, 20), months_ahead=2, retention_months=1)
+    assert missing == [datetime(2024, 6, 1), datetime(2024, 7, 1)]
+    assert expired == ["responses_legacy", "responses_p2024_03"]
+    assert plan_maintenance(partitions, datetime(2024, 5, 20), months_ahead=0, retention_months=0) == ([], [])
+
+def test_migrations_build_the_model_schema_on_sqlite(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+    migrated = inspect(create_engine(url))
+    assert {index["name"] for index in migrated.get_indexes("responses")} >= {
+        "ix_responses_generation_time_id",
+        "ix_responses_model_generation_time_id",
+        "ix_responses_prompt_id_generation_time_id",
+    }
+    assert "token_count" in {column["name"] for column in migrated.get_columns("prompts")}
+    command.downgrade(config, "base")
+    assert not inspect(create_engine(url)).has_table("responses")
+
+
+@pytest.mark.parametrize("kind", ["zlib", "zstd", "none"])
+def test_text_codec_round_trips_and_only_compresses_large_values(kind):
+    if kind == "zstd":
+        pytest.importorskip("zstandard")
+    codec = TextCodec(kind, min_bytes=64)
+    large = "The quick brown fox jumps over the lazy dog. " * 50 + "\u00e9\u4e2d"
+    for value in ("", "short answer", large):
+        assert codec.decode(codec.encode(value)) == value
+    assert codec.encode("short answer") == b"\x00short answer"
+    assert len(codec.encode(large)) < len(large) // 4 or kind == "none"
+
+def test_text_codec_reads_values_written_with_a_rotated_dictionary():
+    old, new = b"answer text response " * 100, b"completely different words " * 100
+    text = "answer text response " * 20
+    written = TextCodec("zlib", min_bytes=16, dictionaries=[old]).encode(text)
+    assert TextCodec("zlib", min_bytes=16, dictionaries=[new, old]).decode(written) == text
+    with pytest.raises(ValueError):
+        TextCodec("zlib", min_bytes=16, dictionaries=[new]).decode(written)
+
+def test_migration_compresses_text_and_converts_parameters_to_json(tmp_path):
+    url = f"sqlite:///{tmp_path / 'convert.db'}"
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "0003")
+    legacy = create_engine(url)
+    long_text = "A long completion. " * 100
+    with legacy.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO prompts (id, text, model, parameters) VALUES (1, 'Hi', 'gpt-4', ?)",
+                             (str({"max_tokens": 100, "temperature": 0.5}),))
+        conn.exec_driver_sql("INSERT INTO responses (id, text, model, parameters, generation_time, prompt_id) "
+                             "VALUES (1, ?, 'gpt-4', 'None', '2024-05-01 00:00:00', 1)", (long_text,))
+    command.upgrade(config, "head")
+    with patch.object(types, "text_codec", TextCodec("zlib", min_bytes=256)):
+        with legacy.connect() as conn:
+            stored = conn.exec_driver_sql("SELECT text FROM responses").scalar()
+            assert isinstance(stored, bytes) and len(stored) < len(long_text) // 4
+            prompt = conn.execute(
+                select(prompt_models.PromptBlob.text, prompt_models.Prompt.parameters).join(prompt_models.Prompt.blob)
+            ).one()
+            response = conn.execute(response_models.Response.__table__.select()).one()
+    assert prompt.text == "Hi" and prompt.parameters == {"max_tokens": 100, "temperature": 0.5}
+    assert response.text == long_text and response.parameters is None
+
+def test_migration_moves_prompt_texts_to_shared_blobs(tmp_path):
+    url = f"sqlite:///{tmp_path / 'blobs.db'}"
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "0004")
+    legacy = create_engine(url)
+    with legacy.begin() as conn:
+        for prompt_id, text in enumerate(["Template A", "Template B", "Template A"], start=1):
+            conn.exec_driver_sql(
+                "INSERT INTO prompts (id, text, model) VALUES (?, ?, 'gpt-4')", (prompt_id, b"\x00" + text.encode())
+            )
+    command.upgrade(config, "head")
+    with legacy.connect() as conn:
+        blobs = conn.execute(select(prompt_models.PromptBlob.text).order_by(prompt_models.PromptBlob.text)).scalars().all()
+        texts = conn.execute(
+            select(prompt_models.PromptBlob.text).join(prompt_models.Prompt.blob).order_by(prompt_models.Prompt.id)
+        ).scalars().all()
+    assert blobs == ["Template A", "Template B"]
+    assert texts == ["Template A", "Template B", "Template A"]
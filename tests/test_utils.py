@@ -1,12 +1,34 @@
+import asyncio
+import time
+import json
+import logging
+import queue
+import random
 import pytest
-from app.utils.auth import create_access_token, verify_token
+import numpy as np
+from app.utils.auth import create_access_token, verify_token, authenticate_user, invalidate_user, Principal, TokenCache, token_cache
 from app.utils.error_handler import handle_exception
-from app.utils.logger import get_logger
+from app.utils import logger as app_logger
+from app.utils.logger import get_logger, discard_logging, JsonFormatter, SamplingFilter, DeferredQueueHandler, parse_sample_rates
 from app.utils.data_validation import validate_prompt, validate_response
-from unittest.mock import patch, MagicMock
+from app.utils.openai_client import init_openai_client, get_openai_client, close_openai_client
+from app.utils.cache import ResponseCache, TTLCache, request_key
+from app.utils.singleflight import SingleFlight
+from app.utils.rate_limit import RELEASE_SCRIPT, RateLimiter, TokenBucket
+from app.utils.resilience import ResilientCaller, CircuitBreaker, CircuitOpenError, DeadlineExceeded, backoff_delay
+from app.providers import EchoProvider, ProviderRegistry, build_registry
+from app.utils.metrics import MetricsMiddleware, REQUEST_LATENCY, ERRORS, LoopLagMonitor, StatsCollector, classify_exception, render_metrics
+from app.utils.tokenizer import Tokenizer, context_tokens, estimate, fit_request
+from app.utils.scheduler import Scheduler, remaining_budget, request_timeout, resolve_priority
+from app.utils.pagination import decode_cursor, encode_cursor
+from app.utils.semantic_cache import SemanticCache, namespace
+from app.utils.vector_index import HashingEmbedder, VectorIndex
+from app.utils.data_validation import ResponseRequest
+from unittest.mock import patch, MagicMock, AsyncMock
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from datetime import datetime
-from openai.error import OpenAIError
+from openai import OpenAIError
 from app.config import settings
 
 def test_create_access_token_valid_user():
@@ -86,4 +108,796 @@ def test_validate_response_valid_input():
 def test_validate_response_invalid_input():
     response_data = {"prompt": "My test prompt", "model": "invalid_model"}
     with pytest.raises(Exception):
-        validate_response(response_data)
\ No newline at end of file
+        validate_response(response_data)
+
+def test_openai_client_shared_between_calls():
+    async def run():
+        client = await init_openai_client()
+        assert get_openai_client() is client
+        assert await init_openai_client() is client
+        await close_openai_client()
+    asyncio.run(run())
+
+def test_openai_client_closed_on_shutdown():
+    async def run():
+        client = await init_openai_client()
+        await close_openai_client()
+        assert client._client.is_closed
+        assert get_openai_client() is not client
+        await close_openai_client()
+    asyncio.run(run())
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.store)
+
+    async def eval(self, script, numkeys, key, token):
+        if self.store.get(key) == token:
+            del self.store[key]
+            return 1
+        return 0
+
+    async def aclose(self):
+        pass
+
+def test_request_key_ignores_parameter_order():
+    first = ResponseRequest(prompt="Hi ", model="text-davinci-003", parameters={"a": 1, "b": 2})
+    second = ResponseRequest(prompt="Hi", model="text-davinci-003", parameters={"b": 2, "a": 1})
+    third = ResponseRequest(prompt="Hi", model="text-davinci-003", parameters={"a": 1, "b": 3})
+    assert request_key(first) == request_key(second)
+    assert request_key(first) != request_key(third)
+    with_context = ResponseRequest(prompt="Hi", model="text-davinci-003", parameters={"a": 1, "b": 2}, context=[{"role": "user", "content": "Yo"}])
+    assert request_key(with_context) != request_key(first)
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.evictions == 1
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(max_entries=2, ttl=10)
+    with patch("app.utils.cache.time.monotonic", return_value=100.0):
+        cache.set("a", 1)
+    with patch("app.utils.cache.time.monotonic", return_value=111.0):
+        assert cache.get("a") is None
+
+def test_response_cache_only_caches_deterministic_requests():
+    cache = ResponseCache(max_entries=10, ttl=60, use_redis=False)
+    assert cache.is_cacheable(ResponseRequest(prompt="Hi", model="text-davinci-003", temperature=0))
+    assert not cache.is_cacheable(ResponseRequest(prompt="Hi", model="text-davinci-003", temperature=0.5))
+    assert cache.is_cacheable(ResponseRequest(prompt="Hi", model="text-davinci-003", temperature=0.5, cache=True))
+    assert not cache.is_cacheable(ResponseRequest(prompt="Hi", model="text-davinci-003", temperature=0, cache=False))
+
+def test_response_cache_counts_hits_and_misses():
+    cache = ResponseCache(max_entries=10, ttl=60, use_redis=False)
+    async def run():
+        assert await cache.get("key") is None
+        await cache.set("key", {"text": "cached"})
+        assert await cache.get("key") == {"text": "cached"}
+    asyncio.run(run())
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_response_cache_reads_through_redis_tier():
+    redis = FakeRedis()
+    writer = ResponseCache(max_entries=10, ttl=60, redis=redis)
+    reader = ResponseCache(max_entries=10, ttl=60, redis=redis)
+    async def run():
+        await writer.set("key", {"text": "shared"})
+        assert await reader.get("key") == {"text": "shared"}
+        assert await reader.get("key") == {"text": "shared"}
+    asyncio.run(run())
+    assert reader.stats()["redis_hits"] == 1
+    assert reader.stats()["hits"] == 2
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight(use_redis=False)
+    calls = []
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "shared"
+    async def run():
+        return await asyncio.gather(*(flight.do("key", upstream) for _ in range(20)))
+    assert asyncio.run(run()) == ["shared"] * 20
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 19
+    assert flight.stats()["in_flight"] == 0
+
+def test_single_flight_propagates_errors_to_all_waiters():
+    flight = SingleFlight(use_redis=False)
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+    async def run():
+        return await asyncio.gather(*(flight.do("key", upstream) for _ in range(3)), return_exceptions=True)
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+def test_single_flight_cancelling_one_waiter_keeps_others():
+    flight = SingleFlight(use_redis=False)
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return "done"
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", upstream))
+        second = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "done"
+        assert first.cancelled()
+    asyncio.run(run())
+
+def test_single_flight_cancels_work_without_waiters():
+    flight = SingleFlight(use_redis=False)
+    cancelled = []
+    async def upstream():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    async def run():
+        waiter = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+    asyncio.run(run())
+    assert cancelled == [True]
+
+def test_single_flight_coalesces_across_workers_with_redis():
+    redis = FakeRedis()
+    workers = [SingleFlight(redis=redis, poll_interval=0.001) for _ in range(2)]
+    calls = []
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "shared"
+    async def run():
+        return await asyncio.gather(*(w.do("key", upstream) for w in workers))
+    assert asyncio.run(run()) == ["shared", "shared"]
+    assert len(calls) == 1
+    assert not any(k.startswith("singleflight:lock:") for k in redis.store)
+
+
+def test_single_flight_does_not_hand_a_finished_flight_to_the_next_one():
+    redis = FakeRedis()
+    first, second = SingleFlight(redis=redis, poll_interval=0.001), SingleFlight(redis=redis, poll_interval=0.001)
+    replies = iter(["first flight", "second flight"])
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        return next(replies)
+
+    async def run():
+        assert await first.do("key", upstream) == "first flight"
+        # The first flight's result is still published; the next flight must not be answered with it
+        return await asyncio.gather(first.do("key", upstream), second.do("key", upstream))
+
+    assert asyncio.run(run()) == ["second flight", "second flight"]
+
+
+def _auth_request(token):
+    return MagicMock(headers={"Authorization": f"Bearer {token}"})
+
+def test_authenticate_user_caches_verified_tokens():
+    token_cache.clear()
+    token = create_access_token(1)
+    with patch("app.utils.auth._load_principal", AsyncMock(return_value=Principal(id=1, username="alice"))) as load:
+        first = asyncio.run(authenticate_user(_auth_request(token)))
+        second = asyncio.run(authenticate_user(_auth_request(token)))
+    assert first == second == Principal(id=1, username="alice")
+    assert load.await_count == 1
+
+def test_invalidate_user_drops_cached_tokens():
+    token_cache.clear()
+    token = create_access_token(1)
+    with patch("app.utils.auth._load_principal", AsyncMock(return_value=Principal(id=1, username="alice"))) as load:
+        asyncio.run(authenticate_user(_auth_request(token)))
+        invalidate_user(1)
+        asyncio.run(authenticate_user(_auth_request(token)))
+    assert load.await_count == 2
+
+def test_zero_ttl_disables_the_token_cache():
+    cache = TokenCache(max_entries=10, ttl=0)
+    cache.set("token", Principal(id=1, username="alice"), exp=None)
+    assert cache.get("token") is None
+
+def test_token_cache_entry_expires_with_token():
+    cache = TokenCache(max_entries=10, ttl=300)
+    with patch("app.utils.auth.time.time", return_value=1000.0), \
+            patch("app.utils.cache.time.monotonic", return_value=50.0):
+        cache.set("token", Principal(id=1, username="alice"), exp=1010.0)
+    with patch("app.utils.cache.time.monotonic", return_value=59.0):
+        assert cache.get("token") == Principal(id=1, username="alice")
+    with patch("app.utils.cache.time.monotonic", return_value=61.0):
+        assert cache.get("token") is None
+
+
+def test_json_formatter_includes_extra_fields():
+    logger = logging.getLogger("test_json_formatter")
+    record = logger.makeRecord(logger.name, logging.INFO, __file__, 1, "Generated response: id=%s", (7,), None, extra={"model": "gpt-4"})
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Generated response: id=7"
+    assert entry["level"] == "INFO"
+    assert entry["model"] == "gpt-4"
+
+
+def test_sampling_filter_drops_sampled_levels_only():
+    sampler = SamplingFilter(parse_sample_rates("INFO=0, DEBUG=0.5"))
+    info = logging.makeLogRecord({"levelno": logging.INFO})
+    error = logging.makeLogRecord({"levelno": logging.ERROR})
+    assert not any(sampler.filter(info) for _ in range(100))
+    assert all(sampler.filter(error) for _ in range(100))
+
+
+def test_deferred_queue_handler_does_not_format_in_caller():
+    class Expensive:
+        formatted = 0
+
+        def __str__(self):
+            Expensive.formatted += 1
+            return "expensive"
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("test_deferred_queue_handler")
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    logger.propagate = False
+    logger.warning("value=%s", Expensive())
+    record = log_queue.get_nowait()
+    assert Expensive.formatted == 0
+    assert record.getMessage() == "value=expensive"
+
+
+def test_get_logger_configures_handlers_once():
+    assert get_logger() is get_logger()
+    assert len(get_logger().handlers) == 1
+
+
+def test_discard_logging_starts_a_new_listener_on_next_use():
+    get_logger()
+    inherited = app_logger._listener
+    discard_logging()
+    assert app_logger._listener is None and get_logger().handlers
+    assert app_logger._listener is not inherited
+    inherited.stop()
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.take(5)
+    bucket.refill(bucket.updated + 0.2)
+    assert bucket.level == pytest.approx(2)
+    assert bucket.wait_time(4) == pytest.approx(0.2)
+
+
+def test_rate_limiter_rejects_burst_with_retry_after():
+    limiter = RateLimiter(enabled=True, requests_per_minute=5, tokens_per_minute=0, max_in_flight=0, use_redis=False)
+
+    async def client(results):
+        try:
+            async with limiter.limit("user:1", "gpt-4", 10):
+                await asyncio.sleep(0)
+            results.append(200)
+        except HTTPException as e:
+            results.append(e.status_code)
+            assert int(e.headers["Retry-After"]) >= 1
+
+    async def burst():
+        results = []
+        await asyncio.gather(*(client(results) for _ in range(20)))
+        # Another user and another model have their own buckets
+        await limiter.acquire("user:2", "gpt-4", 10)
+        await limiter.acquire("user:1", "gpt-3.5-turbo", 10)
+        return results
+
+    results = asyncio.run(burst())
+    assert results.count(200) == 5
+    assert results.count(429) == 15
+
+
+def test_rate_limiter_caps_in_flight_requests_per_user():
+    limiter = RateLimiter(enabled=True, requests_per_minute=0, tokens_per_minute=0, max_in_flight=2, use_redis=False)
+
+    async def scenario():
+        await limiter.acquire("user:1", "gpt-4", 1)
+        await limiter.acquire("user:1", "gpt-4", 1)
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire("user:1", "gpt-4", 1)
+        assert exc.value.status_code == 429
+        await limiter.release("user:1")
+        await limiter.acquire("user:1", "gpt-4", 1)
+
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_releases_on_the_backend_that_admitted():
+    redis = MagicMock(eval=AsyncMock(side_effect=ConnectionError("down")))
+    limiter = RateLimiter(enabled=True, requests_per_minute=0, tokens_per_minute=0, max_in_flight=2, redis=redis)
+
+    async def scenario():
+        backend = await limiter.acquire("user:1", "gpt-4", 1)  # Redis is down: admitted locally
+        assert backend == "local" and limiter.stats()["in_flight"] == 1
+        redis.eval.side_effect, redis.eval.return_value = None, "0"  # Redis is back before the release
+        await limiter.release("user:1", backend)
+        assert limiter.stats()["in_flight"] == 0
+        assert redis.eval.await_count == 1  # Only the failed acquire
+        async with limiter.limit("user:1", "gpt-4", 1):
+            pass
+        redis.eval.assert_awaited_with(RELEASE_SCRIPT, 1, "rate-limit:user:1:in-flight")
+
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_token_budget_waits_when_allowed():
+    limiter = RateLimiter(enabled=True, requests_per_minute=0, tokens_per_minute=600, max_in_flight=0, use_redis=False)
+
+    async def scenario():
+        await limiter.acquire("user:1", "gpt-4", 600)
+        with pytest.raises(HTTPException):
+            await limiter.acquire("user:1", "gpt-4", 5)
+        start = time.monotonic()
+        await limiter.acquire("user:1", "gpt-4", 5, max_wait=2)  # 10 tokens/s refill
+        return time.monotonic() - start
+
+    assert 0.3 < asyncio.run(scenario()) < 2
+
+
+def test_backoff_delay_honors_retry_after():
+    assert 0 <= backoff_delay(3, base=0.1, cap=0.3) <= 0.3
+    assert backoff_delay(1, base=0.1, cap=0.3, retry_after=2) == 2
+
+
+def test_circuit_breaker_opens_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.before_call("gpt-4")
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("gpt-4")
+    time.sleep(0.06)
+    breaker.before_call("gpt-4")  # Half-open: one probe goes through
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("gpt-4")
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_resilient_caller_retries_transient_errors():
+    caller = ResilientCaller(max_attempts=3, backoff_base=0.01, backoff_max=0.01, deadline=5, hedge=False)
+    attempts = []
+
+    async def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise asyncio.TimeoutError()
+        return "ok"
+
+    assert asyncio.run(caller.call("gpt-4", flaky)) == "ok"
+    assert len(attempts) == 3
+    assert caller.retries == 2
+
+
+def test_resilient_caller_enforces_deadline():
+    caller = ResilientCaller(max_attempts=5, backoff_base=0.01, backoff_max=0.01, deadline=0.1, hedge=False)
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(caller.call("gpt-4", hang))
+    assert time.monotonic() - start < 1
+
+
+def test_short_client_budget_does_not_open_the_circuit():
+    caller = ResilientCaller(max_attempts=1, deadline=5, hedge=False, failure_threshold=1, reset_timeout=60)
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        token = request_timeout.set(0.05)  # As set by `Scheduler.slot` for `X-Request-Timeout: 0.05`
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await caller.call("gpt-4", hang, deadline=0.05)
+        finally:
+            request_timeout.reset(token)
+        assert caller.breaker("gpt-4").state == "closed"
+        with pytest.raises(DeadlineExceeded):
+            await caller.call("gpt-4", hang, deadline=0.05)  # The server's own budget: counts
+        assert caller.breaker("gpt-4").state == "open"
+
+    asyncio.run(scenario())
+
+
+def test_resilient_caller_hedges_slow_attempts():
+    caller = ResilientCaller(max_attempts=1, deadline=5, hedge=True, hedge_percentile=95, hedge_min_samples=1)
+    caller.latencies("gpt-4").add(0.02)
+    calls = []
+
+    async def first_slow(timeout):
+        calls.append(timeout)
+        await asyncio.sleep(1 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    start = time.monotonic()
+    assert asyncio.run(caller.call("gpt-4", first_slow)) == 2
+    assert time.monotonic() - start < 0.5
+    assert caller.hedges == 1
+
+
+def test_resilient_caller_against_fault_injecting_stub():
+    from openai import AsyncOpenAI
+    from benchmarks.stub_server import StubServer, create_stub_app
+
+    stub = create_stub_app(latency=0.01, retry_after=0)
+    caller = ResilientCaller(
+        max_attempts=3, backoff_base=0.01, backoff_max=0.02, deadline=5, hedge=False,
+        failure_threshold=3, reset_timeout=60,
+    )
+
+    async def scenario(base_url):
+        client = AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0)
+
+        def attempt(timeout):
+            return client.chat.completions.create(
+                model="gpt-4", messages=[{"role": "user", "content": "ping"}], timeout=timeout
+            )
+
+        try:
+            stub.state.script.extend([503, 502])
+            response = await caller.call("gpt-4", attempt)  # Two injected faults, then success
+            assert response.choices[0].message.content == "This is a stubbed response"
+            stub.state.script.extend([503, 503, 503])
+            with pytest.raises(Exception):
+                await caller.call("gpt-4", attempt)
+            requests = stub.state.stats.requests
+            with pytest.raises(CircuitOpenError):
+                await caller.call("gpt-4", attempt)
+            assert stub.state.stats.requests == requests  # Failed fast without calling upstream
+        finally:
+            await client.close()
+
+    with StubServer(stub, port=8771) as server:
+        asyncio.run(scenario(server.base_url))
+
+
+class FailingProvider(EchoProvider):
+    async def complete(self, request, timeout):
+        raise asyncio.TimeoutError()
+
+
+def test_registry_routes_to_fastest_backend():
+    registry = ProviderRegistry(caller=ResilientCaller(max_attempts=1, deadline=5, hedge=False))
+    slow, fast = EchoProvider("slow", latency=0.05), EchoProvider("fast", latency=0.001)
+    registry.register(slow, ["gpt-4"])
+    registry.register(fast, ["gpt-4"])
+    request = ResponseRequest(prompt="hello", model="gpt-4")
+
+    async def scenario():
+        for _ in range(3):  # Both backends get measured first
+            await registry.complete(request)
+        assert registry.routes("gpt-4")[0].provider is fast
+        assert registry.stats()["fast:gpt-4"]["p50_ms"] < registry.stats()["slow:gpt-4"]["p50_ms"]
+
+    asyncio.run(scenario())
+
+
+def test_registry_falls_back_to_next_backend():
+    registry = ProviderRegistry(caller=ResilientCaller(max_attempts=1, deadline=5, hedge=False))
+    registry.register(FailingProvider("broken"), ["gpt-4"], weight=10)
+    registry.register(EchoProvider("backup"), ["gpt-4"])
+    request = ResponseRequest(prompt="hello", model="gpt-4")
+    assert asyncio.run(registry.complete(request)) == "hello"
+    assert registry.error_rate(registry.routes("gpt-4")[-1].provider, "gpt-4") == 1.0
+
+
+def test_build_registry_from_settings_json():
+    registry = build_registry('[{"name": "local", "type": "echo", "models": ["tiny"], "weight": 2}]')
+    assert registry.models() == ["tiny"]
+    assert registry.routes("tiny")[0].weight == 2
+
+
+def test_build_registry_adds_the_echo_model_only_with_debug():
+    assert "echo" not in build_registry("", debug=False).models()
+    assert "echo" in build_registry("", debug=True).models()
+
+
+def test_response_request_rejects_unknown_model():
+    with pytest.raises(ValueError):
+        ResponseRequest(prompt="hello", model="no-such-model")
+
+
+def test_metrics_middleware_labels_by_route_template():
+    from fastapi import FastAPI
+
+    metrics_app = FastAPI()
+
+    @metrics_app.get("/items/{item_id}")
+    async def read_item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="Not found")
+        return {"id": item_id}
+
+    metrics_app.add_middleware(MetricsMiddleware)
+    client = TestClient(metrics_app)
+    ok = REQUEST_LATENCY.labels("GET", "/items/{item_id}", "200")
+    before = ok._sum.get(), ERRORS.labels("http", "/items/{item_id}")._value.get()
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/0")
+    assert ok._sum.get() > before[0]
+    assert ERRORS.labels("http", "/items/{item_id}")._value.get() == before[1] + 1
+
+
+def test_classify_exception_matches_error_handler_classes():
+    assert classify_exception(OpenAIError("boom")) == "openai"
+    assert classify_exception(HTTPException(status_code=429)) == "http"
+    assert classify_exception(ValueError()) == "unexpected"
+
+
+def test_stats_collector_exports_numeric_stats():
+    collector = StatsCollector("demo", lambda: {"hits": 3, "enabled": True, "circuits": {}})
+    families = list(collector.collect())
+    assert [family.name for family in families] == ["demo_hits"]
+    assert families[0].samples[0].value == 3
+
+
+def test_render_metrics_in_multiprocess_mode(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    with patch("app.utils.metrics._stats_collectors", [StatsCollector("demo", lambda: {"hits": 3})]):
+        body, _ = render_metrics()
+    # Only what the worker files hold (none here) and this worker's stats
+    assert b"demo_hits 3.0" in body
+    assert b"http_request_duration_seconds" not in body
+
+
+def test_app_import_time_within_budget():
+    from benchmarks.bench_startup import IMPORT_TIME_BUDGET, LAZY_DEPENDENCIES, fastest_import
+
+    total, modules = fastest_import("app.main", runs=3)
+    assert [name for name in LAZY_DEPENDENCIES if name in modules] == []
+    assert total < IMPORT_TIME_BUDGET, f"import app.main took {total:.2f}s"
+
+
+def test_tokenizer_caches_counts_per_prompt_hash():
+    counter = Tokenizer(kind="estimate", max_entries=10)
+    assert counter.count("Hello, world!", "gpt-4") == estimate("Hello, world!") == 4
+    counter.count("Hello, world!", "gpt-4")
+    assert (counter.hits, counter.misses) == (1, 1)
+
+
+def test_tokenizer_truncates_to_budget():
+    counter = Tokenizer(kind="estimate")
+    text = "word " * 1000
+    assert estimate(counter.truncate(text, "gpt-4", 100)) <= 100
+
+
+def test_fit_request_clamps_max_tokens_and_rejects_oversized_prompts():
+    request, prompt_tokens = fit_request(ResponseRequest(prompt="word " * 4000, model="gpt-4", max_tokens=8000))
+    assert request.max_tokens == 8192 - prompt_tokens
+    with pytest.raises(HTTPException) as exc:
+        fit_request(ResponseRequest(prompt="word " * 9000, model="gpt-4"), overflow="reject")
+    assert exc.value.status_code == 400
+    request, prompt_tokens = fit_request(ResponseRequest(prompt="word " * 9000, model="gpt-4"), overflow="truncate")
+    assert prompt_tokens <= 8192 - settings.MIN_COMPLETION_TOKENS
+    assert request.max_tokens == 8192 - prompt_tokens
+
+
+def test_fit_request_budgets_the_context():
+    context = [{"role": "user", "content": "word " * 3000}, {"role": "assistant", "content": "ok"}]
+    request = ResponseRequest(prompt="word " * 100, model="gpt-4", max_tokens=8000, context=context)
+    history_tokens = context_tokens(request)
+    assert history_tokens > 3000
+    request, prompt_tokens = fit_request(request)
+    assert request.max_tokens == 8192 - history_tokens - prompt_tokens
+    with pytest.raises(HTTPException):
+        fit_request(request.copy(update={"prompt": "word " * 5000}), overflow="reject")
+    with pytest.raises(HTTPException):  # Nothing left to truncate the prompt to
+        fit_request(request.copy(update={"context": context * 3}), overflow="truncate")
+
+
+def test_scheduler_serves_interactive_before_batch():
+    scheduler = Scheduler(max_concurrency=1, max_queue=10, enabled=True)
+    order = []
+
+    async def job(name, priority):
+        async with scheduler.slot("gpt-4", priority, timeout=5):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        first = asyncio.ensure_future(job("first", "interactive"))
+        await asyncio.sleep(0)
+        background = asyncio.ensure_future(job("background", "background"))
+        batch = asyncio.ensure_future(job("batch", "batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(job("interactive", "interactive"))
+        await asyncio.gather(first, background, batch, interactive)
+
+    asyncio.run(scenario())
+    assert order == ["first", "interactive", "batch", "background"]
+
+
+def test_scheduler_sheds_requests_that_cannot_meet_their_deadline():
+    scheduler = Scheduler(max_concurrency=1, max_queue=10, enabled=True)
+
+    async def scenario():
+        async with scheduler.slot("gpt-4", "interactive", timeout=5):
+            await asyncio.sleep(0.05)  # Teaches the scheduler a ~50ms service time
+        async with scheduler.slot("gpt-4", "interactive", timeout=5):
+            assert remaining_budget(60) <= 5
+            with pytest.raises(HTTPException) as exc:
+                async with scheduler.slot("gpt-4", "interactive", timeout=0.06):
+                    pass
+            assert exc.value.status_code == 503
+            assert exc.value.headers["Retry-After"] == "1"
+        assert scheduler.stats() == {"queued": 0, "active": 0, "shed": 1}
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_bounds_the_queue():
+    scheduler = Scheduler(max_concurrency=1, max_queue=1, enabled=True)
+
+    async def hold(seconds):
+        async with scheduler.slot("gpt-4", "batch", timeout=5):
+            await asyncio.sleep(seconds)
+
+    async def scenario():
+        running = asyncio.ensure_future(hold(0.05))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(hold(0))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException):
+            await hold(0)
+        await asyncio.gather(running, queued)
+
+    asyncio.run(scenario())
+
+
+def test_priority_header_can_only_lower_the_class():
+    assert resolve_priority(None, "background") == "background"
+    assert resolve_priority(None, "interactive", default="batch") == "batch"
+    assert resolve_priority(Principal(id=1, username="u"), None) == "interactive"
+
+
+def test_hashing_embedder_scores_rephrasings_above_unrelated_prompts():
+    embedder = HashingEmbedder(dim=256)
+    base = embedder.embed_sync("What is the capital of France?")
+    rephrased = embedder.embed_sync("what is   the capital of france")
+    other = embedder.embed_sync("Write a haiku about autumn leaves")
+    assert float(base @ rephrased) > 0.95
+    assert float(base @ other) < 0.5
+
+
+def test_semantic_namespace_separates_models_and_sampling_parameters():
+    request = ResponseRequest(prompt="Hi", model="gpt-4", temperature=0)
+    assert namespace(request) == namespace(request.copy(update={"prompt": "Hello"}))
+    assert namespace(request) != namespace(request.copy(update={"model": "gpt-3.5-turbo"}))
+    assert namespace(request) != namespace(request.copy(update={"max_tokens": 10}))
+
+
+def test_vector_index_evicts_least_recently_used_entries():
+    embedder = HashingEmbedder(dim=64)
+    index = VectorIndex(dim=64, max_entries=3, nlist=4, nprobe=1)
+    for i, text in enumerate(["alpha beta", "gamma delta", "epsilon zeta"]):
+        index.add(embedder.embed_sync(text), "m", i)
+    index.search(embedder.embed_sync("alpha beta"), "m")  # Touch entry 0
+    index.add(embedder.embed_sync("eta theta"), "m", 3)
+    assert len(index) == 3 and index.evictions == 1
+    assert sorted(index.ids[index.spaces >= 0].tolist()) == [0, 2, 3]
+
+
+def test_vector_index_trained_search_finds_the_nearest_vector(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((2000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = VectorIndex(dim=32, max_entries=4000, nlist=8, nprobe=8)
+    index.add_many(vectors, "m", np.arange(2000))
+    assert index.needs_training()
+    index.apply_training(index.train())
+    assert not index.needs_training()
+    assert index.search(vectors[123], "m")[:1] == (123,)
+    assert index.search(vectors[123], "other") is None
+
+    path = str(tmp_path / "index.npz")
+    index.save(path, "hashing")
+    restored = VectorIndex(dim=32, max_entries=4000, nlist=8, nprobe=8)
+    assert restored.load(path, "hashing")
+    assert len(restored) == 2000 and restored.centroids is not None
+    assert restored.search(vectors[7], "m")[0] == 7
+    assert not VectorIndex(dim=32).load(path, "openai")
+
+
+def test_semantic_cache_answers_near_duplicate_prompts():
+    cache = SemanticCache(enabled=True, threshold=0.9, embedder="hashing", dim=256, max_entries=100, path="")
+    stored = MagicMock(id=42)
+    db = MagicMock(get=AsyncMock(return_value=stored))
+    request = ResponseRequest(prompt="Explain the theory of relativity simply.", model="gpt-4", temperature=0)
+
+    async def scenario():
+        assert await cache.lookup(db, request, object) is None
+        await cache.add(request, 42)
+        rephrased = request.copy(update={"prompt": "explain the theory of relativity simply"})
+        assert await cache.lookup(db, rephrased, object) is stored
+        unrelated = request.copy(update={"prompt": "List three prime numbers."})
+        assert await cache.lookup(db, unrelated, object) is None
+        db.get.return_value = None  # Row deleted since it was indexed
+        assert await cache.lookup(db, rephrased, object) is None
+
+    asyncio.run(scenario())
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 0, "evictions": 0}
+
+
+def test_cursor_round_trips_sort_keys():
+    key = [datetime(2024, 5, 1, 12, 30), 42]
+    assert decode_cursor(encode_cursor(key), [datetime, int]) == key
+    assert decode_cursor(None, [int]) is None
+
+
+@pytest.mark.parametrize("cursor", ["%%%", "bm90IGpzb24", encode_cursor([1, 2]), encode_cursor(["x"])])
+def test_decode_cursor_rejects_malformed_cursors(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, [int])
+    assert exc.value.status_code == 400
+
+
+def test_loop_lag_monitor_records_blocking_stretches():
+    monitor = LoopLagMonitor(interval=0.01)
+
+    async def scenario():
+        await monitor.start()
+        await asyncio.sleep(0.03)
+        time.sleep(0.1)  # Blocks the loop past the pending timer
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.samples >= 2
+    assert monitor.stats()["max_seconds"] >= 0.05
+
+
+def test_stub_latency_distributions_keep_the_mean():
+    from benchmarks.stub_server import sample_latency
+
+    random.seed(0)
+    for distribution in ("uniform", "exponential", "lognormal"):
+        samples = [sample_latency(0.1, distribution, sigma=1.0) for _ in range(20000)]
+        assert min(samples) >= 0
+        assert abs(sum(samples) / len(samples) - 0.1) < 0.01
+    assert sample_latency(0.1) == 0.1
+    with pytest.raises(ValueError):
+        sample_latency(0.1, "normal")
+
+
+def test_load_report_histogram_quantile_interpolates_like_prometheus():
+    from benchmarks.bench_load import compare, histogram_quantile
+
+    buckets = {0.01: 50.0, 0.1: 90.0, 1.0: 100.0, float("inf"): 100.0}
+    assert histogram_quantile(buckets, 0.5) == pytest.approx(0.01)
+    assert histogram_quantile(buckets, 0.7) == pytest.approx(0.055)
+    assert histogram_quantile({0.01: 0.0, float("inf"): 0.0}, 0.5) is None
+    assert histogram_quantile({0.01: 0.0, float("inf"): 4.0}, 0.99) == 0.01  # Past the last bound
+    lines = compare({"config": {"rps": 1}, "latency_ms": {"p99": 100.0}}, {"latency_ms": {"p99": 150.0}, "ok": 3})
+    assert len(lines) == 2 and "+50.0%" in lines[0]